@@ -1,6 +1,12 @@
+import hashlib
+import warnings
+from collections import OrderedDict
 import numpy as np
 from numpy import diag, dot
 from numpy.linalg import pinv
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
 
 # Utility
 def normalize(array, axis=None):
@@ -18,7 +24,7 @@ def clip(array, tol=1e-6):
     ret[np.abs(ret) < tol] = 0
     return ret 
 
-def as_op_matrix(x):
+def as_op_matrix(x, ns):
     """Convert scalar, vector, or matrix to operator matrix for state-dependent
     parameters.
     """
@@ -32,21 +38,197 @@ def as_op_matrix(x):
         raise ValueError("Invalid dimension for parameter:", np.ndim(x))
     return ret
 
+parameter_matrix = as_op_matrix
+
+def as_diagonal(x, ns):
+    """Convert a scalar or vector state-dependent parameter to the diagonal of
+    its operator matrix, leaving matrices (which have no such form) as-is.
+    """
+    if np.ndim(x) <= 1:
+        return np.broadcast_to(np.asarray(x, dtype=float), (ns,))
+    elif np.ndim(x) == 2:
+        return x
+    raise ValueError("Invalid dimension for parameter:", np.ndim(x))
+
+def issparse(mat):
+    return scipy.sparse.issparse(mat)
+
+def _dense(x):
+    return x.toarray() if issparse(x) else np.asarray(x)
+
+def _right_multiply(P, g):
+    """Compute `P @ G`, where `g` is the diagonal of `G` (or `G` itself)."""
+    if np.ndim(g) == 2:
+        return P @ g
+    elif issparse(P):
+        return P @ scipy.sparse.diags(g)
+    return P * g
+
+def _product(G, L):
+    """The product of two parameters, as returned by `as_diagonal`."""
+    if np.ndim(G) == 1 and np.ndim(L) == 1:
+        return G * L
+    return as_op_matrix(G, len(G)) @ as_op_matrix(L, len(L))
+
+def _weight_rows(w, X):
+    """Compute `diag(w) @ X`."""
+    if issparse(X):
+        return scipy.sparse.diags(w) @ X
+    return w[:, None] * X
+
+def _identity(P):
+    if issparse(P):
+        return scipy.sparse.identity(P.shape[0], format='csc')
+    return np.eye(len(P))
+
+
+class Factorization:
+    """An LU factorization of a square (dense or sparse) matrix, which can be
+    used to solve systems involving the matrix or its transpose.
+
+    If the matrix is singular (e.g., `I - P` for gamma and lambda of one),
+    its pseudoinverse is used instead, giving the minimum-norm solutions.
+    """
+    def __init__(self, mat):
+        self.sparse = issparse(mat)
+        self.pinv = None
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', scipy.linalg.LinAlgWarning)
+                if self.sparse:
+                    self.lu = scipy.sparse.linalg.splu(
+                        scipy.sparse.csc_matrix(mat))
+                else:
+                    self.lu = scipy.linalg.lu_factor(mat)
+        except (RuntimeError, scipy.linalg.LinAlgWarning):
+            self.pinv = pinv(_dense(mat))
+
+    def solve(self, b, trans=False):
+        """Solve `A x = b` (or `A.T x = b` if `trans` is true)."""
+        b = _dense(b)
+        if self.pinv is not None:
+            return (self.pinv.T if trans else self.pinv) @ b
+        if self.sparse:
+            return self.lu.solve(b, trans='T' if trans else 'N')
+        return scipy.linalg.lu_solve(self.lu, b, trans=1 if trans else 0)
+
 # MDPs
-def stationary(mat):
-    """Compute the stationary distribution for transition matrix `mat`, via 
-    c omputing the solution to the system of equations (P.T - I)*\pi = 0. 
-        
+def content_hash(mat):
+    """A digest of the contents of a (dense or sparse) matrix, for caching
+    results computed from it.
+    """
+    h = hashlib.sha1()
+    if issparse(mat):
+        mat = scipy.sparse.csr_matrix(mat, copy=True)
+        mat.sum_duplicates()
+        parts = (mat.indptr, mat.indices, mat.data)
+        h.update(b'sparse')
+    else:
+        parts = (np.ascontiguousarray(mat),)
+    h.update(repr(mat.shape).encode())
+    for arr in parts:
+        h.update(arr.dtype.str.encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+# stationary distributions by (content hash, method, tol), most recent last
+_stationary_cache = OrderedDict()
+STATIONARY_CACHE_SIZE = 32
+
+def stationary(mat, method='auto', tol=1e-10, max_iter=100000):
+    """Compute the stationary distribution for transition matrix `mat`.
+
+    Results are memoized by the contents of `mat`, so the distribution is only
+    computed once for a given transition matrix, however many solutions
+    (e.g., for different values of gamma and lambda) require it.
+
     NB: Assumes `mat` is ergodic (aperiodic and irreducible).
+
+    Args:
+      mat : The transition matrix (dense or sparse).
+      method (optional): One of 'solve' (a direct solution to the system of
+        equations (P.T - I)*pi = 0), 'power' (power iteration), 'eigs' (a
+        Krylov solve for the leading eigenvector of P.T), or 'auto', which
+        solves directly for dense matrices and uses 'eigs' for sparse ones.
+      tol (optional): The convergence tolerance for the iterative methods.
+      max_iter (optional): The maximum number of iterations.
+
+    Returns:
+      d: The stationary distribution.
+    """
+    if method == 'auto':
+        method = 'eigs' if issparse(mat) else 'solve'
+    key = (content_hash(mat), method, tol)
+    if key in _stationary_cache:
+        _stationary_cache.move_to_end(key)
+        return _stationary_cache[key].copy()
+
+    if method == 'solve':
+        d = _stationary_solve(mat)
+    elif method == 'power':
+        d = _stationary_power(mat, tol, max_iter)
+    elif method == 'eigs':
+        try:
+            d = _stationary_eigs(mat, tol, max_iter)
+        except scipy.sparse.linalg.ArpackNoConvergence:
+            d = _stationary_solve(mat)
+    else:
+        raise ValueError("Unknown method:", method)
+
+    _stationary_cache[key] = d
+    while len(_stationary_cache) > STATIONARY_CACHE_SIZE:
+        _stationary_cache.popitem(last=False)
+    return d.copy()
+
+def _stationary_solve(mat):
+    """Solve (P.T - I)*pi = 0 directly, with the components summing to one.
+
     Could do with LU factorization -- c.f. 54-14 in Handbook of Linear Algebra
     """
-    P = (np.copy(mat).T - np.eye(len(mat)))
-    P[-1,:] = 1
-    b = np.zeros(len(mat))
-    b[-1] = 1
-    x = np.linalg.solve(P, b)
+    ns = mat.shape[0]
+    if issparse(mat):
+        # rather than adding a (dense) row of ones, fix the component of a
+        # likely state to one, chosen by a few steps of power iteration
+        x = _stationary_power(mat, tol=0, max_iter=100)
+        k = np.argmax(x)
+        keep = np.arange(ns) != k
+        P = (mat.T - scipy.sparse.identity(ns)).tocsc()
+        x = np.ones(ns)
+        x[keep] = scipy.sparse.linalg.spsolve(P[keep][:, keep],
+                                              -_dense(P[keep][:, k]).ravel())
+    else:
+        P = (np.copy(mat).T - np.eye(len(mat)))
+        P[-1,:] = 1
+        b = np.zeros(ns)
+        b[-1] = 1
+        x = np.linalg.solve(P, b)
     return normalize(x)
 
+def _stationary_power(mat, tol, max_iter):
+    """Power iteration, until successive iterates differ by less than `tol`
+    (in the L1 norm). The lazy chain (I + P)/2 is iterated, which has the same
+    stationary distribution but cannot be periodic.
+    """
+    PT = mat.T.tocsr() if issparse(mat) else np.asarray(mat).T
+    x = np.full(mat.shape[0], 1/mat.shape[0])
+    for i in range(max_iter):
+        x_next = 0.5*(x + PT @ x)
+        if np.sum(np.abs(x_next - x)) < tol:
+            return normalize(x_next)
+        x = x_next
+    return normalize(x)
+
+def _stationary_eigs(mat, tol, max_iter):
+    """Find the eigenvector of P.T with eigenvalue one using ARPACK."""
+    ns = mat.shape[0]
+    if ns < 3:
+        return _stationary_solve(mat)
+    PT = mat.T.tocsr() if issparse(mat) else np.asarray(mat).T
+    vals, vecs = scipy.sparse.linalg.eigs(PT, k=1, which='LM', tol=tol,
+                                          maxiter=max_iter,
+                                          v0=np.full(ns, 1/ns))
+    return normalize(np.abs(np.real(vecs[:, 0])))
+
 def rmse(a, b, weight=None):
     if weight is None:
     	weight = 1.0
@@ -56,11 +238,23 @@ def rmse(a, b, weight=None):
 # Solutions
 ###############################################################################
 
+def _solve_weighted(X, w, K, Y, r):
+    """Solve for the fixed point `A theta = b`, with `A = X.T W K^{-1} Y` and
+    `b = X.T W K^{-1} r`, where `W = diag(w)` and `K` is a `Factorization`.
+
+    The columns of `Y` and `r` are solved for together, using `K` once.
+    """
+    Z = K.solve(np.column_stack([_dense(Y), r]))
+    WZ = w[:, None] * Z
+    A = _dense(X.T @ WZ[:, :-1])
+    b = _dense(X.T @ WZ[:, -1])
+    return np.linalg.lstsq(A, b, rcond=None)[0]
+
 def ls_solver(P, r, X, gm, d=None):
     """Compute the least-squares solution for an MDP under LFA.
 
     Args:
-      P : The transition matrix under a given policy.
+      P : The transition matrix under a given policy (dense or sparse).
       r : The expected immediate reward for each state under the policy.
       X : The feature matrix (one row for each state)
       gm : The discount parameter, gamma
@@ -69,30 +263,28 @@ def ls_solver(P, r, X, gm, d=None):
     Returns:
       theta: the weight vector found by the TD solution.
     """
-    ns = len(P) # number of states
-    I = np.eye(ns)
+    ns = P.shape[0] # number of states
     # TODO: Check for validity of P, r, X (size and values)
     # TODO: Provide a way to handle terminal states
 
     # account for scalar, vector, or matrix parameters
-    G = parameter_matrix(gm)
+    G = as_diagonal(gm, ns)
 
     # compute the stationary distribution if unspecified
     if d is None:
         d = stationary(P)
-    # the stationary distribution as a matrix
-    D = np.diag(d)
 
-    # Solve the equation
-    A = X.T @ D @ X
-    b = X.T @ D @ pinv(I - P @ G) @ r
-    return pinv(A) @ b
+    # Solve the equation, with the true values from a single linear solve
+    v = Factorization(_identity(P) - _right_multiply(P, G)).solve(r)
+    A = _dense(X.T @ _weight_rows(d, X))
+    b = _dense(X.T @ (d * v))
+    return np.linalg.lstsq(A, b, rcond=None)[0]
 
 def td_solver(P, r, X, gm, lm, d=None):
     """Compute the TD solution for an MDP under linear function approximation.
 
     Args:
-      P : The transition matrix under a given policy.
+      P : The transition matrix under a given policy (dense or sparse).
       r : The expected immediate reward for each state under the policy.
       X : The feature matrix (one row for each state)
       gm : The discount parameter, gamma
@@ -102,31 +294,30 @@ def td_solver(P, r, X, gm, lm, d=None):
     Returns:
       theta: the weight vector found by the TD solution.
     """
-    ns = len(P) # number of states
-    I = np.eye(ns)
+    ns = P.shape[0] # number of states
+    I = _identity(P)
     # TODO: Check for validity of P, r, X (size and values)
     # TODO: Provide a way to handle terminal states
 
     # account for scalar, vector, or matrix parameters
-    G = parameter_matrix(gm)
-    L = parameter_matrix(lm)
+    G = as_diagonal(gm, ns)
+    L = as_diagonal(lm, ns)
+    GL = _product(G, L)
 
     # compute the stationary distribution if unspecified
     if d is None:
         d = stationary(P)
-    # the stationary distribution as a matrix
-    D = np.diag(d)
 
-    # Solve the equation
-    A = X.T @ D @ pinv(I - P @ G @ L) @ (I - P @ G) @ X
-    b = X.T @ D @ pinv(I - P @ G @ L) @ r
-    return pinv(A) @ b
+    # Solve the equation, factorizing (I - P G L) once for every term
+    K = Factorization(I - _right_multiply(P, GL))
+    Y = (I - _right_multiply(P, G)) @ X
+    return _solve_weighted(X, d, K, Y, r)
 
 def etd_solver(P, r, X, gm, lm, interest, d_pi=None, d_mu=None):
     """Compute the ETD solution for an MDP under linear function approximation.
 
     Args:
-      P : The transition matrix under a given policy.
+      P : The transition matrix under a given policy (dense or sparse).
       r : The expected immediate reward for each state under the policy.
       X : The feature matrix (one row for each state)
       gm : The discount parameter, gamma
@@ -137,15 +328,16 @@ def etd_solver(P, r, X, gm, lm, interest, d_pi=None, d_mu=None):
     Returns:
       theta: the weight vector found by the ETD solution.
     """
-    ns = len(P) # number of states
-    I = np.eye(ns)
+    ns = P.shape[0] # number of states
+    I = _identity(P)
     # TODO: Check for validity of P, r, X (size and values)
     # TODO: Provide a way to handle terminal states
 
     # account for scalar, vector, or matrix parameters
-    G = parameter_matrix(gm)
-    L = parameter_matrix(lm)
-    N = parameter_matrix(interest)
+    G = as_diagonal(gm, ns)
+    L = as_diagonal(lm, ns)
+    N = as_diagonal(interest, ns)
+    GL = _product(G, L)
 
     # compute the stationary distribution if unspecified
     if d_pi is None:
@@ -153,21 +345,198 @@ def etd_solver(P, r, X, gm, lm, interest, d_pi=None, d_mu=None):
     if d_mu is None:
         d_mu = d_pi
 
-    # compute the "warp" matrix (P_{\pi,\gamma,\lambda})
-    P_lm = I - pinv(I - P @ G @ L) @ (I - P @ G)
+    # the "warp" matrix is P_{\pi,\gamma,\lambda} = I - K^{-1} (I - P G),
+    # with K = (I - P G L), so (I - P_lm)^{-1} = (I - P G)^{-1} K
+    I_PG = I - _right_multiply(P, G)
+    I_PGL = I - _right_multiply(P, GL)
+    K = Factorization(I_PGL)
 
-    # compute the interest weighted distribution and emphasis trace
-    d_i = np.dot(N, d_mu)
-    m = d_i @ pinv(I - P_lm)
-    M = np.diag(m)
+    # compute the interest weighted distribution and emphasis trace, via
+    # m = d_i^T (I - P G)^{-1} K, i.e., by solving with (I - P G)^T
+    d_i = N @ d_mu if np.ndim(N) == 2 else N * d_mu
+    m = _dense(I_PGL.T @ Factorization(I_PG).solve(d_i, trans=True))
 
     # Solve the equation
-    A = X.T @ M @ pinv(I - P @ G @ L) @ (I - P @ G) @ X
-    b = X.T @ M @ pinv(I - P @ G @ L) @ r
-    return pinv(A) @ b
+    Y = I_PG @ X
+    return _solve_weighted(X, m, K, Y, r)
 
+# Batched solutions
+###############################################################################
+
+def spectral_decomposition(P, tol=1e-8, max_cond=1e6):
+    """Compute the eigendecomposition `P = V diag(lam) V^{-1}`.
+
+    For non-normal `P` the eigenvectors may be nearly parallel, and errors in
+    solutions computed in the eigenbasis are amplified by the condition number
+    of `V`, so the decomposition is only used if it is below `max_cond`.
+
+    Returns:
+      (lam, V, Vinv), or `None` if `P` is sparse or not (numerically)
+      diagonalizable, in which case solutions must be found by factorization.
+    """
+    if issparse(P):
+        return None
+    P = np.asarray(P)
+    try:
+        lam, V = np.linalg.eig(P)
+        if not np.linalg.cond(V) < max_cond:
+            return None
+        Vinv = np.linalg.inv(V)
+    except np.linalg.LinAlgError:
+        return None
+    err = np.max(np.abs((V * lam) @ Vinv - P))
+    if not np.isfinite(err) or err > tol:
+        return None
+    return lam, V, Vinv
+
+def _resolvable(lam, cs, tol=1e-10):
+    """Whether `(I - c P)` is nonsingular for each `c` in `cs`, given the
+    eigenvalues `lam` of `P` (otherwise, factorizations are needed to find
+    pseudoinverse solutions).
+    """
+    return np.min(np.abs(1 - np.outer(cs, lam)), initial=np.inf) > tol
 
+def _grid(gm, lm):
+    """Broadcast the (scalar) gamma and lambda values of a grid together."""
+    gm, lm = np.broadcast_arrays(np.asarray(gm, dtype=float),
+                                 np.asarray(lm, dtype=float))
+    return gm.shape, gm.ravel(), lm.ravel()
 
+def _batch(solve, X, shape):
+    """Apply `solve` to one feature matrix or each of a list of them,
+    returning arrays of solutions of shape `shape + (num_features,)`.
+    """
+    if isinstance(X, (list, tuple)):
+        return [solve(x).reshape(shape + (x.shape[1],)) for x in X]
+    return solve(X).reshape(shape + (X.shape[1],))
+
+def _lstsq(A, b):
+    return np.linalg.lstsq(np.real(A), np.real(b), rcond=None)[0]
+
+def td_solver_batch(P, r, X, gm, lm, d=None, spectral=True):
+    """Compute TD solutions for a grid of (gamma, lambda) values at once.
+
+    With an eigendecomposition of `P`, each resolvent (I - c P)^{-1} is
+    diagonal in the eigenbasis, so the matrix work is shared by every point
+    of the grid, and each point costs only O(|S| k^2) for k features. If `P`
+    is sparse or not diagonalizable (or its eigenvectors are ill-conditioned,
+    see `spectral_decomposition`), or (I - P G L) is singular for some point,
+    (I - P G L) is factorized once for each distinct value of gamma*lambda
+    instead.
+
+    Args:
+      P : The transition matrix under a given policy (dense or sparse).
+      r : The expected immediate reward for each state under the policy.
+      X : The feature matrix, or a list of feature matrices.
+      gm : Array of (constant) values of gamma.
+      lm : Array of (constant) values of lambda, broadcast against `gm`, e.g.
+        `gm[:, None]` and `lm[None, :]` for every combination.
+      d (optional): The stationary distribution to use.
+      spectral (optional): Whether to use the eigendecomposition of `P`.
 
+    Returns:
+      theta: The solutions, with shape `broadcast(gm, lm).shape + (k,)` (or
+        a list of these, for a list of feature matrices).
+    """
+    shape, gms, lms = _grid(gm, lm)
+    if d is None:
+        d = stationary(P)
+    eig = spectral_decomposition(P) if spectral else None
+    if eig is not None and not _resolvable(eig[0], gms*lms):
+        eig = None
+
+    if eig is not None:
+        lam, V, Vinv = eig
+        wr = Vinv @ r
+        def solve(X):
+            X = _dense(X)
+            W = Vinv @ X
+            XDV = (X.T * d) @ V
+            ret = np.empty((len(gms), X.shape[1]))
+            for i, (g, l) in enumerate(zip(gms, lms)):
+                denom = 1 - g*l*lam
+                A = XDV @ (((1 - g*lam)/denom)[:, None] * W)
+                b = XDV @ (wr/denom)
+                ret[i] = _lstsq(A, b)
+            return ret
+    else:
+        I = _identity(P)
+        factors = {}
+        def solve(X):
+            PX = P @ X
+            ret = np.empty((len(gms), X.shape[1]))
+            for i, (g, l) in enumerate(zip(gms, lms)):
+                if g*l not in factors:
+                    factors[g*l] = Factorization(I - g*l*P)
+                ret[i] = _solve_weighted(X, d, factors[g*l], X - g*PX, r)
+            return ret
+    return _batch(solve, X, shape)
+
+def etd_solver_batch(P, r, X, gm, lm, interest, d_pi=None, d_mu=None,
+                     spectral=True):
+    """Compute ETD solutions for a grid of (gamma, lambda) values at once.
+
+    As for `td_solver_batch`, the eigendecomposition of `P` (or else the
+    factorizations of (I - P G L) and (I - P G) for each distinct value of
+    gamma*lambda and gamma) is shared by every point of the grid.
 
+    Args:
+      P : The transition matrix under a given policy (dense or sparse).
+      r : The expected immediate reward for each state under the policy.
+      X : The feature matrix, or a list of feature matrices.
+      gm : Array of (constant) values of gamma.
+      lm : Array of (constant) values of lambda, broadcast against `gm`.
+      interest: The interest parameter.
+      d_pi, d_mu (optional): The stationary distributions to use.
+      spectral (optional): Whether to use the eigendecomposition of `P`.
 
+    Returns:
+      theta: The solutions, with shape `broadcast(gm, lm).shape + (k,)` (or
+        a list of these, for a list of feature matrices).
+    """
+    shape, gms, lms = _grid(gm, lm)
+    ns = P.shape[0]
+    if d_pi is None:
+        d_pi = stationary(P)
+    if d_mu is None:
+        d_mu = d_pi
+    N = as_diagonal(interest, ns)
+    d_i = N @ d_mu if np.ndim(N) == 2 else N * d_mu
+    eig = spectral_decomposition(P) if spectral else None
+    if eig is not None and not _resolvable(eig[0], np.r_[gms*lms, gms]):
+        eig = None
+
+    if eig is not None:
+        lam, V, Vinv = eig
+        wr = Vinv @ r
+        ui = V.T @ d_i
+        # the emphasis for each point, m = d_i^T (I - P G)^{-1} (I - P G L)
+        ms = np.real(Vinv.T @ (ui[:, None] * (1 - np.outer(lam, gms*lms)) /
+                               (1 - np.outer(lam, gms))))
+        def solve(X):
+            X = _dense(X)
+            W = Vinv @ X
+            ret = np.empty((len(gms), X.shape[1]))
+            for i, (g, l) in enumerate(zip(gms, lms)):
+                XMV = (X.T * ms[:, i]) @ V
+                denom = 1 - g*l*lam
+                A = XMV @ (((1 - g*lam)/denom)[:, None] * W)
+                b = XMV @ (wr/denom)
+                ret[i] = _lstsq(A, b)
+            return ret
+    else:
+        I = _identity(P)
+        factors = {}
+        def factor(c):
+            if c not in factors:
+                factors[c] = Factorization(I - c*P)
+            return factors[c]
+        ms = [_dense((I - g*l*P).T @ factor(g).solve(d_i, trans=True))
+              for g, l in zip(gms, lms)]
+        def solve(X):
+            PX = P @ X
+            ret = np.empty((len(gms), X.shape[1]))
+            for i, (g, l) in enumerate(zip(gms, lms)):
+                ret[i] = _solve_weighted(X, ms[i], factor(g*l), X - g*PX, r)
+            return ret
+    return _batch(solve, X, shape)
@@ -6,14 +6,133 @@ parameters, feature function, and potentially the target and behavior policies
 into a single object.
 """
 import numpy as np
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+import features
 import parametric
+import policy
+
+
+# number of states for which an agent keeps importance sampling ratios
+RHO_CACHE_SIZE = 2**16
+
+
+class UpdatePlan:
+    """The arguments for an algorithm's update, compiled once from the
+    agent's parameter functions so that each step only evaluates those that
+    vary.
+
+    Constant parameters are stored in a template argument list, parameters
+    that look up the state (or next state) in a dictionary or array are
+    evaluated via a bound `__getitem__`, and other parameter functions are
+    called with `(s, a, sp)`. The importance sampling ratio `rho` is supplied
+    by the agent on each step, and takes precedence over any parameter
+    function.
+
+    Args:
+        names: The algorithm's update parameters, in order (`update_params`).
+        param_funcs: A dictionary of `Parameter` instances.
+    """
+    def __init__(self, names, param_funcs):
+        self.names = list(names)
+        self.index = {k: i for i, k in enumerate(self.names)}
+        self.template = [None]*len(self.names)
+        self.on_state, self.on_next, self.general = [], [], []
+        self.rho_index = self.index.get('rho')
+        self.missing = []
+        for i, k in enumerate(self.names):
+            func = param_funcs.get(k)
+            if k == 'rho':
+                continue
+            elif func is None:
+                self.missing.append(k)
+            elif isinstance(func, parametric.Constant):
+                self.template[i] = func.value
+            elif type(func) is parametric.MapState:
+                self.on_state.append((i, func.data.__getitem__))
+            elif type(func) is parametric.MapNextState:
+                self.on_next.append((i, func.data.__getitem__))
+            elif type(func) is parametric.ArrayState:
+                self.on_state.append((i, func.__getitem__))
+            elif type(func) is parametric.ArrayNextState:
+                self.on_next.append((i, func.__getitem__))
+            else:
+                self.general.append((i, func))
 
+    @property
+    def needs_rho(self):
+        return self.rho_index is not None
+
+    def __call__(self, s, a, sp, rho=1, params=None):
+        """The arguments to pass to the algorithm's update for the transition
+        `(s, a, sp)`, with the values in `params` overriding the parameters.
+        """
+        args = self.template.copy()
+        for i, get in self.on_state:
+            args[i] = get(s)
+        for i, get in self.on_next:
+            args[i] = get(sp)
+        for i, func in self.general:
+            args[i] = func(s, a, sp)
+        if self.rho_index is not None:
+            args[self.rho_index] = rho
+        if params:
+            for k, v in params.items():
+                i = self.index.get(k)
+                if i is not None:
+                    args[i] = v
+        for k in self.missing:
+            if not params or k not in params:
+                raise KeyError(k)
+        return args
+
+
+class ValueMixin:
+    """Methods for computing the values of sets of states from the weights
+    `theta`, using the feature matrices of a `features.FeatureCache` held as
+    `self.cache` (with `self._bound` initially `None`).
+    """
+    def bind(self, env):
+        """Precompute the feature matrix for the environment's states, so that
+        `values()` can evaluate all of them with a single matrix product.
+        """
+        self.states = list(env.states)
+        self._bound = self.cache(self.states)
+
+    def values(self, states=None):
+        """Compute the values for the given states as an array (with a column
+        for each member of a bank of learners), defaulting to the states of
+        the environment bound with `bind`.
+        """
+        if states is not None:
+            _, X = self.cache(states)
+        elif self._bound is not None:
+            _, X = self._bound
+        else:
+            raise ValueError("No states given, and not bound to an "
+                             "environment (see `bind`)")
+        return X @ np.transpose(self.theta)
 
-class OnPolicyAgent:
-    """An agent designed for on-policy experiments."""
-    def __init__(self, algo, behavior, phi=None, update_params=dict()):
+    def get_values(self, states):
+        """Compute the values for each of the given states."""
+        states = list(states)
+        return dict(zip(states, self.values(states)))
+
+
+class OnPolicyAgent(ValueMixin):
+    """An agent designed for on-policy experiments.
+
+    If `rng` (a `np.random.Generator` or seed) is given, actions are selected
+    using the agent's own random number stream created from it, leaving the
+    behavior policy (which may be shared with other agents) untouched;
+    otherwise, the behavior policy selects actions with its own stream.
+    """
+    def __init__(self, algo, behavior, phi=None, update_params=dict(),
+                 rng=None):
         self.algo = algo
         self.behavior = behavior
+        self.uniform = None if rng is None else policy.UniformStream(rng)
 
         # set the feature function
         if phi is None:
@@ -21,9 +140,15 @@ class OnPolicyAgent:
         else:
             self.phi = phi
 
-        # default parameters to use for updating
+        # default parameters to use for updating, and the plan for evaluating
+        # them and arranging them as arguments to the algorithm's update
         self.param_funcs = {k: parametric.to_parameter(v)
                             for k, v in update_params.items()}
+        self.plan = UpdatePlan(algo.update_params, self.param_funcs)
+
+        # feature matrices for computing the values of sets of states
+        self.cache = features.FeatureCache(self.phi)
+        self._bound = None
 
         # in the on-policy setting, `rho` is always equal to one.
         self.rho = 1
@@ -40,10 +165,17 @@ class OnPolicyAgent:
             The action the agent chose.
         """
         # choose the action according to behavior policy
-        action = self.behavior.choose(s, actions)
-        return action
-
-    def update(self, s, a, r, sp, **params):
+        if self.uniform is None:
+            return self.behavior.choose(s, actions)
+        mu = self.behavior
+        if isinstance(mu, policy.CompiledPolicy):
+            return mu.actions[mu.sample_index(mu.state_index[s],
+                                              self.uniform())]
+        actions = list(actions)
+        return actions[policy.sample(mu.probabilities(s, actions),
+                                     self.uniform())]
+
+    def update(self, s, a, r, sp, x=None, xp=None, **params):
         """ Update the agent from the experience it received.
 
         Uses `self.rho` which will be accurate if the agent's `choose` method
@@ -53,23 +185,22 @@ class OnPolicyAgent:
             s: The state at the beginning of the transition.
             r: The reward, a result of the transition (`s`, `a`, `sp`).
             sp: The new state, a result of action `a` in state `s`.
+            x (optional): The features of `s`, if already computed.
+            xp (optional): The features of `sp`, if already computed.
             **params: Any additional parameters needed to make the update.
 
         Note: The parameters in `**params` override the defaults set during the
         agent's initialization, and are assumed to be numeric, not callables.
         """
-        # determine the state dependent update params
-        update_params = {k: v(s, a, sp) for k, v in self.param_funcs.items()}
-        # specify rho from previous invocation of `choice`
-        update_params['rho'] = self.rho
-        # override parameter values as necessary
-        update_params.update(**params)
-        # determine args to pass to algorithm update
-        args = [update_params[k] for k in self.algo.update_params]
+        # determine args to pass to algorithm update, with `rho` from the
+        # previous invocation of `choice`, overriding values as necessary
+        args = self.plan(s, a, sp, self.rho, params)
 
-        # function approximation
-        x = self.phi(s)
-        xp = self.phi(sp)
+        # function approximation, unless the features were given
+        if x is None:
+            x = self.phi(s)
+        if xp is None:
+            xp = self.phi(sp)
 
         # update
         self.algo.update(x, r, xp, *args)
@@ -83,24 +214,37 @@ class OnPolicyAgent:
 
     def predict(self, s):
         """Compute/predict the value for state `s`."""
-        return np.dot(self.theta, self.phi(s))
-
-    def get_values(self, states):
-        """Compute the values for each of the given states."""
-        theta = self.theta
-        return {s: np.dot(theta, self.phi(s)) for s in states}
+        return features.dot(self.theta, self.phi(s))
 
     def reset(self):
         """Call the learning algorithm's reset method."""
         self.algo.reset()
 
 
-class OffPolicyAgent:
-    """An agent designed for off-policy experiments."""
-    def __init__(self, algo, target, behavior, phi=None, update_params=dict()):
+class OffPolicyAgent(ValueMixin):
+    """An agent designed for off-policy experiments.
+
+    Actions are selected using the agent's own random number stream, created
+    from `rng` (a `np.random.Generator` or seed), if given.
+
+    When both the target and behavior policies are stationary, the behavior
+    policy's distribution and the importance sampling ratios for each state
+    are computed only once, and recomputed only if either policy is modified.
+    If the behavior policy is a `CompiledPolicy`, they are precomputed as a
+    dense `rho[s, a]` table; otherwise, those of the `RHO_CACHE_SIZE` most
+    recently visited states are kept.
+    """
+    def __init__(self, algo, target, behavior, phi=None, update_params=dict(),
+                 rng=None):
         self.algo = algo
         self.target = target
         self.behavior = behavior
+        self.uniform = policy.UniformStream(rng)
+
+        # precomputed importance sampling ratios, for stationary policies
+        self._rho_versions = None
+        self._rho_table = None
+        self._rho_cache = OrderedDict()
 
         # set the feature function
         if phi is None:
@@ -108,9 +252,15 @@ class OffPolicyAgent:
         else:
             self.phi = phi
 
-        # default parameters to use for updating
+        # default parameters to use for updating, and the plan for evaluating
+        # them and arranging them as arguments to the algorithm's update
         self.param_funcs = {k: parametric.to_parameter(v)
                             for k, v in update_params.items()}
+        self.plan = UpdatePlan(algo.update_params, self.param_funcs)
+
+        # feature matrices for computing the values of sets of states
+        self.cache = features.FeatureCache(self.phi)
+        self._bound = None
 
     def choose(self, s, actions):
         """ Select an action from possible actions in response to state `s`,
@@ -124,16 +274,63 @@ class OffPolicyAgent:
         Returns:
             The action the agent chose.
         """
+        if self.target.stationary and self.behavior.stationary:
+            return self._choose_stationary(s, actions)
         # get the action probabilities for target policy and behavior policy
         prob_pi = self.target.probabilities(s, actions)
         prob_mu = self.behavior.probabilities(s, actions)
         # choose the action according to behavior policy
-        action = np.random.choice(actions, p=prob_mu)
+        i = policy.sample(prob_mu, self.uniform())
         # compute the importance sampling ratio
-        self.rho = prob_pi[action]/prob_mu[action]
-        return action
-
-    def update(self, s, a, r, sp, **params):
+        self.rho = prob_pi[i]/prob_mu[i]
+        return list(actions)[i]
+
+    def _choose_stationary(self, s, actions):
+        """Select an action using precomputed distributions and ratios."""
+        versions = (self.target.version, self.behavior.version)
+        if versions != self._rho_versions:
+            self._precompute_rho()
+            self._rho_versions = versions
+
+        # dense table, with sampling via the behavior policy's alias tables
+        if self._rho_table is not None:
+            i = self.behavior.state_index[s]
+            j = self.behavior.sample_index(i, self.uniform())
+            self.rho = self._rho_table[i][j]
+            return self.behavior.actions[j]
+
+        # otherwise, compute the distribution and ratios on the first visit
+        # (or the first since the state dropped out of the cache)
+        key = (s, tuple(actions))
+        entry = self._rho_cache.get(key)
+        if entry is None:
+            prob_pi = self.target.probabilities(s, actions)
+            prob_mu = self.behavior.probabilities(s, actions)
+            rho = [p/m if m > 0 else 0.0 for p, m in zip(prob_pi, prob_mu)]
+            entry = (list(accumulate(prob_mu)), rho, list(actions))
+            self._rho_cache[key] = entry
+            if len(self._rho_cache) > RHO_CACHE_SIZE:
+                self._rho_cache.popitem(last=False)
+        else:
+            self._rho_cache.move_to_end(key)
+        cdf, rho, actions = entry
+        i = min(bisect_right(cdf, self.uniform()*cdf[-1]), len(cdf) - 1)
+        self.rho = rho[i]
+        return actions[i]
+
+    def _precompute_rho(self):
+        """Compute the importance sampling ratios for stationary policies."""
+        self._rho_cache = OrderedDict()
+        self._rho_table = None
+        mu = self.behavior
+        if isinstance(mu, policy.CompiledPolicy):
+            pi = np.array([self.target.probabilities(s, mu.actions)
+                           for s in mu.states], dtype=float)
+            rho = np.zeros_like(mu.probs)
+            np.divide(pi, mu.probs, out=rho, where=mu.probs > 0)
+            self._rho_table = rho.tolist()
+
+    def update(self, s, a, r, sp, x=None, xp=None, **params):
         """ Update the agent from the experience it received.
 
         Uses `self.rho` which will be accurate if the agent's `choose` method
@@ -143,23 +340,22 @@ class OffPolicyAgent:
             s: The state at the beginning of the transition.
             r: The reward, a result of the transition (`s`, `a`, `sp`).
             sp: The new state, a result of action `a` in state `s`.
+            x (optional): The features of `s`, if already computed.
+            xp (optional): The features of `sp`, if already computed.
             **params: Any additional parameters needed to make the update.
 
         Note: The parameters in `**params` override the defaults set during the
         agent's initialization, and are assumed to be numeric, not callables.
         """
-        # determine the state dependent update params
-        update_params = {k: v(s, a, sp) for k, v in self.param_funcs.items()}
-        # specify rho from previous invocation of `choice`
-        update_params['rho'] = self.rho
-        # override parameter values as necessary
-        update_params.update(**params)
-        # determine args to pass to algorithm update
-        args = [update_params[k] for k in self.algo.update_params]
+        # determine args to pass to algorithm update, with `rho` from the
+        # previous invocation of `choice`, overriding values as necessary
+        args = self.plan(s, a, sp, self.rho, params)
 
-        # function approximation
-        x = self.phi(s)
-        xp = self.phi(sp)
+        # function approximation, unless the features were given
+        if x is None:
+            x = self.phi(s)
+        if xp is None:
+            xp = self.phi(sp)
 
         # update
         self.algo.update(x, r, xp, *args)
@@ -206,42 +402,67 @@ class OffPolicyAgent:
 
     def predict(self, s):
         """Compute/predict the value for state `s`."""
-        return np.dot(self.theta, self.phi(s))
-
-    def get_values(self, states):
-        """Compute the values for each of the given states."""
-        theta = self.theta
-        return {s: np.dot(theta, self.phi(s)) for s in states}
+        return features.dot(self.theta, self.phi(s))
 
     def reset(self):
         """Call the learning algorithm's reset method."""
         self.algo.reset()
 
 
-class HordeAgent:
-    def __init__(self, algo, pol, phi, update_params=dict()):
+class HordeAgent(ValueMixin):
+    """An agent learning about policy `pol`, as one member of a Horde.
+
+    If the experience is generated by a different `behavior` policy, the
+    importance sampling ratio for each transition is computed from the
+    probabilities the two policies give the action taken, which requires the
+    available actions to be passed to `update` (or found via `bind`).
+    Otherwise, the agent is assumed to be on-policy (so `rho` is one).
+
+    See `horde.Horde` for learning many predictions at once.
+    """
+    def __init__(self, algo, pol, phi, update_params=dict(), behavior=None):
         self.algo = algo
         self.pol = pol
+        self.behavior = behavior
+        self._get_actions = None
         if phi is None:
             self.phi = lambda x: x
         else:
             self.phi = phi
-        # default parameter functions to use for updates
+        # default parameter functions to use for updates, and the plan for
+        # evaluating them and arranging them as arguments to the update
         self.param_funcs = {k: parametric.to_parameter(v)
                             for k, v in update_params.items()}
-
-    def update(self, s, a, r, sp, **params):
-        # determine the state dependent update params
-        update_params = {k: v(s, a, sp) for k, v in self.param_funcs.items()}
-        # compute the action selection probability ratio
-        update_params['rho'] = 1 #TODO: This is wrong
-        update_params.update(**params)
+        self.plan = UpdatePlan(algo.update_params, self.param_funcs)
+
+        # feature matrices for computing the values of sets of states
+        self.cache = features.FeatureCache(self.phi)
+        self._bound = None
+
+    def ratio(self, s, a, actions=None):
+        """The importance sampling ratio for taking action `a` in state `s`."""
+        if self.behavior is None:
+            return 1.0
+        if actions is None:
+            if self._get_actions is None:
+                raise ValueError("Available actions are needed to compute rho")
+            actions = self._get_actions(s)
+        return (policy.action_probability(self.pol, s, a, actions) /
+                policy.action_probability(self.behavior, s, a, actions))
+
+    def update(self, s, a, r, sp, actions=None, x=None, xp=None, **params):
+        # compute the action selection probability ratio, if it is needed
+        rho = 1.0
+        if self.plan.needs_rho and 'rho' not in params:
+            rho = self.ratio(s, a, actions)
         # get the arguments to pass to the function
-        args = [update_params[k] for k in self.algo.update_params]
+        args = self.plan(s, a, sp, rho, params)
 
-        # function approximation
-        x = self.phi(s)
-        xp = self.phi(sp)
+        # function approximation, unless the features were given
+        if x is None:
+            x = self.phi(s)
+        if xp is None:
+            xp = self.phi(sp)
 
         return self.algo.update(x, r, xp, *args)
 
@@ -249,10 +470,12 @@ class HordeAgent:
     def theta(self):
         return self.algo.theta
 
-    def get_values(self, states):
-        """Compute the values for each of the given states."""
-        theta = self.theta
-        return {s: np.dot(theta, self.phi(s)) for s in states}
+    def bind(self, env):
+        """Precompute the feature matrix for the environment's states, and use
+        the environment to find the available actions when computing `rho`.
+        """
+        super().bind(env)
+        self._get_actions = env.get_actions
 
     def reset(self):
         self.algo.reset()
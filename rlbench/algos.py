@@ -1,11 +1,86 @@
 import inspect
 import numpy as np
+from features import ActiveFeatures
 
 
 # Provide a registry of available algorithms
 algo_registry = {}
 
 
+def param_grid(**axes):
+    """Enumerate every combination of the supplied parameter values.
+
+    Returns a dictionary mapping each parameter name to a flat array, such that
+    the `k`-th entry of each array gives the `k`-th point of the grid. The
+    result can be passed directly to one of the "bank" algorithms, e.g.:
+
+        TDBank(n, **param_grid(alpha=[0.1, 0.01], lm=[0.0, 0.5, 0.9]))
+    """
+    names = list(axes.keys())
+    mesh = np.meshgrid(*[np.ravel(axes[k]) for k in names], indexing='ij')
+    return {k: np.ravel(v) for k, v in zip(names, mesh)}
+
+
+def _stack_params(*params):
+    """Broadcast per-member parameters to a common length `K`."""
+    arrays = [np.atleast_1d(np.asarray(p, dtype=float)).ravel() for p in params]
+    return [np.array(v) for v in np.broadcast_arrays(*arrays)]
+
+
+def _col(v):
+    """Reshape a scalar or length `K` array so it broadcasts over rows."""
+    return np.reshape(v, (-1, 1))
+
+
+# Trace entries smaller than this in magnitude are zeroed and dropped from the
+# support, so that the sparse updates stay proportional to the active features
+TRACE_TOL = 1e-12
+
+
+def _trace(z, support, decay, x, scale=1, tol=TRACE_TOL):
+    """Compute `z = decay*z + scale*x` in place, for sparse features `x`.
+
+    Only the entries of `z` in `support` (those which may be nonzero, or all of
+    them if `support` is None) are touched. Entries of the support which have
+    decayed below `tol` in magnitude are set to zero and dropped. Returns the
+    new support.
+    """
+    if decay == 0:
+        if support is None:
+            z[:] = 0
+        else:
+            z[support] = 0
+        support = x.indices
+    elif support is None:
+        z *= decay
+    else:
+        z[support] *= decay
+        support = np.union1d(support, x.indices)
+    z[x.indices] += scale*x.weights
+    if support is not None and tol > 0:
+        keep = np.abs(z[support]) >= tol
+        if not keep.all():
+            z[support[~keep]] = 0
+            support = support[keep]
+    return support
+
+
+def _trace_add(w, c, z, support):
+    """Compute `w += c*z` in place, touching only the support of `z`."""
+    if support is None:
+        w += c*z
+    else:
+        w[support] += c*z[support]
+
+
+def _combine(x, c, y):
+    """Return the indices and values of `x + c*y`, for sparse `x` and `y`."""
+    indices = np.concatenate([x.indices, y.indices])
+    values = np.concatenate([x.weights, c*y.weights])
+    indices, inverse = np.unique(indices, return_inverse=True)
+    return indices, np.bincount(inverse, weights=values, minlength=len(indices))
+
+
 class MetaAlgo(type):
     # TODO: Documentation
     def __new__(meta, name, bases, attrs):
@@ -52,44 +127,144 @@ class TD(Algo):
         self.reset()
 
     def reset(self):
-        self.theta = np.zeros(n)
+        self.theta = np.zeros(self.n)
         self.z = np.zeros(self.n)
         self.old_rho = 0
+        self._support = np.zeros(0, dtype=np.intp)  # nonzero entries of `z`
 
     def update(self, x, r, xp, alpha, gm, gm_p, lm, rho):
         # TODO: Documentation
         # TODO: Compare updates from Geist 2014 vs. Precup, Sutton, & Singh 2000
+        if isinstance(x, ActiveFeatures):
+            return self._update_sparse(x, r, xp, alpha, gm, gm_p, lm, rho)
         self.z = x + gm*lm*self.old_rho*self.z
         delta = r + gm*rho*np.dot(self.theta, xp) - np.dot(self.theta, x)
         self.theta += alpha*delta*self.z
 
         # prepare for next iteration
         self.old_rho = rho
+        self._support = None
+
+    def _update_sparse(self, x, r, xp, alpha, gm, gm_p, lm, rho):
+        self._support = _trace(self.z, self._support, gm*lm*self.old_rho, x)
+        delta = r + gm*rho*xp.dot(self.theta) - x.dot(self.theta)
+        _trace_add(self.theta, alpha*delta, self.z, self._support)
+
+        # prepare for next iteration
+        self.old_rho = rho
 
 
 class LSTD(Algo):
-    def __init__(self, n, epsilon=1e-6, **kwargs):
+    """Least-squares TD, or LSTD(λ).
+
+    The solution `theta` is cached, and recomputed only once `solve_every`
+    updates have been made since it was last computed.
+    """
+    def __init__(self, n, epsilon=1e-6, solve_every=1, **kwargs):
         self.n  = n                         # number of features
+        self.epsilon = epsilon              # regularization for `A`
+        self.solve_every = solve_every      # updates between solutions
         self.reset()
 
     def reset(self):
         self.z  = np.zeros(self.n)               # traces
-        self.A  = np.eye(self.n) * epsilon     # A^-1 . b = theta^*
+        self.A  = np.eye(self.n) * self.epsilon  # A^-1 . b = theta^*
         self.b  = np.zeros(self.n)
         self.old_rho = 0
+        self._support = np.zeros(0, dtype=np.intp)  # nonzero entries of `z`
+
+        # cached solution and number of updates made since computing it
+        self._theta = None
+        self._stale = 0
 
     def update(self, x, r, xp, gm, gm_p, lm, rho):
+        if isinstance(x, ActiveFeatures):
+            return self._update_sparse(x, r, xp, gm, gm_p, lm, rho)
         self.z = x + gm*lm*self.old_rho*self.z
         self.A += np.outer(self.z, (x - gm_p*rho*xp))
         self.b += r*rho*self.z
 
         # prepare for next iteration
         self.old_rho = rho
+        self._support = None
+        self._stale += 1
+
+    def _update_sparse(self, x, r, xp, gm, gm_p, lm, rho):
+        self._support = _trace(self.z, self._support, gm*lm*self.old_rho, x)
+        vi, vv = _combine(x, -gm_p*rho, xp)
+        if self._support is None:
+            self.A[:, vi] += np.outer(self.z, vv)
+        else:
+            z = self.z[self._support]
+            self.A[np.ix_(self._support, vi)] += np.outer(z, vv)
+        _trace_add(self.b, r*rho, self.z, self._support)
+
+        # prepare for next iteration
+        self.old_rho = rho
+        self._stale += 1
+
+    def solve(self):
+        """Compute the solution from the current statistics."""
+        return np.dot(np.linalg.pinv(self.A), self.b)
 
     @property
     def theta(self):
-        return np.dot(np.linalg.pinv(self.A), self.b)
+        if self._theta is None or self._stale >= self.solve_every:
+            self._theta = self.solve()
+            self._stale = 0
+        return self._theta
+
+
+class RecursiveLSTD(LSTD):
+    """Recursive LSTD(λ), which maintains `A^-1` directly via Sherman-Morrison
+    rank-one updates, making each update (and solution) O(n^2) rather than the
+    O(n^3) required to invert `A`.
+    """
+    def reset(self):
+        self.z  = np.zeros(self.n)                   # traces
+        self.Ainv = np.eye(self.n) / self.epsilon    # A^-1 . b = theta^*
+        self.b  = np.zeros(self.n)
+        self.old_rho = 0
+        self._support = np.zeros(0, dtype=np.intp)  # nonzero entries of `z`
+
+        # cached solution and number of updates made since computing it
+        self._theta = None
+        self._stale = 0
+
+    def update(self, x, r, xp, gm, gm_p, lm, rho):
+        if isinstance(x, ActiveFeatures):
+            return self._update_sparse(x, r, xp, gm, gm_p, lm, rho)
+        self.z = x + gm*lm*self.old_rho*self.z
+        v = x - gm_p*rho*xp
+        # Sherman-Morrison: (A + z v^T)^-1 = A^-1 - (A^-1 z v^T A^-1)/(1 + v^T A^-1 z)
+        Az = np.dot(self.Ainv, self.z)
+        vA = np.dot(v, self.Ainv)
+        self.Ainv -= np.outer(Az, vA)/(1 + np.dot(v, Az))
+        self.b += r*rho*self.z
+
+        # prepare for next iteration
+        self.old_rho = rho
+        self._support = None
+        self._stale += 1
+
+    def _update_sparse(self, x, r, xp, gm, gm_p, lm, rho):
+        self._support = _trace(self.z, self._support, gm*lm*self.old_rho, x)
+        vi, vv = _combine(x, -gm_p*rho, xp)
+        if self._support is None:
+            Az = np.dot(self.Ainv, self.z)
+        else:
+            Az = np.dot(self.Ainv[:, self._support], self.z[self._support])
+        vA = np.dot(vv, self.Ainv[vi])
+        self.Ainv -= np.outer(Az, vA)/(1 + np.dot(vv, Az[vi]))
+        _trace_add(self.b, r*rho, self.z, self._support)
+
+        # prepare for next iteration
+        self.old_rho = rho
+        self._stale += 1
 
+    def solve(self):
+        """Compute the solution from the current statistics."""
+        return np.dot(self.Ainv, self.b)
 
 
 class ETD(Algo):
@@ -104,8 +279,12 @@ class ETD(Algo):
         self.F = 0
         self.M = 0
         self.old_rho = 0
+        self._support = np.zeros(0, dtype=np.intp)  # nonzero entries of `z`
 
     def update(self, x, r, xp, alpha, gm, gm_p, lm, rho, interest):
+        if isinstance(x, ActiveFeatures):
+            return self._update_sparse(x, r, xp, alpha, gm, gm_p, lm, rho,
+                                       interest)
         delta = r + gm_p*np.dot(self.theta, xp) - np.dot(self.theta, x)
         self.F = gm*self.old_rho*self.F + interest
         self.M = lm*interest + (1 - lm)*self.F
@@ -114,6 +293,17 @@ class ETD(Algo):
 
         # prepare for next iteration
         self.old_rho = rho
+        self._support = None
+
+    def _update_sparse(self, x, r, xp, alpha, gm, gm_p, lm, rho, interest):
+        delta = r + gm_p*xp.dot(self.theta) - x.dot(self.theta)
+        self.F = gm*self.old_rho*self.F + interest
+        self.M = lm*interest + (1 - lm)*self.F
+        self._support = _trace(self.z, self._support, rho*gm*lm, x, rho*self.M)
+        _trace_add(self.theta, alpha*delta, self.z, self._support)
+
+        # prepare for next iteration
+        self.old_rho = rho
 
 
 class GTD(Algo):
@@ -132,10 +322,21 @@ class GTD(Algo):
         self.w = np.zeros(self.n)
 
     def update(self, x, r, xp, alpha, beta, gm, gm_p, rho):
+        if isinstance(x, ActiveFeatures):
+            return self._update_sparse(x, r, xp, alpha, beta, gm, gm_p, rho)
         delta = r + gm_p*np.dot(self.theta, xp) - np.dot(self.theta, x)
         self.theta += alpha*rho*(x - gm_p*xp)*np.dot(x, self.w)
         self.w += beta*rho*(delta*x - self.w)
 
+    def _update_sparse(self, x, r, xp, alpha, beta, gm, gm_p, rho):
+        delta = r + gm_p*xp.dot(self.theta) - x.dot(self.theta)
+        xw = x.dot(self.w)
+        self.theta[x.indices] += alpha*rho*xw*x.weights
+        self.theta[xp.indices] -= alpha*rho*xw*gm_p*xp.weights
+        # NB: the decay of `w` touches every entry, so remains O(n)
+        self.w *= 1 - beta*rho
+        self.w[x.indices] += beta*rho*delta*x.weights
+
 
 class GTD2(Algo):
     """GTD2 -- Gradient Temporal Difference Learning, which minimizes MSPBE.
@@ -153,10 +354,19 @@ class GTD2(Algo):
         self.w = np.zeros(self.n)
 
     def update(self, x, r, xp, alpha, beta, gm, gm_p, rho):
+        if isinstance(x, ActiveFeatures):
+            return self._update_sparse(x, r, xp, alpha, beta, gm, gm_p, rho)
         delta = r + gm_p*np.dot(self.theta, xp) - np.dot(self.theta, x)
         self.theta += alpha*rho*(x - gm_p*xp)*np.dot(x, self.w)
         self.w += beta*(rho*delta - np.dot(x, self.w))*x
 
+    def _update_sparse(self, x, r, xp, alpha, beta, gm, gm_p, rho):
+        delta = r + gm_p*xp.dot(self.theta) - x.dot(self.theta)
+        xw = x.dot(self.w)
+        self.theta[x.indices] += alpha*rho*xw*x.weights
+        self.theta[xp.indices] -= alpha*rho*xw*gm_p*xp.weights
+        self.w[x.indices] += beta*(rho*delta - xw)*x.weights
+
 
 class TDC(Algo):
     """The Temporal Difference with Gradient Correction, AKA TDC(λ), AKA GTD(λ).
@@ -172,9 +382,116 @@ class TDC(Algo):
         self.theta = np.zeros(self.n)
         self.z = np.zeros(self.n)
         self.w = np.zeros(self.n)
+        self._support = np.zeros(0, dtype=np.intp)  # nonzero entries of `z`
 
     def update(self, x, r, xp, alpha, beta, gm, gm_p, lm, lm_p, rho):
+        if isinstance(x, ActiveFeatures):
+            return self._update_sparse(x, r, xp, alpha, beta, gm, gm_p, lm,
+                                       lm_p, rho)
         delta = r + gm_p*np.dot(self.theta, xp) - np.dot(self.theta, x)
         self.z = rho*(x + gm*lm*self.z)
         self.theta += alpha*(delta*self.z - gm_p*(1-lm_p)*np.dot(self.z, self.w)*xp)
-        self.w += beta*(delta*self.z - np.dot(x, self.w)*x)
\ No newline at end of file
+        self.w += beta*(delta*self.z - np.dot(x, self.w)*x)
+        self._support = None
+
+    def _update_sparse(self, x, r, xp, alpha, beta, gm, gm_p, lm, lm_p, rho):
+        delta = r + gm_p*xp.dot(self.theta) - x.dot(self.theta)
+        self._support = _trace(self.z, self._support, rho*gm*lm, x, rho)
+        if self._support is None:
+            zw = np.dot(self.z, self.w)
+        else:
+            zw = np.dot(self.z[self._support], self.w[self._support])
+        xw = x.dot(self.w)
+        _trace_add(self.theta, alpha*delta, self.z, self._support)
+        self.theta[xp.indices] -= alpha*gm_p*(1-lm_p)*zw*xp.weights
+        _trace_add(self.w, beta*delta, self.z, self._support)
+        self.w[x.indices] -= beta*xw*x.weights
+
+
+class TDBank(Algo):
+    """A bank of `K` TD(λ) learners that share a single stream of experience,
+    differing only in their step-size `alpha` and bootstrapping parameter `lm`.
+
+    The members' weights and traces are stacked into `(K, n)` arrays, so that
+    each transition is processed by one broadcasted update rather than `K`
+    separate ones. The per-member parameters are fixed at initialization,
+    while `gm`, `gm_p` and `rho` are supplied at each step as for `TD`, and
+    may be either scalars or arrays of length `K`.
+    """
+    def __init__(self, n, alpha, lm, **kwargs):
+        self.n = n
+        self.alpha, self.lm = _stack_params(alpha, lm)
+        self.K = len(self.alpha)
+        self.reset()
+
+    def reset(self):
+        self.theta = np.zeros((self.K, self.n))
+        self.z = np.zeros((self.K, self.n))
+        self.old_rho = 0
+
+    def update(self, x, r, xp, gm, gm_p, rho):
+        self.z = x + _col(gm*self.lm*self.old_rho)*self.z
+        delta = r + gm*rho*np.dot(self.theta, xp) - np.dot(self.theta, x)
+        self.theta += _col(self.alpha*delta)*self.z
+
+        # prepare for next iteration
+        self.old_rho = rho
+
+
+class ETDBank(Algo):
+    """A bank of `K` ETD(λ) learners sharing a single stream of experience,
+    with per-member step-size `alpha` and bootstrapping parameter `lm`.
+
+    See `TDBank` for how the members are stacked; `interest` is supplied per
+    step alongside `gm`, `gm_p` and `rho`.
+    """
+    def __init__(self, n, alpha, lm, **kwargs):
+        self.n = n
+        self.alpha, self.lm = _stack_params(alpha, lm)
+        self.K = len(self.alpha)
+        self.reset()
+
+    def reset(self):
+        self.theta = np.zeros((self.K, self.n))
+        self.z = np.zeros((self.K, self.n))
+        self.F = np.zeros(self.K)
+        self.M = np.zeros(self.K)
+        self.old_rho = 0
+
+    def update(self, x, r, xp, gm, gm_p, rho, interest):
+        delta = r + gm_p*np.dot(self.theta, xp) - np.dot(self.theta, x)
+        self.F = gm*self.old_rho*self.F + interest
+        self.M = self.lm*interest + (1 - self.lm)*self.F
+        self.z = _col(rho*self.M)*x + _col(rho*gm*self.lm)*self.z
+        self.theta += _col(self.alpha*delta)*self.z
+
+        # prepare for next iteration
+        self.old_rho = rho
+
+
+class TDCBank(Algo):
+    """A bank of `K` TDC(λ) learners sharing a single stream of experience,
+    with per-member step-sizes `alpha` and `beta`, and bootstrapping parameter
+    `lm` (which, being constant for each member, also serves as `lm_p`).
+
+    See `TDBank` for how the members are stacked.
+    """
+    def __init__(self, n, alpha, beta, lm, **kwargs):
+        self.n = n
+        self.alpha, self.beta, self.lm = _stack_params(alpha, beta, lm)
+        self.K = len(self.alpha)
+        self.reset()
+
+    def reset(self):
+        self.theta = np.zeros((self.K, self.n))
+        self.z = np.zeros((self.K, self.n))
+        self.w = np.zeros((self.K, self.n))
+
+    def update(self, x, r, xp, gm, gm_p, rho):
+        delta = r + gm_p*np.dot(self.theta, xp) - np.dot(self.theta, x)
+        self.z = _col(rho)*(x + _col(gm*self.lm)*self.z)
+        zw = np.sum(self.z*self.w, axis=1)
+        self.theta += _col(self.alpha)*(_col(delta)*self.z
+                                        - np.outer(gm_p*(1-self.lm)*zw, xp))
+        self.w += _col(self.beta)*(_col(delta)*self.z
+                                   - np.outer(np.dot(self.w, x), x))
@@ -3,7 +3,7 @@ A simple reinforcement learning environment, implementing something like the
 game of "chicken".
 """
 import numpy as np
-from environment import Environment
+from environment import Environment, VecEnv
 
 
 class Chicken(Environment):
@@ -36,6 +36,9 @@ class Chicken(Environment):
         self._state = sp
         return r, sp
 
+    def vectorize(self, n):
+        return VecChicken(self.length+1, n)
+
     def rfunc(self, s, a, sp):
         if s == self.length and a == self.ACTIONS['advance']:
             return 1
@@ -43,4 +46,41 @@ class Chicken(Environment):
             return 0
 
     def is_terminal(self, s=None):
-        return False
\ No newline at end of file
+        return False
+
+
+class VecChicken(VecEnv):
+    """Several copies of `Chicken`, stepped together with array operations."""
+    def __init__(self, length, n):
+        self.length = length-1
+        self.s0 = 0
+        self.n = n
+        self.reset()
+
+    @property
+    def num_envs(self):
+        return self.n
+
+    @property
+    def state(self):
+        return self._state.copy()
+
+    def get_actions(self):
+        return [(0, 1)] * self.n
+
+    def reset(self, s0=None):
+        s0 = self.s0 if s0 is None else s0
+        self._state = np.array(np.broadcast_to(s0, (self.n,)), dtype=int)
+        return self.state
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        if not np.all((actions == 0) | (actions == 1)):
+            raise Exception("Invalid action:", actions)
+        s = self._state
+        at_end = (s == self.length)
+        sp = np.where((actions == 0) & ~at_end, s + 1, self.s0)
+        r = ((actions == 0) & at_end).astype(float)
+        self._state = sp
+        # the environment is continuing, so copies never terminate
+        return r, sp.copy(), np.zeros(self.n, dtype=bool)
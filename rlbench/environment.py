@@ -1,3 +1,4 @@
+import copy
 import numpy as np
 
 
@@ -45,6 +46,31 @@ class Environment(object, metaclass=MetaEnvironment):
         """
         raise NotImplementedError
 
+    def transitions(self, s, a):
+        """The possible outcomes of taking action `a` in state `s`.
+
+        Note:
+            The default implementation assumes the environment is
+            deterministic, simulating the action once via `do()` (and then
+            restoring the current state); stochastic environments should
+            override it.
+
+        Args:
+            s: The state in which the action is taken.
+            a: The action to take.
+
+        Returns:
+            A list of `(prob, sp, r)` tuples, giving the probability of each
+            next state `sp` and the reward `r` received for the transition.
+        """
+        current = self._state
+        try:
+            self.reset(s)
+            r, sp = self.do(a)
+        finally:
+            self._state = current
+        return [(1.0, sp, r)]
+
     def rfunc(self, s, a, sp):
         """Reward function.
 
@@ -123,6 +149,16 @@ class Environment(object, metaclass=MetaEnvironment):
         """Set: The set of terminal states of the environment."""
         return {s for s in self.states if self.is_terminal(s)}
 
+    def vectorize(self, n):
+        """Return a `VecEnv` stepping `n` copies of this environment.
+
+        Note:
+            Environments that can step many states with array operations
+            should override this to return a native implementation; the
+            default wraps `n` copies of the environment.
+        """
+        return VecEnv.from_env(self, n)
+
     @property
     def max_actions(self):
         """int: The maximum number of actions available over all states."""
@@ -130,4 +166,88 @@ class Environment(object, metaclass=MetaEnvironment):
 
     @property
     def info(self):
-        """Return summary information about the environment."""
\ No newline at end of file
+        """Return summary information about the environment."""
+
+
+class VecEnv(object):
+    """Step several copies of an environment in lockstep.
+
+    The current states of the copies are held in an array, and `step` takes an
+    array of actions (one per copy), returning arrays of the rewards and next
+    states. Copies that reach a terminal state are reset automatically.
+
+    This generic implementation steps each copy in turn; subclasses can step
+    them all at once with array operations (see `Environment.vectorize`).
+
+    Args:
+        envs: A list of environments, one per copy.
+    """
+    def __init__(self, envs):
+        self.envs = list(envs)
+        self.reset()
+
+    @classmethod
+    def from_env(cls, env, n):
+        """Make a `VecEnv` of `n` independent copies of `env`."""
+        return cls([copy.deepcopy(env) for i in range(n)])
+
+    def __len__(self):
+        return self.num_envs
+
+    @property
+    def num_envs(self):
+        return len(self.envs)
+
+    def _array(self, items):
+        """Pack states into an array, keeping compound states (e.g. tuples)
+        as single elements.
+        """
+        items = list(items)
+        if all(np.isscalar(x) for x in items):
+            return np.array(items)
+        ret = np.empty(len(items), dtype=object)
+        ret[:] = items
+        return ret
+
+    @property
+    def state(self):
+        """Array of the current state of each copy."""
+        return self._array(env.state for env in self.envs)
+
+    def get_actions(self):
+        """The actions available to each copy, as a list."""
+        return [env.actions for env in self.envs]
+
+    def reset(self, s0=None):
+        """Reset every copy, returning their states.
+
+        Args:
+            s0 (optional): The state (or an array of states, one per copy) to
+                reset to. Defaults to each environment's initial state.
+        """
+        if s0 is None or np.ndim(s0) == 0:
+            s0 = [s0] * self.num_envs
+        for env, s in zip(self.envs, s0):
+            env.reset(s)
+        return self.state
+
+    def step(self, actions):
+        """Take an action in each copy.
+
+        Args:
+            actions: An array of actions, one per copy.
+
+        Returns:
+            r: An array of the rewards received.
+            sp: An array of the resulting states (before any resets).
+            done: A boolean array, true for copies that reached a terminal
+                state and have been reset.
+        """
+        n = self.num_envs
+        r, sp, done = np.empty(n), [None] * n, np.zeros(n, dtype=bool)
+        for i, (env, a) in enumerate(zip(self.envs, actions)):
+            r[i], sp[i] = env.do(a)
+            if env.is_terminal():
+                done[i] = True
+                env.reset()
+        return r, self._array(sp), done
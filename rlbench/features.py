@@ -1,51 +1,201 @@
 import numpy as np
+from collections import OrderedDict
+
+
+class ActiveFeatures:
+    """
+    A sparse feature vector, represented by the indices of its active (nonzero)
+    entries and optionally their values (`None` meaning that each is one).
+    Indices are assumed to be unique.
+
+    Converting it to an array (e.g., via `np.asarray`) gives the equivalent
+    dense vector, but the learning algorithms operate on it directly, so that
+    their updates take time proportional to the number of active features.
+    """
+    __slots__ = ('indices', 'values', 'length')
+
+    def __init__(self, indices, values=None, length=None):
+        self.indices = np.asarray(indices, dtype=np.intp).ravel()
+        if values is not None:
+            values = np.asarray(values, dtype=float).ravel()
+        self.values = values
+        self.length = length
+
+    @property
+    def weights(self):
+        """The values of the active features (ones, for binary features)."""
+        if self.values is None:
+            return np.ones(len(self.indices))
+        return self.values
+
+    def dot(self, w):
+        """Inner product with `w`, over its last axis."""
+        if self.values is None:
+            return np.sum(w[..., self.indices], axis=-1)
+        return np.dot(w[..., self.indices], self.values)
+
+    def toarray(self):
+        """Return the equivalent dense feature vector."""
+        ret = np.zeros(self.length)
+        ret[self.indices] = self.weights
+        return ret
+
+    def __array__(self, dtype=None, copy=None):
+        return self.toarray().astype(dtype, copy=False)
+
+
+def dot(w, x):
+    """Compute the inner product of `w` with feature vector `x`, which may be
+    dense or an instance of `ActiveFeatures`.
+    """
+    if isinstance(x, ActiveFeatures):
+        return x.dot(w)
+    return np.dot(w, x)
+
+
+def active_matrix(indices, values=None, length=None):
+    """Build an `(m, length)` sparse matrix from an `(m, k)` array of active
+    indices (and optionally their values), as a `scipy.sparse.csr_matrix`.
+    Repeated indices in a row are summed.
+    """
+    from scipy import sparse
+    indices = np.asarray(indices, dtype=np.intp)
+    m, k = indices.shape
+    if values is None:
+        values = np.ones(indices.shape)
+    indptr = np.arange(0, m*k + 1, k)
+    ret = sparse.csr_matrix((np.ravel(values), np.ravel(indices), indptr),
+                            shape=(m, length))
+    ret.sum_duplicates()
+    return ret
+
+
+def feature_matrix(phi, states):
+    """Compute the feature matrix for a sequence of states, with one row per
+    state, using `phi.batch` where the feature function provides it.
+
+    The result is either an array or, for sparse features, a sparse matrix;
+    in either case, the values are given by `feature_matrix(phi, states) @ theta`.
+    """
+    states = list(states)
+    if hasattr(phi, 'batch'):
+        return phi.batch(np.array(states))
+    rows = [phi(s) for s in states]
+    if rows and isinstance(rows[0], ActiveFeatures):
+        from scipy import sparse
+        return sparse.vstack([sparse.csr_matrix(
+            (x.weights, x.indices, [0, len(x.indices)]), shape=(1, x.length))
+            for x in rows], format='csr')
+    return np.array([np.asarray(x) for x in rows])
+
+
+class FeatureCache:
+    """
+    Least-recently-used cache of feature matrices, keyed by the sequence of
+    states they were computed for.
+
+    At most `maxsize` matrices are held at once, so memory remains bounded
+    when values are computed for several environments in turn.
+    """
+    def __init__(self, phi, maxsize=4):
+        self.phi = phi
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def __call__(self, states):
+        """Return `(index, X)` for the given states, where `X` is the feature
+        matrix and `index` maps each state to its row in `X`.
+        """
+        key = tuple(states)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        index = {s: i for i, s in enumerate(key)}
+        ret = (index, feature_matrix(self.phi, key))
+        self._cache[key] = ret
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return ret
+
+    def clear(self):
+        """Remove all cached feature matrices."""
+        self._cache.clear()
 
 
 class Int2Unary:
     """
     Convert integer to unary representation (e.g., for tabular case)
+    If `sparse` is true, the output is an `ActiveFeatures` instance.
     """
-    def __init__(self, length, terminals=None):
+    def __init__(self, length, terminals=None, sparse=False):
         if terminals is None:
             self._terminals = set()
         else:
             self._terminals = set(terminals)
         self.length = length
+        self.sparse = sparse
         self._array = np.eye(length)
 
     def __call__(self, x):
         # if x in self.terminals:
         #     return np.zeros(self.length)
+        if self.sparse:
+            return ActiveFeatures([x], None, self.length)
         return self._array[x]
 
+    def batch(self, states):
+        """Compute the features for an array of states, one row per state."""
+        states = np.ravel(states)
+        if self.sparse:
+            return active_matrix(states[:, None], None, self.length)
+        return self._array[states]
+
     @property 
     def terminals(self):
         return self._terminals
 
+    @property 
+    def nin(self):
+        return 1
+
+    @property 
+    def nout(self):
+        return self.length
+
 
 class Int2Binary:
     """
     Convert integer to its bit vector representation.
     On initialization, it precomputes an array which is used to extract the 
     individual bits of each integer. 
+    If `sparse` is true, the output is an `ActiveFeatures` instance.
     """
-    def __init__(self, length, terminals=None):
+    def __init__(self, length, terminals=None, sparse=False):
         if terminals is None:
             self._terminals = set()
         else:
             self._terminals = set(terminals)
         # Precompute the array for converting integers to bit vectors
         self.length = length
+        self.sparse = sparse
         self._array = (1 << np.arange(length))
 
     def __call__(self, x):
         # if x in self.terminals:
         #     return np.zeros(self.length)
-        x = np.array(x)
-        ret = []
-        for i in x.flat:
-            ret.append((i & self._array) > 0)
-        return np.ravel(ret).astype(np.uint8)
+        ret = ((np.reshape(x, (-1, 1)) & self._array) > 0).ravel()
+        if self.sparse:
+            return ActiveFeatures(np.flatnonzero(ret), None, len(ret))
+        return ret.astype(np.uint8)
+
+    def batch(self, states):
+        """Compute the features for an array of states, one row per state."""
+        states = np.asarray(states)
+        ret = ((states[..., None] & self._array) > 0).reshape(len(states), -1)
+        if self.sparse:
+            from scipy import sparse
+            return sparse.csr_matrix(ret, dtype=float)
+        return ret.astype(np.uint8)
 
     @property 
     def terminals(self):
@@ -61,23 +211,41 @@ class Int2Binary:
 
 
 class RandomBinary:
-    def __init__(self, length, num_active, terminals=None, random_seed=None):
+    """
+    Map each input to a random binary vector with `num_active` nonzero entries,
+    generated the first time the input is seen.
+    If `sparse` is true, the output is an `ActiveFeatures` instance.
+    """
+    def __init__(self, length, num_active, terminals=None, random_seed=None,
+                 sparse=False):
         if terminals is None:
             self._terminals = set()
         else:
             self._terminals = set(terminals)
         self.length = length
         self.num_active = num_active
+        self.sparse = sparse
         self.random_state = np.random.RandomState(random_seed)
         self.mapping = {}
 
     def __call__(self, x):
-        return self.mapping.setdefault(x, self.gen())
+        if x not in self.mapping:
+            self.mapping[x] = self.gen()
+        return self.mapping[x]
+
+    def batch(self, states):
+        """Compute the features for an array of states, one row per state."""
+        rows = [self(s) for s in np.ravel(states).tolist()]
+        if self.sparse:
+            return active_matrix([x.indices for x in rows], None, self.length)
+        return np.array(rows)
 
     def gen(self):
         # TODO: A better name for this
         indices = np.arange(self.length)
         nonzero = self.random_state.choice(indices, self.num_active, replace=False)
+        if self.sparse:
+            return ActiveFeatures(np.sort(nonzero), None, self.length)
         ret = np.zeros(self.length)
         ret[nonzero] = 1
         return ret
@@ -86,4 +254,138 @@ class RandomBinary:
     def terminals(self):
         return self._terminals
 
+    @property 
+    def nin(self):
+        return 1
+
+    @property 
+    def nout(self):
+        return self.length
+
+
+def _hash_coords(coords):
+    """Hash integer coordinates (along the last axis) to 64-bit keys."""
+    coords = np.asarray(coords, dtype=np.int64).view(np.uint64)
+    h = np.full(coords.shape[:-1], 0xcbf29ce484222325, dtype=np.uint64)
+    for j in range(coords.shape[-1]):
+        h = (h ^ coords[..., j]) * np.uint64(0x100000001b3)
+    # final mixing step (from SplitMix64), spreading bits for the modulus
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+class IndexHashTable:
+    """
+    A table of fixed size mapping tiles (tuples of integer coordinates) to
+    indices in `range(size)`.
+
+    Each tile is hashed to a slot; the first tile to land in a slot claims it,
+    and any different tile that later lands there shares the index. Such
+    lookups are counted in `collisions`, which gives an indication of whether
+    the table is large enough.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.collisions = 0
+        self._keys = np.zeros(size, dtype=np.uint64)
+        self._used = np.zeros(size, dtype=bool)
+        self._count = 0
+
+    def __call__(self, coords):
+        """Return the indices for an array of tiles, whose coordinates are
+        given along the last axis.
+        """
+        keys = _hash_coords(coords)
+        slots = (keys % np.uint64(self.size)).astype(np.intp)
+
+        # claim previously unused slots, and count lookups for distinct tiles
+        # that land in a slot that has been claimed by a different one
+        ukeys, first = np.unique(keys.ravel(), return_index=True)
+        uslots = slots.ravel()[first]
+        free = ~self._used[uslots]
+        if np.any(free):
+            fslots, fidx = np.unique(uslots[free], return_index=True)
+            self._keys[fslots] = ukeys[free][fidx]
+            self._used[fslots] = True
+            self._count += len(fslots)
+        self.collisions += int(np.sum(self._keys[uslots] != ukeys))
+        return slots
+
+    def __len__(self):
+        """The number of slots that have been claimed."""
+        return self._count
+
+    def full(self):
+        """Return `True` if every slot in the table has been claimed."""
+        return self._count >= self.size
+
+
+class TileCoder:
+    """
+    Tile coding over continuous, multi-dimensional states.
+
+    Each of `num_tilings` tilings partitions the box between `low` and `high`
+    into `num_tiles` tiles per dimension, with each tiling offset from the
+    others by an asymmetric displacement. The tiles are mapped to features via
+    an `IndexHashTable` of size `size`, so memory use is fixed regardless of
+    how many tiles there are in principle.
+
+    The output is an `ActiveFeatures` instance, with one active feature per
+    tiling (or fewer, with values greater than one, if tilings collide).
+    """
+    def __init__(self, low, high, num_tiles, num_tilings, size, terminals=None):
+        if terminals is None:
+            self._terminals = set()
+        else:
+            self._terminals = set(terminals)
+        self.low = np.ravel(low).astype(float)
+        self.high = np.ravel(high).astype(float)
+        self.num_tiles = np.broadcast_to(num_tiles, self.low.shape).astype(int)
+        self.num_tilings = num_tilings
+        self.table = IndexHashTable(size)
+
+        # scale states so that tiles have unit width
+        self._scale = self.num_tiles / (self.high - self.low)
+        # offset of each tiling, in units of tile width, displacing dimension
+        # `j` by (2j + 1)/num_tilings per tiling
+        dims = np.arange(len(self.low))
+        tilings = np.arange(num_tilings)
+        self._offsets = np.outer(tilings, 2*dims + 1) / num_tilings % 1
+
+    def indices(self, states):
+        """Compute the active indices for an `(m, d)` array of states, returning
+        an `(m, num_tilings)` array.
+        """
+        x = (np.reshape(states, (-1, self.nin)) - self.low) * self._scale
+        coords = np.floor(x[:, None, :] + self._offsets).astype(np.int64)
+        # include the tiling as a coordinate, so tilings are hashed apart
+        tilings = np.broadcast_to(np.arange(self.num_tilings)[:, None],
+                                  coords.shape[:-1] + (1,))
+        return self.table(np.concatenate([coords, tilings], axis=-1))
+
+    def __call__(self, x):
+        # if x in self.terminals:
+        #     return ActiveFeatures([], None, self.nout)
+        indices, counts = np.unique(self.indices(x)[0], return_counts=True)
+        if len(indices) == self.num_tilings:
+            return ActiveFeatures(indices, None, self.nout)
+        return ActiveFeatures(indices, counts, self.nout)
+
+    def batch(self, states):
+        """Compute the features for an `(m, d)` array of states, returning an
+        `(m, nout)` sparse matrix.
+        """
+        return active_matrix(self.indices(states), None, self.nout)
+
+    @property
+    def terminals(self):
+        return self._terminals
+
+    @property
+    def nin(self):
+        return len(self.low)
 
+    @property
+    def nout(self):
+        return self.table.size
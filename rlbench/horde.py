@@ -0,0 +1,235 @@
+"""
+A Horde of general value function (GVF) "demons", all learning off-policy from
+a single stream of experience generated by a behavior policy.
+
+Each demon predicts the discounted sum of its own cumulant, under its own
+target policy and discount. The demons' weights are held by a single bank
+algorithm (e.g., `TDCBank`) as a `(K, n)` matrix, so a step requires computing
+the features once, evaluating each distinct policy and parameter function once,
+and a single batched update of all `K` demons, with the per-demon cumulants,
+discounts and importance sampling ratios passed as length `K` vectors.
+"""
+import numpy as np
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+import agents
+import features
+import policy
+from parametric import (ArrayNextState, ArrayState, Constant, MapNextState,
+                        MapState, to_parameter)
+
+
+class Demon:
+    """A general value function, to be learned as part of a `Horde`.
+
+    Args:
+        target: The target policy.
+        cumulant (optional): The signal to predict, as a function of
+            `(s, a, sp)`; if omitted, the reward is used.
+        gamma (optional): The discount, as a parameter called with
+            `(s, a, sp)` (or a constant), giving `gm`.
+        interest (optional): The interest in each state (as a parameter called
+            with `(s, a, sp)`, or a constant), for emphatic algorithms.
+        gamma_p (optional): The discount giving `gm_p`, also called with
+            `(s, a, sp)`. By default, a discount which depends on the current
+            state is applied to the next state instead, so that
+            `gm = gamma(s)` and `gm_p = gamma(sp)`, and any other discount is
+            used for both.
+    """
+    def __init__(self, target, cumulant=None, gamma=0.0, interest=1.0,
+                 gamma_p=None):
+        self.target = target
+        self.cumulant = None if cumulant is None else to_parameter(cumulant)
+        self.gamma = to_parameter(gamma)
+        self.interest = to_parameter(interest)
+        if gamma_p is None:
+            self.gamma_p = _next_state(self.gamma)
+        else:
+            self.gamma_p = to_parameter(gamma_p)
+
+
+def _next_state(param):
+    """The parameter which gives the value of `param` for the next state."""
+    if type(param) is MapState:
+        return MapNextState(param.data)
+    elif type(param) is ArrayState:
+        return ArrayNextState(param.values)
+    return param
+
+
+class _Stacked:
+    """Evaluate a parameter for each of `K` demons as a vector, calling each
+    distinct parameter function only once (and constants never).
+
+    A function of `None` stands for the reward.
+    """
+    def __init__(self, funcs):
+        self.base = np.zeros(len(funcs))
+        groups = {}
+        for k, func in enumerate(funcs):
+            if isinstance(func, Constant):
+                self.base[k] = func.value
+            else:
+                groups.setdefault(id(func), (func, []))[1].append(k)
+        self.groups = [(func, np.array(ks)) for func, ks in groups.values()]
+
+    def __call__(self, *args, r=None):
+        if not self.groups:
+            return self.base
+        ret = self.base.copy()
+        for func, ks in self.groups:
+            ret[ks] = r if func is None else func(*args)
+        return ret
+
+
+class Horde(agents.ValueMixin):
+    """A collection of demons learning in parallel from one behavior policy.
+
+    The Horde can be used wherever an agent is expected (e.g., `run_episode`):
+    `choose` selects actions using the behavior policy, computing each demon's
+    importance sampling ratio, and `update` updates every demon at once.
+    The demons' values for a set of states (see `bind` and `values`) form an
+    array of shape `(len(states), K)`.
+
+    Args:
+        algo: A bank algorithm with one member per demon, e.g., a `TDCBank`
+            constructed with length `K` step-sizes.
+        behavior: The behavior policy.
+        demons: A list of `Demon` instances.
+        phi (optional): The feature function, shared by all demons.
+        rng (optional): A `np.random.Generator` or seed for selecting actions.
+    """
+    def __init__(self, algo, behavior, demons, phi=None, rng=None):
+        self.demons = list(demons)
+        if getattr(algo, 'K', len(self.demons)) != len(self.demons):
+            raise ValueError("Algorithm has %d members for %d demons" %
+                             (algo.K, len(self.demons)))
+        self.algo = algo
+        self.behavior = behavior
+        self.uniform = policy.UniformStream(rng)
+        if phi is None:
+            self.phi = lambda x: x
+        else:
+            self.phi = phi
+
+        # evaluate each distinct target policy once per step
+        self.targets = []
+        index = {}
+        for d in self.demons:
+            index.setdefault(id(d.target), len(self.targets))
+            if len(index) > len(self.targets):
+                self.targets.append(d.target)
+        self._target_index = np.array([index[id(d.target)]
+                                       for d in self.demons])
+        self._stationary = (behavior.stationary and
+                            all(t.stationary for t in self.targets))
+        self._rho_versions = None
+        self._rho_cache = OrderedDict()
+
+        # per-demon parameters, as vectors
+        self._cumulant = _Stacked([d.cumulant for d in self.demons])
+        self._gamma = _Stacked([d.gamma for d in self.demons])
+        self._gamma_p = _Stacked([d.gamma_p for d in self.demons])
+        self._interest = _Stacked([d.interest for d in self.demons])
+
+        # features of the last next state, reused for the following step
+        self._last = None
+        self.rho = np.ones(len(self.demons))
+
+        # feature matrices for computing the values of sets of states
+        self.cache = features.FeatureCache(self.phi)
+        self._bound = None
+
+    def __len__(self):
+        return len(self.demons)
+
+    def _ratios(self, s, actions):
+        """The behavior policy's distribution, and a `(len(actions), K)` array
+        of importance sampling ratios for each action.
+        """
+        prob_mu = np.asarray(self.behavior.probabilities(s, actions),
+                             dtype=float)
+        prob_pi = np.array([t.probabilities(s, actions) for t in self.targets],
+                           dtype=float).reshape(len(self.targets), -1)
+        rho = np.zeros_like(prob_pi)
+        np.divide(prob_pi, prob_mu, out=rho, where=prob_mu > 0)
+        return prob_mu, rho.T[:, self._target_index]
+
+    def ratios(self, s, a, actions):
+        """The importance sampling ratio of each demon for taking action `a`
+        (from `actions`) in state `s`.
+        """
+        actions = list(actions)
+        return self._ratios(s, actions)[1][actions.index(a)]
+
+    def choose(self, s, actions):
+        """Select an action using the behavior policy, setting `self.rho` to
+        the vector of the demons' importance sampling ratios for it.
+        """
+        actions = list(actions)
+        if self._stationary:
+            versions = ((self.behavior.version,) +
+                        tuple(t.version for t in self.targets))
+            if versions != self._rho_versions:
+                self._rho_cache = OrderedDict()
+                self._rho_versions = versions
+            # the ratios of the most recently visited states are kept
+            key = (s, tuple(actions))
+            entry = self._rho_cache.get(key)
+            if entry is None:
+                prob_mu, rho = self._ratios(s, actions)
+                entry = (list(accumulate(prob_mu)), rho)
+                self._rho_cache[key] = entry
+                if len(self._rho_cache) > agents.RHO_CACHE_SIZE:
+                    self._rho_cache.popitem(last=False)
+            else:
+                self._rho_cache.move_to_end(key)
+            cdf, rho = entry
+            i = min(bisect_right(cdf, self.uniform()*cdf[-1]), len(cdf) - 1)
+        else:
+            prob_mu, rho = self._ratios(s, actions)
+            i = policy.sample(prob_mu, self.uniform())
+        self.rho = rho[i]
+        return actions[i]
+
+    def update(self, s, a, r, sp, x=None, xp=None, **params):
+        """Update every demon from the transition `(s, a, r, sp)`.
+
+        Uses `self.rho`, which is accurate if `choose` selected the action
+        (otherwise, pass `rho=horde.ratios(s, a, actions)`). The features `x`
+        and `xp` of `s` and `sp` may be given if already computed. The
+        parameters in `**params` override the demons' parameters.
+        """
+        # features, reusing those of the previous next state if possible
+        if x is None:
+            if self._last is not None and self._last[0] is s:
+                x = self._last[1]
+            else:
+                x = self.phi(s)
+        if xp is None:
+            xp = self.phi(sp)
+        self._last = (sp, xp)
+
+        update_params = {
+            'gm': self._gamma(s, a, sp),
+            'gm_p': self._gamma_p(s, a, sp),
+            'rho': self.rho,
+            'interest': self._interest(s, a, sp),
+        }
+        update_params.update(**params)
+        args = [update_params[k] for k in self.algo.update_params]
+        return self.algo.update(x, self._cumulant(s, a, sp, r=r), xp, *args)
+
+    @property
+    def theta(self):
+        """The `(K, n)` matrix of the demons' weights."""
+        return self.algo.theta
+
+    def predict(self, s):
+        """The prediction of each demon in state `s`."""
+        return features.dot(self.theta, self.phi(s))
+
+    def reset(self):
+        self.algo.reset()
+        self._last = None
@@ -0,0 +1,352 @@
+"""
+Compiled representations of discrete environments as tabular MDPs.
+
+`compile_env` enumerates an environment's states, actions and transitions into
+transition and reward tensors, which can then be used to sample trajectories
+in bulk (see `TrajectorySampler`) without simulating the environment one
+`do()` call at a time. `markov_chain` reduces one further, to the Markov chain
+induced by a policy, whose transition matrix, expected rewards and features
+can be passed directly to the solvers of `mdpsolver`, and `true_values` solves
+for the exact values of its states.
+"""
+from collections import namedtuple
+import numpy as np
+from features import feature_matrix
+from parametric import to_parameter
+
+
+def _ordered(items):
+    """Sort items if possible, otherwise keep them in iteration order."""
+    items = list(items)
+    try:
+        return sorted(items)
+    except TypeError:
+        return items
+
+
+class TabularMDP:
+    """A finite MDP with transition probabilities `P[s, a, s']` and rewards
+    `R[s, a, s']`, with states and actions identified by their indices in
+    `states` and `actions`.
+
+    `P` and `R` are either dense `(|S|, |A|, |S|)` arrays, or sparse matrices
+    of shape `(|S| * |A|, |S|)` (with row `s*|A| + a` for each pair), with
+    `R` having the same sparsity structure as `P`.
+
+    Attributes:
+        available: A boolean `(|S|, |A|)` array of the actions available in
+            each state.
+        terminal: A boolean array indicating the terminal states.
+        start: The index of the start state.
+    """
+    def __init__(self, states, actions, P, R, available, terminal, start=0):
+        self.states = list(states)
+        self.actions = list(actions)
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.action_index = {a: j for j, a in enumerate(self.actions)}
+        self.P = P
+        self.R = R
+        self.available = np.asarray(available, dtype=bool)
+        self.terminal = np.asarray(terminal, dtype=bool)
+        self.start = start
+
+    @property
+    def num_states(self):
+        return len(self.states)
+
+    @property
+    def num_actions(self):
+        return len(self.actions)
+
+    @property
+    def sparse(self):
+        return not isinstance(self.P, np.ndarray)
+
+    def _flat(self):
+        """Transition probabilities and rewards in `(|S| * |A|, |S|)` CSR form."""
+        if self.sparse:
+            return self.P.tocsr(copy=True), self.R.tocsr(copy=True)
+        from scipy import sparse
+        shape = (self.num_states * self.num_actions, self.num_states)
+        P = sparse.csr_matrix(self.P.reshape(shape))
+        # rewards with the same sparsity structure as `P`
+        R = P.copy()
+        rows = np.repeat(np.arange(shape[0]), np.diff(P.indptr))
+        R.data = self.R.reshape(shape)[rows, P.indices].astype(float)
+        return P, R
+
+    def expected_reward(self):
+        """The expected immediate reward for each state-action pair, as an
+        `(|S|, |A|)` array.
+        """
+        shape = (self.num_states, self.num_actions)
+        if self.sparse:
+            P, R = self._flat()
+            P.data = P.data * R.data
+            return np.asarray(P.sum(axis=1)).reshape(shape)
+        return np.sum(self.P * self.R, axis=2)
+
+    def policy_matrix(self, pol):
+        """The `(|S|, |A|)` matrix of action probabilities under `pol`, which
+        is queried once for the available actions of each state.
+        """
+        ret = np.zeros((self.num_states, self.num_actions))
+        for i, s in enumerate(self.states):
+            cols = np.flatnonzero(self.available[i])
+            if len(cols):
+                actions = [self.actions[j] for j in cols]
+                ret[i, cols] = pol.probabilities(s, actions)
+        return ret
+
+    def chain(self, pol, restart=True):
+        """The transition matrix and expected rewards of the Markov chain
+        induced by following `pol`.
+
+        Args:
+            pol: The policy, as an `(|S|, |A|)` matrix of action
+                probabilities, or a `Policy`.
+            restart (optional): If true, terminal states transition to the
+                start state (with no reward), so that the chain keeps running
+                over successive episodes; otherwise, terminal states have no
+                outgoing transitions.
+
+        Returns:
+            P: The `(|S|, |S|)` transition matrix (sparse if the MDP is).
+            r: The expected immediate reward for each state.
+        """
+        if not isinstance(pol, np.ndarray):
+            pol = self.policy_matrix(pol)
+        ns, na = self.num_states, self.num_actions
+        r = np.sum(pol * self.expected_reward(), axis=1)
+        if self.sparse:
+            from scipy import sparse
+            # weight row (s, a) of the flattened `P` by pi(a | s)
+            W = sparse.csr_matrix((pol.ravel(), np.arange(ns*na),
+                                   np.arange(0, ns*na + 1, na)),
+                                  shape=(ns, ns*na))
+            P = (W @ self._flat()[0]).tolil()
+            for i in np.flatnonzero(self.terminal):
+                P.rows[i], P.data[i] = [], []
+                if restart:
+                    P[i, self.start] = 1
+            P = P.tocsr()
+        else:
+            P = np.einsum('ij,ijk->ik', pol, self.P)
+            P[self.terminal] = 0
+            if restart:
+                P[self.terminal, self.start] = 1
+        r[self.terminal] = 0
+        return P, r
+
+
+def compile_env(env, sparse=False):
+    """Compile a discrete environment into a `TabularMDP`, enumerating its
+    states, the actions available in each, and their outcomes (as given by
+    `env.transitions`). Terminal states are not expanded, and so have no
+    available actions or outgoing transitions.
+
+    Args:
+        env: The environment to compile.
+        sparse (optional): If true, store `P` and `R` as sparse matrices, which
+            is advisable when there are many states.
+
+    Returns:
+        The compiled `TabularMDP`.
+    """
+    states = _ordered(env.states)
+    actions = _ordered({a for s in states for a in env.get_actions(s)})
+    state_index = {s: i for i, s in enumerate(states)}
+    action_index = {a: j for j, a in enumerate(actions)}
+    ns, na = len(states), len(actions)
+
+    # enumerate the outcomes of each state-action pair
+    terminal = [env.is_terminal(s) for s in states]
+    available = np.zeros((ns, na), dtype=bool)
+    rows, cols, probs, rewards = [], [], [], []
+    for i, s in enumerate(states):
+        # episodes end in terminal states, so they have no outcomes
+        if terminal[i]:
+            continue
+        for a in env.get_actions(s):
+            j = action_index[a]
+            available[i, j] = True
+            for p, sp, r in env.transitions(s, a):
+                rows.append(i*na + j)
+                cols.append(state_index[sp])
+                probs.append(p)
+                rewards.append(r)
+    start = state_index.get(getattr(env, 's0', None), 0)
+
+    if sparse:
+        from scipy import sparse as sp
+        shape = (ns*na, ns)
+        P = sp.csr_matrix((probs, (rows, cols)), shape=shape)
+        # rewards for the same outcome are averaged, weighted by probability
+        PR = sp.csr_matrix((np.multiply(probs, rewards), (rows, cols)),
+                           shape=shape)
+        R = P.copy()
+        R.data = np.divide(PR.data, P.data, out=np.zeros_like(PR.data),
+                           where=P.data != 0)
+    else:
+        P = np.zeros((ns*na, ns))
+        PR = np.zeros((ns*na, ns))
+        np.add.at(P, (rows, cols), probs)
+        np.add.at(PR, (rows, cols), np.multiply(probs, rewards))
+        R = np.divide(PR, P, out=np.zeros_like(PR), where=P != 0)
+        P, R = P.reshape(ns, na, ns), R.reshape(ns, na, ns)
+    return TabularMDP(states, actions, P, R, available, terminal, start)
+
+
+MarkovChain = namedtuple('MarkovChain', ['states', 'P', 'r', 'X', 'terminal'])
+
+
+def markov_chain(env, pol, phi=None, sparse=False, restart=True):
+    """Build the Markov chain induced by following a policy in an environment,
+    by enumerating its states and actions.
+
+    The transition matrix `P`, expected rewards `r` and feature matrix `X` are
+    in the form expected by the solvers of `mdpsolver`, e.g.,
+    `td_solver(P, r, X, gm, lm)`. When the environment is episodic, `gm`
+    should be zero in the terminal states (see `parameter_vector`).
+
+    Args:
+        env: The environment.
+        pol: The policy to follow.
+        phi (optional): The feature function; if omitted, `X` is `None`.
+        sparse (optional): If true, `P` (and `X`, where possible) are sparse.
+        restart (optional): Whether terminal states transition to the start
+            state (see `TabularMDP.chain`).
+
+    Returns:
+        A `MarkovChain` of the states (in the order of the rows of `P`, `r` and
+        `X`), `P`, `r`, `X`, and a boolean array of the terminal states.
+    """
+    mdp = compile_env(env, sparse=sparse)
+    P, r = mdp.chain(pol, restart=restart)
+    X = feature_matrix(phi, mdp.states) if phi is not None else None
+    return MarkovChain(mdp.states, P, r, X, mdp.terminal)
+
+
+def parameter_vector(param, states, terminal=None):
+    """Evaluate a state-dependent parameter (e.g., gamma) for each state,
+    with zeros for any states marked as `terminal`.
+
+    Each state is passed as both the current and the next state, so that
+    parameters of either (e.g., `MapState` or `MapNextState`) give the
+    state's value.
+    """
+    states = list(states)
+    ret = np.array(to_parameter(param).batch(states, None, states),
+                   dtype=float)
+    if terminal is not None:
+        ret[np.asarray(terminal, dtype=bool)] = 0
+    return ret
+
+
+def true_values(env, pol, gamma, sparse=False):
+    """Compute the exact value of each state of an environment under a policy,
+    discounting by `gamma` (a constant, or a function of the next state),
+    such that `v = r + P G v`.
+
+    The returned dictionary can be used as the `val_dct` of `run_errors`, in
+    place of Monte Carlo estimates (terminal states have a value of zero).
+    """
+    chain = markov_chain(env, pol, sparse=sparse, restart=False)
+    G = parameter_vector(gamma, chain.states)
+    if sparse:
+        from scipy import sparse as sp
+        from scipy.sparse.linalg import spsolve
+        A = sp.identity(len(G), format='csc') - chain.P @ sp.diags(G)
+        v = spsolve(A.tocsc(), chain.r)
+    else:
+        v = np.linalg.solve(np.eye(len(G)) - chain.P * G, chain.r)
+    return dict(zip(chain.states, v.tolist()))
+
+
+class TrajectorySampler:
+    """Sample trajectories from a `TabularMDP` under a fixed policy, for many
+    seeds at once.
+
+    The action and next-state distributions are stored as cumulative tables,
+    offset so that every row can be searched in a single call to
+    `np.searchsorted`. Each time step is then a handful of array operations
+    over all of the seeds, with no calls back into the environment or policy.
+
+    Args:
+        mdp: The `TabularMDP` to sample from.
+        pol: The policy, as an `(|S|, |A|)` matrix of action probabilities, or
+            a `Policy` (converted via `mdp.policy_matrix`).
+    """
+    def __init__(self, mdp, pol):
+        self.mdp = mdp
+        if not isinstance(pol, np.ndarray):
+            pol = mdp.policy_matrix(pol)
+        ns, na = mdp.num_states, mdp.num_actions
+
+        # cumulative action probabilities, offset by the row (state) index
+        cdf = np.cumsum(pol, axis=1)
+        cdf /= np.where(cdf[:, -1:] > 0, cdf[:, -1:], 1)
+        cdf[:, -1] = 1
+        self._action_cdf = (cdf + np.arange(ns)[:, None]).ravel()
+
+        # cumulative next-state probabilities, offset by row (state-action)
+        P, R = mdp._flat()
+        P.sum_duplicates()
+        counts = np.diff(P.indptr)
+        rows = np.repeat(np.arange(ns*na), counts)
+        csum = np.concatenate([[0], np.cumsum(P.data)])
+        before = csum[P.indptr[:-1]]
+        total = csum[P.indptr[1:]] - before
+        cdf = (csum[1:] - before[rows]) / total[rows]
+        cdf[P.indptr[1:][counts > 0] - 1] = 1
+        self._state_cdf = cdf + rows
+        self._next = P.indices
+        self._reward = R.data
+
+    def sample(self, T, seeds, s0=None, block_size=4096):
+        """Sample a trajectory of `T` steps for each seed.
+
+        When a terminal state is reached, the next step begins from the start
+        state (so the trajectory spans multiple episodes).
+
+        Args:
+            T: The number of steps to sample.
+            seeds: A sequence of seeds, one per trajectory; each trajectory
+                depends only on its own seed.
+            s0 (optional): The index of the initial state (defaults to the
+                MDP's start state).
+            block_size (optional): Number of steps of random numbers to
+                generate at a time.
+
+        Returns:
+            A dictionary of `(N, T)` arrays `s`, `a`, `r` and `sp`, with states
+            and actions given as indices into `mdp.states` and `mdp.actions`.
+        """
+        rngs = [np.random.default_rng(seed) for seed in seeds]
+        n, na = len(rngs), self.mdp.num_actions
+        start = self.mdp.start if s0 is None else s0
+        terminal = self.mdp.terminal
+
+        ret = {'s': np.empty((n, T), dtype=np.intp),
+               'a': np.empty((n, T), dtype=np.intp),
+               'r': np.empty((n, T)),
+               'sp': np.empty((n, T), dtype=np.intp)}
+        s = np.full(n, start, dtype=np.intp)
+        for lo in range(0, T, block_size):
+            hi = min(lo + block_size, T)
+            # one pair of uniforms per step, so blocking doesn't change them
+            u = np.stack([rng.random((hi - lo, 2)) for rng in rngs])
+            for t in range(lo, hi):
+                # select actions, then next states, by inverting the CDFs
+                a = np.searchsorted(self._action_cdf, s + u[:, t-lo, 0],
+                                    side='right') - s*na
+                row = s*na + a
+                k = np.searchsorted(self._state_cdf, row + u[:, t-lo, 1],
+                                    side='right')
+                sp = self._next[k]
+                ret['s'][:, t] = s
+                ret['a'][:, t] = a
+                ret['r'][:, t] = self._reward[k]
+                ret['sp'][:, t] = sp
+                s = np.where(terminal[sp], start, sp)
+        return ret
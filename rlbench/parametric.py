@@ -7,17 +7,37 @@ from collections import UserDict
 
 
 def to_parameter(x):
-    """Helper function for converting values into `Parameter` objects."""
+    """Helper function for converting values into `Parameter` objects.
+
+    One-dimensional arrays, holding a value for each of the states `0, ...,
+    n-1`, are represented by an `ArrayState`, and dictionaries by a `MapState`.
+    """
     if isinstance(x, Parameter):
         return x
     elif isinstance(x, numbers.Number):
         return Constant(x)
     elif isinstance(x, dict):
         return MapState(x)
+    elif isinstance(x, np.ndarray) and x.ndim == 1:
+        return ArrayState(x)
     else:
         raise TypeError("Unable to represent as a parameter:", x)
 
 
+def _as_indices(s, n):
+    """Convert an array of states to indices, checking that every state is
+    one of the integers `0, ..., n-1`.
+    """
+    keys = np.asarray(s)
+    if keys.size == 0:
+        return keys.astype(int)
+    if keys.dtype.kind not in 'iu':
+        raise KeyError("States must be integers, not %s" % keys.dtype)
+    if keys.min() < 0 or keys.max() >= n:
+        raise KeyError("States must be between 0 and %d" % (n - 1))
+    return keys
+
+
 class Parameter:
     """Base class for parameters."""
     def __init__(self, *args, **kwargs):
@@ -26,6 +46,15 @@ class Parameter:
     def __call__(self, *args, **kwargs) -> float:
         pass
 
+    def batch(self, s, a=None, sp=None):
+        """Evaluate the parameter for a sequence of transitions, given as
+        sequences of states, actions and next states, returning an array.
+        """
+        n = len(s) if s is not None else len(sp)
+        a = [None]*n if a is None else a
+        sp = [None]*n if sp is None else sp
+        return np.array([self(*args) for args in zip(s, a, sp)], dtype=float)
+
 
 class Constant(Parameter):
     """A constant parameter. Returns the value supplied during initialization
@@ -37,6 +66,10 @@ class Constant(Parameter):
     def __call__(self, *args, **kwargs) -> float:
         return self.value
 
+    def batch(self, s, a=None, sp=None):
+        n = len(s) if s is not None else len(sp)
+        return np.full(n, self.value)
+
 
 class MapState(UserDict, Parameter):
     """A function that maps keys to values, essentially like a dictionary, 
@@ -73,3 +106,83 @@ class FirstVisit(Parameter):
 
     def reset(self):
         self.unseen = {k: True for k in self.unseen}
+
+
+class ArrayState(Parameter):
+    """A parameter given by an array of values indexed by the current state,
+    `s`, for environments whose states are the integers `0, ..., n-1`.
+
+    Called with an array of states, it returns the array of their values.
+    As with `MapState`, a `KeyError` is raised for any other state. The values
+    are copied, and should not be modified afterwards.
+    """
+    def __init__(self, values):
+        self.values = np.array(values, dtype=float)
+        if self.values.ndim != 1:
+            raise ValueError("Expected a one-dimensional array of values")
+        self.values.flags.writeable = False
+        # as a list, for quickly looking up one state at a time
+        self.items = self.values.tolist()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, s):
+        if isinstance(s, numbers.Integral) and 0 <= s < len(self.items):
+            return self.items[s]
+        raise KeyError(s)
+
+    def __call__(self, s, a=None, sp=None):
+        if np.ndim(s):
+            return self.values[_as_indices(s, len(self.values))]
+        return self[s]
+
+    def batch(self, s, a=None, sp=None):
+        return self.values[_as_indices(s, len(self.values))]
+
+
+class ArrayNextState(ArrayState):
+    """Like `ArrayState`, but indexed by the *subsequent* state, (that is, s'
+    in the transition (s, a, s')).
+    """
+    def __call__(self, s, a, sp):
+        return ArrayState.__call__(self, sp)
+
+    def batch(self, s, a=None, sp=None):
+        return ArrayState.batch(self, sp)
+
+
+class ArrayFirstVisit(Parameter):
+    """Like `FirstVisit`, for the states `0, ..., n-1`: returns the value of a
+    state the first time it is called with that state, zero thereafter.
+
+    Called with an array of states, only the first occurrence of each state
+    that has not already been seen gets its value.
+    """
+    def __init__(self, values):
+        self.values = np.array(values, dtype=float)
+        self.unseen = np.ones(len(self.values), dtype=bool)
+
+    def __call__(self, key, *args):
+        if np.ndim(key):
+            return self.batch(key)
+        if (isinstance(key, numbers.Integral) and 0 <= key < len(self.values)
+                and self.unseen[key]):
+            self.unseen[key] = False
+            return float(self.values[key])
+        return 0
+
+    def batch(self, s, a=None, sp=None):
+        keys = np.asarray(s)
+        if keys.size and keys.dtype.kind not in 'iu':
+            raise KeyError("States must be integers, not %s" % keys.dtype)
+        ret = np.zeros(len(keys))
+        valid = np.flatnonzero((keys >= 0) & (keys < len(self.values)))
+        uniq, first = np.unique(keys[valid], return_index=True)
+        first = valid[first[self.unseen[uniq]]]
+        ret[first] = self.values[keys[first]]
+        self.unseen[uniq] = False
+        return ret
+
+    def reset(self):
+        self.unseen[:] = True
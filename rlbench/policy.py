@@ -6,12 +6,129 @@ TODO: Options
 TODO: More generally parameterizable policies.
 """
 import numpy as np
-from collections import defaultdict
+from bisect import bisect_right
+from collections.abc import MutableMapping
+from itertools import accumulate
+
+
+class UniformStream:
+    """Uniform random variates on [0, 1), drawn from a `np.random.Generator`
+    in blocks of `block_size` at a time rather than one per call.
+
+    Args:
+        rng (optional): A `np.random.Generator`, or a seed for creating one.
+            If unspecified, the seed is drawn from NumPy's global random
+            state, so that `np.random.seed` still makes runs reproducible.
+        block_size (optional): The number of variates to draw at once.
+    """
+    def __init__(self, rng=None, block_size=4096):
+        if rng is None:
+            rng = np.random.randint(2**63, dtype=np.int64)
+        self.rng = np.random.default_rng(rng)
+        self.block_size = block_size
+        self._block = []
+        self._pos = 0
+
+    def __call__(self):
+        """Return the next uniform variate."""
+        if self._pos >= len(self._block):
+            self._block = self.rng.random(self.block_size).tolist()
+            self._pos = 0
+        self._pos += 1
+        return self._block[self._pos - 1]
+
+    def sample(self, n):
+        """Return an array of the next `n` uniform variates."""
+        ret = np.array(self._block[self._pos:self._pos+n])
+        self._pos += len(ret)
+        if len(ret) < n:
+            ret = np.concatenate([ret, self.rng.random(n - len(ret))])
+        return ret
+
+
+def sample(probs, u):
+    """Select an index according to the probabilities `probs`, using the
+    uniform variate `u` (i.e., by inverting the cumulative distribution).
+    """
+    cdf = list(accumulate(probs))
+    return min(bisect_right(cdf, u*cdf[-1]), len(cdf) - 1)
+
+
+def alias_tables(probs):
+    """Compute the tables for sampling from each row of `probs` in O(1) time
+    via the alias method (using Vose's algorithm).
+
+    Returns:
+        q: For each row and column, the probability of keeping the column.
+        alias: For each row and column, the column to select instead.
+    """
+    probs = np.atleast_2d(np.asarray(probs, dtype=float))
+    nrows, k = probs.shape
+    q = np.ones((nrows, k))
+    alias = np.tile(np.arange(k), (nrows, 1))
+    for i, row in enumerate(probs):
+        scaled = row * k / np.sum(row)
+        small = [j for j in range(k) if scaled[j] < 1]
+        large = [j for j in range(k) if scaled[j] >= 1]
+        while small and large:
+            lo, hi = small.pop(), large.pop()
+            q[i, lo] = scaled[lo]
+            alias[i, lo] = hi
+            scaled[hi] -= 1 - scaled[lo]
+            (small if scaled[hi] < 1 else large).append(hi)
+        # anything remaining is kept with probability one (up to rounding)
+        for j in small + large:
+            q[i, j] = 1
+    return q, alias
+
+
+def action_probability(pol, s, a, actions):
+    """The probability of policy `pol` selecting action `a` from `actions` in
+    state `s`.
+    """
+    probs = pol.probabilities(s, actions)
+    return probs[list(actions).index(a)]
 
 
 class Policy:
-    def __init__(self, *args, **kwargs):
-        pass
+    # whether the action probabilities for each state are fixed, so that
+    # quantities derived from them can be precomputed (e.g., by agents)
+    stationary = False
+    # number of times the policy has been modified
+    _version = 0
+
+    def __init__(self, *args, rng=None, **kwargs):
+        self.seed(rng)
+
+    def __setattr__(self, name, value):
+        # count changes to public attributes, invalidating derived quantities
+        if not name.startswith('_'):
+            object.__setattr__(self, '_version', self._version + 1)
+        object.__setattr__(self, name, value)
+
+    def modified(self):
+        """Mark the policy as modified, which is needed after changing any of
+        its attributes in place.
+        """
+        self._version += 1
+
+    @property
+    def version(self):
+        """A counter that changes whenever the policy is modified."""
+        return self._version
+
+    def seed(self, rng=None):
+        """Set the random number stream used to select actions, from a
+        `np.random.Generator` or a seed (see `UniformStream`).
+        """
+        self._uniform = UniformStream(rng)
+
+    @property
+    def uniform(self):
+        """The stream of uniform variates used to select actions."""
+        if getattr(self, '_uniform', None) is None:
+            self.seed()
+        return self._uniform
 
     def choose(self, s, actions):
         """ Select an action from possible actions in response to state `s`.
@@ -44,30 +161,108 @@ class RandomPolicy(Policy):
     """ A policy which selects a random action from the available actions every
     time, regardless of the state that it is in.
     """
+    stationary = True
+
     def choose(self, s, actions):
         """Randomly select from available actions, with equal probability."""
-        return np.random.choice(actions)
+        actions = list(actions)
+        return actions[int(self.uniform() * len(actions))]
 
     def probabilities(self, s, actions):
         return np.ones(len(actions))/len(actions)
 
 
+class Distribution(MutableMapping):
+    """A mapping of actions to probabilities, which are zero for any action
+    that is not present.
+
+    Changes are reported to the policy that owns the distribution (if any)
+    via its `modified` method.
+    """
+    def __init__(self, probs, owner=None):
+        # TODO: check that probabilities sum to one
+        self._probs = dict(probs)
+        self._owner = owner
+
+    def __getitem__(self, a):
+        return self._probs.get(a, 0)
+
+    def __setitem__(self, a, p):
+        self._probs[a] = p
+        if self._owner is not None:
+            self._owner.modified()
+
+    def __delitem__(self, a):
+        del self._probs[a]
+        if self._owner is not None:
+            self._owner.modified()
+
+    def __iter__(self):
+        return iter(self._probs)
+
+    def __len__(self):
+        return len(self._probs)
+
+    def __repr__(self):
+        return 'Distribution(%r)' % self._probs
+
+
+class PolicyTable(MutableMapping):
+    """A mapping of states to the `Distribution` over actions in each, which
+    reports changes to the policy that owns it, like `Distribution`.
+    """
+    def __init__(self, dct, owner=None):
+        self._owner = owner
+        self._dists = {s: Distribution(actions, owner)
+                       for s, actions in dct.items()}
+
+    def __getitem__(self, s):
+        return self._dists[s]
+
+    def __setitem__(self, s, actions):
+        self._dists[s] = Distribution(actions, self._owner)
+        if self._owner is not None:
+            self._owner.modified()
+
+    def __delitem__(self, s):
+        del self._dists[s]
+        if self._owner is not None:
+            self._owner.modified()
+
+    def __iter__(self):
+        return iter(self._dists)
+
+    def __len__(self):
+        return len(self._dists)
+
+    def __repr__(self):
+        return 'PolicyTable(%r)' % self._dists
+
+
 class FixedPolicy(Policy):
     """ A policy which selects actions according to a fixed distribution for
     each state.
+
+    The distributions in `pol` may be modified in place (e.g.,
+    `pol[s][a] = p`), which updates the policy's `version`, so that agents
+    relying on the policy being stationary can detect the change.
     """
-    def __init__(self, dct):
+    stationary = True
+
+    def __init__(self, dct, rng=None):
+        self.seed(rng)
         # define the policy from the supplied dictionary
-        self.pol = dict()
-        for s, actions in dct.items():
-            # dictionary of probabilities-- zero when an action is not present
-            self.pol[s] = defaultdict(int)
-            for a, p in actions.items():
-                # TODO: check that probabilities sum to one
-                self.pol[s][a] = p
+        self.pol = dct
+
+    def __setattr__(self, name, value):
+        if name == 'pol':
+            value = PolicyTable(value, self)
+        super().__setattr__(name, value)
 
     def choose(self, s, actions):
-        return np.random.choice(actions, p=[self.pol[s][a] for a in actions])
+        actions = list(actions)
+        probs = [self.pol[s][a] for a in actions]
+        return actions[sample(probs, self.uniform())]
 
     def prob(self, s, a):
         return self.pol[s][a]
@@ -75,18 +270,103 @@ class FixedPolicy(Policy):
     def probabilities(self, s, actions):
         return [self.pol[s][a] for a in actions]
 
+    def compile(self, states=None, actions=None, rng=None):
+        """Convert to a `CompiledPolicy`, defaulting to the states of the
+        policy and every action that is given a probability in any of them.
+        """
+        if states is None:
+            states = list(self.pol.keys())
+        if actions is None:
+            actions = {a for dist in self.pol.values() for a in dist}
+            try:
+                actions = sorted(actions)
+            except TypeError:
+                actions = list(actions)
+        probs = [[self.pol[s][a] for a in actions] for s in states]
+        return CompiledPolicy(states, actions, probs, rng=rng)
+
+
+class CompiledPolicy(Policy):
+    """ A policy which selects actions according to a fixed distribution for
+    each state, stored as an `(|S|, |A|)` probability matrix, with states and
+    actions mapped to integer indices.
+
+    Actions are sampled via the alias method, taking O(1) time per draw, and
+    can also be sampled for many states at once with `sample_indices`.
+    The `actions` passed to `choose` are assumed to be those the policy was
+    compiled with (actions that are unavailable should have zero probability).
+    The arrays are read-only; to change the policy, assign new ones.
+    """
+    stationary = True
+
+    def __init__(self, states, actions, probs, rng=None):
+        self.seed(rng)
+        self.states = list(states)
+        self.actions = list(actions)
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.action_index = {a: j for j, a in enumerate(self.actions)}
+        self.probs = probs
+
+    def __setattr__(self, name, value):
+        # keep the sampling tables consistent with the probabilities
+        if name == 'probs':
+            value = np.array(value, dtype=float)
+            value.setflags(write=False)
+        super().__setattr__(name, value)
+        if name == 'probs':
+            q, alias = alias_tables(self.probs)
+            q.setflags(write=False)
+            alias.setflags(write=False)
+            super().__setattr__('q', q)
+            super().__setattr__('alias', alias)
+            # lists are faster than arrays for looking up single entries
+            self._q = q.tolist()
+            self._alias = alias.tolist()
+
+    def choose(self, s, actions=None):
+        return self.actions[self.sample_index(self.state_index[s],
+                                              self.uniform())]
+
+    def sample_index(self, i, u):
+        """Select an action index for the state with index `i`, using the
+        uniform variate `u`.
+        """
+        u *= len(self.actions)
+        j = int(u)
+        if u - j >= self._q[i][j]:
+            j = self._alias[i][j]
+        return j
+
+    def sample_indices(self, state_indices):
+        """Sample action indices for an array of state indices at once."""
+        state_indices = np.asarray(state_indices)
+        u = self.uniform.sample(state_indices.size) * len(self.actions)
+        j = u.astype(int)
+        keep = (u - j) < self.q[state_indices.ravel(), j]
+        ret = np.where(keep, j, self.alias[state_indices.ravel(), j])
+        return ret.reshape(state_indices.shape)
+
+    def prob(self, s, a):
+        return self.probs[self.state_index[s], self.action_index[a]]
+
+    def probabilities(self, s, actions):
+        row = self.probs[self.state_index[s]]
+        return [row[self.action_index[a]] for a in actions]
+
 
 class ObliviousPolicy(Policy):
     """ A policy which takes actions according to a set of fixed preferences,
     or if none of its preferred actions are available, selects a random action.
     """
-    def __init__(self, preferences):
+    def __init__(self, preferences, rng=None):
         """
         Initialize the policy.
 
         Args:
             preferences: An list of actions, in order of preference.
+            rng (optional): Random number stream for selecting actions.
         """
+        self.seed(rng)
         # check that preferences are well formed
         self.preferences = preferences
 
@@ -95,4 +375,12 @@ class ObliviousPolicy(Policy):
             if p in actions:
                 return p
         else:
-            return np.random.choice(actions)
+            actions = list(actions)
+            return actions[int(self.uniform() * len(actions))]
+
+    def probabilities(self, s, actions):
+        actions = list(actions)
+        for p in self.preferences:
+            if p in actions:
+                return [float(a == p) for a in actions]
+        return np.ones(len(actions))/len(actions)
@@ -0,0 +1,231 @@
+"""
+Offline replay of recorded trajectories to learning algorithms.
+
+Replaying a single recorded trajectory to each algorithm under comparison gives
+them all exactly the same experience, and avoids the cost of simulating the
+environment and selecting actions for every run. The features of each distinct
+state are computed once, and the per-step parameters and importance sampling
+ratios are computed once, up front, and shared by every algorithm replayed.
+
+Recorded columns (which may be memory-mapped, from a `TrajectoryReader`) are
+used as they are, and read a chunk at a time during replay, so that long
+trajectories need not be loaded into memory; constant parameters are stored
+as scalars rather than expanded into per-step arrays.
+"""
+from itertools import repeat
+import numpy as np
+from features import ActiveFeatures, feature_matrix
+from parametric import Constant, to_parameter
+from policy import action_probability
+from trajectory import STEP_COLUMNS, TrajectoryReader
+
+
+# number of steps to read from each column at a time
+CHUNK_SIZE = 2**16
+
+
+def as_columns(steps):
+    """Convert a trajectory to a dictionary of columns.
+
+    The trajectory may be a list of `(s, a, r, sp)` tuples (as returned by
+    `run_policy`), a list of contexts (as returned by `run_policy_verbose`), a
+    `TrajectoryReader`, or already a dictionary of columns.
+    """
+    if isinstance(steps, TrajectoryReader):
+        return dict(steps.columns)
+    elif isinstance(steps, dict):
+        return steps
+    steps = list(steps)
+    if steps and isinstance(steps[0], dict):
+        return {k: [ctx[k] for ctx in steps] for k in steps[0]}
+    return {k: [step[i] for step in steps] for i, k in enumerate(STEP_COLUMNS)}
+
+
+def _index_states(s, sp, chunk_size=CHUNK_SIZE):
+    """Find the distinct states in a trajectory, returning them along with the
+    index of each step's state and next state.
+
+    Numeric columns are processed a chunk at a time, and if the states are the
+    integers `0, ..., n-1`, the columns themselves serve as the indices.
+    """
+    s, sp = np.asarray(s), np.asarray(sp)
+    if s.ndim == sp.ndim == 1 and {s.dtype.kind, sp.dtype.kind} <= set('biuf'):
+        parts = [np.unique(col[lo:lo+chunk_size]) for col in (s, sp)
+                 for lo in range(0, len(col), chunk_size)]
+        states = np.unique(np.concatenate(parts)) if parts else s[:0]
+        if ({s.dtype.kind, sp.dtype.kind} <= set('iu') and
+                np.array_equal(states, np.arange(len(states)))):
+            return states.tolist(), s, sp
+        idx, idx_p = np.empty(len(s), dtype=int), np.empty(len(sp), dtype=int)
+        for col, ret in ((s, idx), (sp, idx_p)):
+            for lo in range(0, len(col), chunk_size):
+                ret[lo:lo+chunk_size] = np.searchsorted(
+                    states, col[lo:lo+chunk_size])
+        return states.tolist(), idx, idx_p
+    index = {}
+    inverse = np.array([index.setdefault(x, len(index))
+                        for x in list(s) + list(sp)], dtype=int)
+    n = len(s)
+    return list(index.keys()), inverse[:n], inverse[n:]
+
+
+def _rows(X):
+    """Split a (dense or sparse) feature matrix into per-state vectors."""
+    if isinstance(X, np.ndarray):
+        return list(X)
+    X = X.tocsr()
+    return [ActiveFeatures(X.indices[lo:hi], X.data[lo:hi], X.shape[1])
+            for lo, hi in zip(X.indptr[:-1], X.indptr[1:])]
+
+
+class Replay:
+    """Replay a recorded trajectory to any number of learning algorithms.
+
+    Args:
+        steps: The trajectory (see `as_columns` for the accepted forms).
+        phi: The feature function.
+        target (optional): The target policy. If given, the trajectory must
+            record the behavior policy's probability for each action taken as
+            `mu`, and `rho` is computed from the target policy's probability
+            for the action among those available. Alternatively, `rho` is
+            computed from recorded `pi` and `mu` columns, or else is one.
+        param_funcs (optional): Parameter functions for parameters that were
+            not recorded in the trajectory, e.g., `{'gm': 0.9}`.
+        actions (optional): The actions available, as a function of the state
+            or a sequence of the actions available in every state, for
+            computing the target policy's probabilities. Defaults to those
+            recorded for each step (by `run_policy_verbose`), or else to
+            every action taken in the trajectory.
+    """
+    def __init__(self, steps, phi, target=None, param_funcs=dict(),
+                 actions=None):
+        cols = as_columns(steps)
+        s, a, sp = cols['s'], cols['a'], cols['sp']
+        self.num_steps = len(s)
+        self.r = np.asarray(cols['r'], dtype=float)
+
+        # compute the features for each distinct state only once
+        self.states, self.idx, self.idx_p = _index_states(s, sp)
+        self.X = feature_matrix(phi, self.states)
+        self._features = _rows(self.X)
+
+        # recorded per-step parameters, and those computed from functions
+        self.params = {k: np.asarray(v, dtype=float) for k, v in cols.items()
+                       if k not in STEP_COLUMNS + ('pi', 'mu', 'actions')}
+        for k, v in param_funcs.items():
+            func = to_parameter(v)
+            if isinstance(func, Constant):
+                self.params[k] = func.value
+                continue
+            self.params[k] = np.empty(self.num_steps)
+            for lo in range(0, self.num_steps, CHUNK_SIZE):
+                hi = lo + CHUNK_SIZE
+                self.params[k][lo:hi] = func.batch(s[lo:hi], a[lo:hi],
+                                                   sp[lo:hi])
+
+        # importance sampling ratios
+        if target is not None:
+            if 'mu' not in cols:
+                raise ValueError("The behavior policy's probabilities (`mu`) "
+                                 "are needed to compute rho for the target")
+            available = cols.get('actions') if actions is None else None
+            pi = self._target_probs(target, a, actions, available)
+            self.rho = pi/np.asarray(cols['mu'], dtype=float)
+        elif 'mu' in cols and 'pi' in cols:
+            self.rho = np.asarray(cols['pi'], dtype=float)/np.asarray(cols['mu'])
+        elif 'mu' in cols:
+            raise ValueError("The trajectory records the behavior policy's "
+                             "probabilities (`mu`) but not the target's "
+                             "(`pi`); pass the target policy to compute rho")
+        else:
+            self.rho = np.broadcast_to(1.0, (self.num_steps,))
+
+    def _target_probs(self, target, a, actions=None, available=None):
+        """The target policy's probability for each action taken, evaluated
+        once per distinct state and action (and set of available actions).
+        """
+        if actions is None:
+            actions = set()
+            for lo in range(0, self.num_steps, CHUNK_SIZE):
+                actions.update(np.unique(a[lo:lo+CHUNK_SIZE]).tolist())
+            try:
+                actions = sorted(actions)
+            except TypeError:
+                actions = list(actions)
+        probs = {}
+        ret = np.empty(self.num_steps)
+        for lo in range(0, self.num_steps, CHUNK_SIZE):
+            hi = lo + CHUNK_SIZE
+            steps = zip(np.asarray(self.idx[lo:hi]).tolist(),
+                        np.asarray(a[lo:hi]).tolist(),
+                        repeat(None) if available is None
+                        else available[lo:hi])
+            for t, (i, act, acts) in enumerate(steps, lo):
+                key = (i, act) if acts is None else (i, act, tuple(acts))
+                if key not in probs:
+                    s = self.states[i]
+                    if acts is None:
+                        acts = actions(s) if callable(actions) else actions
+                    probs[key] = action_probability(target, s, act, acts)
+                ret[t] = probs[key]
+        return ret
+
+    def __len__(self):
+        return self.num_steps
+
+    def _steps(self, algo, params):
+        """Iterate over the steps as `(i, r, j, *args)` tuples, with `i` and
+        `j` the indices of the state and next state, and `args` the arguments
+        for `algo`'s update, reading the per-step columns a chunk at a time.
+        """
+        values = dict(self.params, rho=self.rho)
+        values.update(params)
+        cols = [self.idx, self.r, self.idx_p]
+        cols += [values[k] for k in algo.update_params]
+        for k, col in zip(algo.update_params, cols[3:]):
+            if np.ndim(col) and len(col) != self.num_steps:
+                raise ValueError("Parameter %s has %d values for %d steps" %
+                                 (k, len(col), self.num_steps))
+        for lo in range(0, self.num_steps, CHUNK_SIZE):
+            hi = lo + CHUNK_SIZE
+            yield from zip(*[np.asarray(col[lo:hi]).tolist() if np.ndim(col)
+                             else repeat(float(col)) for col in cols])
+
+    def run(self, algo, **params):
+        """Feed the trajectory to `algo`, with `params` (constants or per-step
+        arrays) overriding the trajectory's parameters. Returns the algorithm.
+        """
+        phi = self._features
+        for i, r, j, *args in self._steps(algo, params):
+            algo.update(phi[i], r, phi[j], *args)
+        return algo
+
+    def weights(self, algo, schedule, **params):
+        """Feed the trajectory to `algo` as in `run`, returning an array of the
+        algorithm's weights after each of the steps in `schedule` (as from
+        `eval_schedule`, with steps counted from one).
+        """
+        phi = self._features
+        schedule = np.asarray(schedule)
+        ret = np.full((len(schedule),) + np.shape(algo.theta), np.nan)
+        k = 0
+        for t, (i, r, j, *args) in enumerate(self._steps(algo, params), 1):
+            if k >= len(schedule):
+                break
+            algo.update(phi[i], r, phi[j], *args)
+            if t == schedule[k]:
+                ret[k] = algo.theta
+                k += 1
+        return ret[:k]
+
+    def run_all(self, algos):
+        """Replay the trajectory to several algorithms.
+
+        Args:
+            algos: A dictionary mapping names to `(algo, params)` pairs.
+
+        Returns:
+            A dictionary mapping names to the algorithms after replay.
+        """
+        return {name: self.run(algo, **params)
+                for name, (algo, params) in algos.items()}
@@ -3,13 +3,15 @@
 Implementation of code for benchmarking reinforcement learning algorithms.
 """
 import numpy as np
-from collections import defaultdict
-from parametric import to_parameter
+from parametric import Constant, to_parameter
+from features import feature_matrix
+from policy import action_probability
 
 
-def run_episode(agent, env, max_steps):
-    """Run an episode in a policy evaluation experiment."""
-    ret = []
+def iter_episode(agent, env, max_steps):
+    """Run an episode in a policy evaluation experiment, yielding each
+    transition as `(s, a, r, sp)` after the agent has been updated with it.
+    """
     t = 0
 
     # reset the environment and get initial state
@@ -24,29 +26,68 @@ def run_episode(agent, env, max_steps):
         # update the agent
         agent.update(s, a, r, sp)
 
-        # record the transition
-        ret.append((s, a, r, sp))
+        # emit the transition
+        yield (s, a, r, sp)
 
         # prepare for next iteration
         t += 1
         s = sp
-    return ret
 
-def run_many(agent_lst, behavior, env, max_steps):
+def run_episode(agent, env, max_steps):
+    """Run an episode in a policy evaluation experiment."""
+    return list(iter_episode(agent, env, max_steps))
+
+def run_many(agent_lst, behavior, env, max_steps, features=None):
+    """Run several agents on a single stream of experience from `behavior`.
+
+    Agents are grouped by their feature function, so that the features of each
+    state are computed once per step for every agent sharing that function,
+    and the features of the next state are carried over to the next step.
+
+    Args:
+        agent_lst: The agents to update.
+        behavior: The policy used to select actions.
+        env: The environment.
+        max_steps: The maximum number of steps to run for.
+        features (optional): A dictionary mapping feature functions to
+            precomputed dictionaries of features (e.g., from `get_features`),
+            which are used instead of calling those functions.
+    """
     steps = []
-    error_dct = {}
     t = 0
 
+    # group the agents by feature function
+    groups = {}
+    for agent in agent_lst:
+        phi = getattr(agent, 'phi', None)
+        groups.setdefault(id(phi), (phi, []))[1].append(agent)
+    features = dict() if features is None else features
+    tables = [(phi, features.get(phi), agents)
+              for phi, agents in groups.values()]
+    last = [None]*len(tables)
+
     # reset the environment and get initial state
     env.reset()
     s = env.state
     while not env.is_terminal() and t < max_steps:
-        a = behavior.choose(s, env.actions)
+        actions = env.actions
+        a = behavior.choose(s, actions)
         r, sp = env.do(a)
 
-        # update the agents
-        for agent in agent_lst:
-            delta = agent.update(s, a, r, sp)
+        # update the agents (with the available actions, for computing rho)
+        for i, (phi, table, agents) in enumerate(tables):
+            if phi is None:
+                for agent in agents:
+                    agent.update(s, a, r, sp, actions=actions)
+                continue
+            if table is not None:
+                x, xp = table[s], table[sp]
+            else:
+                x = last[i] if t else phi(s)
+                xp = phi(sp)
+            last[i] = xp
+            for agent in agents:
+                agent.update(s, a, r, sp, actions=actions, x=x, xp=xp)
 
         # record the transition
         steps.append((s, a, r, sp))
@@ -60,22 +101,78 @@ def run_many(agent_lst, behavior, env, max_steps):
     return ret
 
 
-def run_errors(agent, env, max_steps, val_dct):
+def eval_schedule(max_steps, every=None, num=None, log=False):
+    """Determine the steps at which to evaluate an agent during a run.
+
+    Steps are counted from one, so step `t` is the point at which the agent
+    has made `t` updates. By default, every step is included.
+
+    Args:
+        max_steps: The maximum number of steps in the run.
+        every (optional): Evaluate once every `every` steps.
+        num (optional): Evaluate at (at most) `num` points, spaced linearly, or
+            logarithmically if `log` is true, up to and including `max_steps`.
+
+    Returns:
+        A sorted array of unique steps.
+    """
+    if every is not None:
+        if every < 1:
+            raise ValueError("Must evaluate every one or more steps, not %r"
+                             % every)
+        return np.arange(every, max_steps+1, every)
+    elif num is not None:
+        if num < 1:
+            raise ValueError("Must evaluate at one or more points, not %r"
+                             % num)
+        if log:
+            points = np.geomspace(1, max_steps, num)
+        else:
+            points = np.linspace(max_steps/num, max_steps, num)
+        return np.unique(np.round(points).astype(int))
+    return np.arange(1, max_steps+1)
+
+
+def check_schedule(schedule):
+    """Validate a schedule of steps (counted from one), returning them as a
+    sorted array without duplicates.
+    """
+    arr = np.asarray(schedule)
+    if arr.ndim != 1:
+        raise ValueError("Schedule must be a sequence of steps")
+    if arr.size and (arr.dtype.kind not in 'iuf' or
+                     np.any(arr != np.round(arr)) or np.any(arr < 1)):
+        raise ValueError("Scheduled steps must be integers of at least one")
+    return np.unique(arr.astype(int))
+
+
+def run_errors(agent, env, max_steps, val_dct, schedule=None):
     """Run an episode in a policy evaluation experiment, recording the agent's
     RMSE vs. known state values.
+
+    The errors are recorded after each of the steps in `schedule` (see
+    `eval_schedule`), defaulting to every step; the schedule is sorted, and
+    any repeated steps removed. Returns an array of the errors at the
+    scheduled steps that were reached before the episode terminated, with an
+    extra axis for agents whose algorithm has multiple weight vectors.
     """
-    ret = []
     t = 0
+    if schedule is None:
+        schedule = eval_schedule(max_steps)
+    schedule = check_schedule(schedule)
 
     # record/precompute information about the environment
-    states = env.states
-    features = {s: agent.phi(s) for s in states}
-    target_values = np.array([val_dct[s] for s in states])
+    agent.bind(env)
+    target_values = np.array([val_dct[s] for s in agent.states])
+
+    # preallocate the errors, and track the next step to evaluate
+    ret = np.full((len(schedule),) + np.shape(agent.theta)[:-1], np.nan)
+    k = 0
 
     # reset the environment and get initial state
     env.reset()
     s = env.state
-    while not env.is_terminal() and t < max_steps:
+    while not env.is_terminal() and t < max_steps and k < len(schedule):
         # choose an action, take it, and observe the result
         actions = env.actions
         a = agent.choose(s, actions)
@@ -84,24 +181,22 @@ def run_errors(agent, env, max_steps, val_dct):
         # update the agent
         agent.update(s, a, r, sp)
 
-        # get the agent's state values and compare with the target values
-        theta = agent.theta
-        values = np.array([np.dot(theta, features[s]) for s in states])
-        difference = target_values - values
-        error = np.sqrt(np.mean(difference**2))
-
-        # record the transition
-        ret.append(error)
-
         # prepare for next iteration
         t += 1
         s = sp
-    return ret
 
+        # compare the agent's state values with the target values
+        if t == schedule[k]:
+            difference = agent.values().T - target_values
+            ret[k] = np.sqrt(np.mean(difference**2, axis=-1))
+            k += 1
+    return ret[:k]
 
-def run_policy(pol, env, max_steps, param_funcs=dict()):
-    """Run a policy in an environment for a specified number of steps."""
-    ret = []
+
+def iter_policy(pol, env, max_steps):
+    """Run a policy in an environment for a specified number of steps,
+    yielding each transition as `(s, a, r, sp)`.
+    """
     t = 0
 
     # reset the environment and get initial state
@@ -113,22 +208,22 @@ def run_policy(pol, env, max_steps, param_funcs=dict()):
         a = pol.choose(s, actions)
         r, sp = env.do(a)
 
-        # record the transition
-        ret.append((s, a, r, sp))
+        # emit the transition
+        yield (s, a, r, sp)
 
         # prepare for next iteration
         s = sp
         t += 1
-    return ret
 
-def run_policy_verbose(pol, env, max_steps, param_funcs=dict()):
-    """Run a policy in an environment for a specified number of steps.
+def run_policy(pol, env, max_steps, param_funcs=dict()):
+    """Run a policy in an environment for a specified number of steps."""
+    return list(iter_policy(pol, env, max_steps))
 
-    Provide enough information to run the online algorithms offline by recording
-    each step's entire context, potentially including the values of parameter
-    functions at each point in time.
+def iter_policy_verbose(pol, env, max_steps, param_funcs=dict(),
+                        record_probs=False):
+    """Run a policy in an environment for a specified number of steps,
+    yielding the context of each step (as in `run_policy_verbose`).
     """
-    ret = []
     t = 0
 
     # convert parameter functions to `Parameter` type, if needed
@@ -149,14 +244,28 @@ def run_policy_verbose(pol, env, max_steps, param_funcs=dict()):
         # record values of parameters for the transition
         for name, func in param_funcs.items():
             ctx[name] = func(s, a, sp)
+        if record_probs:
+            ctx['mu'] = action_probability(pol, s, a, actions)
 
-        # log the context of the transition
-        ret.append(ctx)
+        # emit the context of the transition
+        yield ctx
 
         # prepare for next iteration
         s = sp
         t += 1
-    return ret
+
+def run_policy_verbose(pol, env, max_steps, param_funcs=dict(),
+                       record_probs=False):
+    """Run a policy in an environment for a specified number of steps.
+
+    Provide enough information to run the online algorithms offline by recording
+    each step's entire context, potentially including the values of parameter
+    functions at each point in time.
+    If `record_probs` is true, the probability of the policy having selected
+    each action is recorded as `mu`, allowing for off-policy replay.
+    """
+    return list(iter_policy_verbose(pol, env, max_steps, param_funcs,
+                                    record_probs))
 
 ################################################################################
 # Data Analysis functions
@@ -174,14 +283,15 @@ def get_next_states(lst):
     # lst = [(s1, a1, r2, s2), (s2, a2, r3, s3), ...]
     return [i[3] for i in lst]
 
+def _stepwise(lst, param):
+    """Evaluate a parameter for the state at each step, as an array."""
+    return to_parameter(param).batch(get_states(lst))
+
 def get_gammas(lst, gamma):
-    # convert gamma to state-dependent parameter
-    gamma = to_parameter(gamma)
-    return [gamma(s) for s in get_states(lst)]
+    return _stepwise(lst, gamma).tolist()
 
 def stepwise_params(lst, param):
-    param = to_parameter(param)
-    return [param(s) for s in get_states(lst)]
+    return _stepwise(lst, param).tolist()
 
 def stepwise_return(lst, gamma):
     """Compute the return at each step in a trajectory.
@@ -193,33 +303,125 @@ def stepwise_return(lst, gamma):
     # convert gamma to a state-dependent parameter
     gamma = to_parameter(gamma)
     rewards = get_rewards(lst)
-    gmlst = get_gammas(lst, gamma)
-    n = len(lst)
-    ret = []
-    tmp = 0
-    for r, gm in reversed(list(zip(rewards, gmlst))):
-        tmp *= gm
-        tmp += r
-        ret.append(tmp)
-    return list(reversed(ret))
+    if isinstance(gamma, Constant):
+        gmlst = gamma.value
+    else:
+        gmlst = _stepwise(lst, gamma)
+    return discounted_return(rewards, gmlst).tolist()
+
+def _return_blocks(rewards, gammas, block_size=2**16):
+    """Compute the discounted return `G_t = r_t + gm_t * G_{t+1}` one block
+    at a time, starting from the end of the trajectory.
+
+    Within each block the recurrence is solved as a scan over the affine maps
+    `G -> r_t + gm_t * G`, composing maps `1, 2, 4, ...` steps apart, so that
+    only `log2(block_size)` array operations are needed per block. For a
+    constant discount, `scipy.signal.lfilter` solves the recurrence directly.
+
+    Yields:
+        Tuples `(lo, hi, G)`, with `G` the returns for steps `lo` to `hi`.
+    """
+    n = len(rewards)
+    constant = np.ndim(gammas) == 0
+    tail = 0.0
+    for hi in range(n, 0, -block_size):
+        lo = max(hi - block_size, 0)
+        r = np.asarray(rewards[lo:hi], dtype=float)
+        if constant:
+            from scipy.signal import lfilter
+            G = lfilter([1], [1, -gammas], r[::-1], zi=[gammas*tail])[0][::-1]
+        else:
+            a = np.array(gammas[lo:hi], dtype=float)
+            G = r.copy()
+            k = 1
+            while k < len(G):
+                G[:-k] += a[:-k] * G[k:]
+                a[:-k] *= a[k:]
+                k *= 2
+            G += a * tail
+        tail = G[0]
+        yield lo, hi, G
+
+def discounted_return(rewards, gammas, block_size=2**16):
+    """Compute the discounted return at each step of a trajectory, given
+    arrays of rewards and discount factors (or a constant discount factor),
+    with `G_t = r_t + gm_t * G_{t+1}`.
+
+    The recurrence is solved backwards one block at a time, so the arrays can
+    be memory-mapped (e.g. from a `TrajectoryReader`) without being read into
+    memory all at once.
+    """
+    ret = np.empty(len(rewards))
+    for lo, hi, G in _return_blocks(rewards, gammas, block_size):
+        ret[lo:hi] = G
+    return ret
 
+def _state_indices(states):
+    """Find the distinct states in a sequence, returning them and the index of
+    the state at each step.
+    """
+    arr = np.asarray(states)
+    if arr.ndim == 1 and arr.dtype.kind in 'biuf':
+        unique, inverse = np.unique(arr, return_inverse=True)
+        return unique.tolist(), inverse.ravel()
+    index = {}
+    inverse = np.array([index.setdefault(x, len(index)) for x in states])
+    return list(index.keys()), inverse
+
+def mc_values(indices, rewards, gammas, num_states=None, block_size=2**16):
+    """Every-visit Monte Carlo estimates of the value of each state, averaging
+    the returns following each visit.
+
+    The returns are computed one block at a time (see `discounted_return`)
+    and accumulated per state with `np.bincount`, so only a block of returns
+    is held in memory at once.
+
+    Args:
+        indices: Array of (non-negative integer) state indices for each step.
+        rewards: Array of rewards for each step.
+        gammas: Array of discount factors for each step, or a constant.
+        num_states (optional): The number of states (one more than the largest
+            index, by default).
+        block_size (optional): The number of steps to process at a time.
+
+    Returns:
+        values: The average return from each state (`nan` for states that were
+            never visited).
+        counts: The number of visits to each state.
+    """
+    if num_states is None:
+        num_states = int(np.max(indices)) + 1 if len(indices) else 0
+    totals = np.zeros(num_states)
+    counts = np.zeros(num_states, dtype=np.int64)
+    for lo, hi, G in _return_blocks(rewards, gammas, block_size):
+        idx = np.asarray(indices[lo:hi])
+        totals += np.bincount(idx, weights=G, minlength=num_states)
+        counts += np.bincount(idx, minlength=num_states)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts, counts
 
 def every_visit_mc(lst, gamma):
-    # compute the returns at each step
-    glst = stepwise_return(lst, gamma)
-    # group returns by state
-    dct = defaultdict(list)
-    for x, g in zip(lst, glst):
-        s, a, r, sp = x
-        dct[s].append(g)
+    # compute the returns at each step, grouped by state
+    states, indices = _state_indices(get_states(lst))
+    gamma = to_parameter(gamma)
+    if isinstance(gamma, Constant):
+        gmlst = gamma.value
+    else:
+        gmlst = _stepwise(lst, gamma)
+    values, counts = mc_values(indices, get_rewards(lst), gmlst,
+                               num_states=len(states))
 
     # output the averaged returns for each state
-    return {k: np.mean(v) for k, v in dct.items()}
+    return dict(zip(states, values.tolist()))
 
 def phi_matrix(states, phi):
-    return np.array([phi(s) for s in states])
+    return feature_matrix(phi, states)
 
 def get_features(states, phi):
+    states = list(states)
+    X = feature_matrix(phi, states)
+    if isinstance(X, np.ndarray):
+        return dict(zip(states, X))
     return {s: phi(s) for s in states}
 
 def get_values(states, phi, theta):
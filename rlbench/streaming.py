@@ -0,0 +1,175 @@
+"""
+Streaming analysis of trajectories.
+
+The rollout generators (`iter_policy`, `iter_episode`, `iter_policy_verbose`)
+yield one transition at a time; the consumers defined here summarize them as
+they go by, using memory that depends on the number of states rather than the
+length of the run. Consumers are attached to a stream with `tap`, which passes
+each transition through unchanged (so taps can be chained, and the stream
+consumed by something else), or `consume`, which drains the stream:
+
+    ret, mc = consume(iter_policy(pol, env, 10**6), RunningReturn(0.9),
+                      OnlineMC(0.9))
+"""
+import numpy as np
+from parametric import to_parameter
+
+
+def _unpack(step):
+    """Get `(s, a, r, sp)` from a transition tuple or a context dictionary."""
+    if isinstance(step, dict):
+        return step['s'], step['a'], step['r'], step['sp']
+    return step
+
+
+def tap(steps, *consumers):
+    """Pass each transition in `steps` to each of the consumers, and yield it."""
+    for step in steps:
+        for consumer in consumers:
+            consumer(step)
+        yield step
+
+
+def consume(steps, *consumers):
+    """Pass every transition in `steps` to each of the consumers, returning
+    the consumers once the stream is exhausted.
+    """
+    for step in tap(steps, *consumers):
+        pass
+    return consumers
+
+
+class Consumer:
+    """Base class for streaming consumers of transitions."""
+    def __call__(self, step):
+        self.update(*_unpack(step))
+
+    def update(self, s, a, r, sp):
+        raise NotImplementedError
+
+
+class RunningReturn(Consumer):
+    """Track the total reward, and the discounted return from the start of the
+    stream, `sum_t (gm_0 * ... * gm_{t-1}) * r_t`.
+
+    Args:
+        gamma: The discount parameter (a constant, or a state-dependent
+            parameter evaluated as `gamma(s, a, sp)`).
+    """
+    def __init__(self, gamma):
+        self.gamma = to_parameter(gamma)
+        self.t = 0
+        self.total = 0.0
+        self.discounted = 0.0
+        self.discount = 1.0
+
+    def update(self, s, a, r, sp):
+        self.t += 1
+        self.total += r
+        self.discounted += self.discount * r
+        self.discount *= self.gamma(s, a, sp)
+
+    @property
+    def mean(self):
+        """The average reward per step."""
+        return self.total / self.t if self.t else np.nan
+
+
+class OnlineMC(Consumer):
+    """Every-visit Monte Carlo estimates of state values, computed online
+    with constant work per step.
+
+    The return following a visit at time `t` is `(A - A_t) / D_t`, where
+    `D_t` is the product of the discounts before `t` and `A` accumulates the
+    rewards weighted by `D`. Summing over visits, each state needs only the
+    scaled counts `sum_t 1/D_t` and offsets `sum_t A_t/D_t`, so a reward is
+    credited to every earlier visit without revisiting them. To keep the
+    scaled quantities in range, the accumulated returns are folded into the
+    offsets whenever `D` falls below `rescale`.
+
+    Args:
+        gamma: The discount parameter (a constant, or a state-dependent
+            parameter evaluated as `gamma(s, a, sp)`, as in `every_visit_mc`).
+        rescale (optional): The threshold below which to rescale.
+    """
+    def __init__(self, gamma, rescale=1e-4):
+        self.gamma = to_parameter(gamma)
+        self.rescale = rescale
+        self.index = {}
+        self.counts = np.zeros(16, dtype=np.int64)
+        self._scaled = np.zeros(16)
+        self._offset = np.zeros(16)
+        self._A = 0.0
+        self._D = 1.0
+
+    def _grow(self):
+        n = 2 * len(self.counts)
+        for name in ('counts', '_scaled', '_offset'):
+            arr = getattr(self, name)
+            new = np.zeros(n, dtype=arr.dtype)
+            new[:len(arr)] = arr
+            setattr(self, name, new)
+
+    def _fold(self):
+        n = len(self.index)
+        self._offset[:n] -= self._A * self._scaled[:n]
+        self._scaled[:n] *= self._D
+        self._A = 0.0
+        self._D = 1.0
+
+    def update(self, s, a, r, sp):
+        i = self.index.setdefault(s, len(self.index))
+        if i == len(self.counts):
+            self._grow()
+        self.counts[i] += 1
+        self._scaled[i] += 1/self._D
+        self._offset[i] += self._A/self._D
+        self._A += self._D * r
+        self._D *= self.gamma(s, a, sp)
+        if self._D < self.rescale:
+            self._fold()
+
+    @property
+    def values(self):
+        """Dictionary of the average return following visits to each state."""
+        n = len(self.index)
+        totals = self._A * self._scaled[:n] - self._offset[:n]
+        return dict(zip(self.index, (totals / self.counts[:n]).tolist()))
+
+
+class ErrorTracker(Consumer):
+    """Record an agent's RMSE vs. known state values as it learns from a
+    stream (e.g., from `iter_episode`), after each step in `schedule`.
+
+    Args:
+        agent: The agent, which should already be bound to the environment
+            (see `bind`), and is updated by the stream's producer.
+        val_dct: A dictionary of the true value of each state.
+        schedule: The steps after which to record the error (see
+            `eval_schedule`).
+    """
+    def __init__(self, agent, val_dct, schedule):
+        self.agent = agent
+        self.schedule = np.asarray(schedule)
+        self.target_values = np.array([val_dct[s] for s in agent.states])
+        self._errors = np.full((len(self.schedule),) +
+                               np.shape(agent.theta)[:-1], np.nan)
+        self.t = 0
+        self.k = 0
+
+    def update(self, s, a, r, sp):
+        self.t += 1
+        if self.k < len(self.schedule) and self.t == self.schedule[self.k]:
+            difference = self.agent.values().T - self.target_values
+            self._errors[self.k] = np.sqrt(np.mean(difference**2, axis=-1))
+            self.k += 1
+
+    @property
+    def done(self):
+        """Whether every scheduled step has been recorded."""
+        return self.k >= len(self.schedule)
+
+    @property
+    def errors(self):
+        """The errors recorded so far."""
+        return self._errors[:self.k]
@@ -0,0 +1,308 @@
+"""
+Parameter sweeps over (algorithm, parameters, seed) grids.
+
+Each seed corresponds to a recorded trajectory, prepared as a `Replay`. The
+arrays the replays need (feature matrices, state indices, rewards, parameters)
+are placed in shared memory once, so that the worker processes of the pool
+read them without each receiving its own copy. Completed cells are appended
+to a checkpoint file as they finish, so that an interrupted sweep can be
+resumed without repeating them. Each cell's key identifies the replay's
+contents and the evaluation setup, so that results recorded for different
+trajectories or schedules are not reused.
+"""
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from algos import algo_registry, param_grid
+from replay import Replay, _rows
+
+
+def cell_key(algo_name, params, seed, context=None):
+    """A string uniquely identifying a cell of a sweep, where `context`
+    identifies what the cell is run on (see `Sweep.context`).
+    """
+    params = {k: float(v) for k, v in sorted(params.items())}
+    return json.dumps([algo_name, params, seed, context])
+
+
+def _update_hash(h, arr, chunk_size=2**20):
+    """Add an array's shape, type and contents to hash `h`, a chunk at a
+    time (so memory-mapped arrays need not be loaded at once).
+    """
+    arr = np.asarray(arr)
+    h.update(repr((arr.shape, arr.dtype.str)).encode())
+    flat = arr.reshape(-1) if arr.ndim else arr.reshape(1)
+    for lo in range(0, len(flat), chunk_size):
+        h.update(np.ascontiguousarray(flat[lo:lo+chunk_size]).tobytes())
+
+
+def replay_digest(rep):
+    """A digest of the contents of a `Replay`."""
+    h = hashlib.sha1()
+    for arr in (rep.idx, rep.idx_p, rep.r, rep.rho):
+        _update_hash(h, arr)
+    for k, v in sorted(rep.params.items()):
+        h.update(k.encode())
+        _update_hash(h, v)
+    if isinstance(rep.X, np.ndarray):
+        _update_hash(h, rep.X)
+    else:
+        X = rep.X.tocsr()
+        for arr in (X.indptr, X.indices, X.data, X.shape):
+            _update_hash(h, arr)
+    return h.hexdigest()
+
+
+def make_algo(algo_name, n, params):
+    """Construct an algorithm with `n` features, passing it any of `params`
+    that its constructor takes (e.g., the step-sizes of the banks).
+    """
+    cls = algo_registry[algo_name]
+    names = [k for k, p in inspect.signature(cls.__init__).parameters.items()
+             if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)]
+    return cls(n, **{k: params[k] for k in names[2:] if k in params})
+
+
+def _share(arrays, segments):
+    """Copy arrays into shared memory, returning a picklable specification
+    for attaching to them (and recording the segments so they can be freed).
+    """
+    spec = {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        segments.append(shm)
+        spec[name] = (shm.name, arr.dtype.str, arr.shape)
+    return spec
+
+
+def _attach(spec, segments):
+    """Attach to arrays in shared memory, as described by `spec`."""
+    ret = {}
+    for name, (shm_name, dtype, shape) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        segments.append(shm)
+        ret[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return ret
+
+
+def share_replay(rep, segments):
+    """Place the arrays of a `Replay` in shared memory."""
+    arrays = {'idx': rep.idx, 'idx_p': rep.idx_p, 'r': rep.r, 'rho': rep.rho}
+    arrays.update({'param_' + k: v for k, v in rep.params.items()})
+    if isinstance(rep.X, np.ndarray):
+        arrays['X'] = rep.X
+    else:
+        X = rep.X.tocsr()
+        arrays.update(X_data=X.data, X_indices=X.indices, X_indptr=X.indptr)
+        arrays['X_shape'] = np.array(X.shape)
+    return _share(arrays, segments)
+
+
+def attach_replay(spec, segments):
+    """Reconstruct a `Replay` from arrays placed in shared memory."""
+    arrays = _attach(spec, segments)
+    rep = Replay.__new__(Replay)
+    rep.idx, rep.idx_p = arrays['idx'], arrays['idx_p']
+    rep.r, rep.rho = arrays['r'], arrays['rho']
+    rep.num_steps = len(rep.r)
+    rep.params = {k[len('param_'):]: v for k, v in arrays.items()
+                  if k.startswith('param_')}
+    if 'X' in arrays:
+        rep.X = arrays['X']
+    else:
+        from scipy import sparse
+        rep.X = sparse.csr_matrix((arrays['X_data'], arrays['X_indices'],
+                                   arrays['X_indptr']),
+                                  shape=tuple(arrays['X_shape']))
+    rep.states = None
+    rep._features = _rows(rep.X)
+    return rep
+
+
+def run_cell(rep, algo_name, params, schedule=(), evaluate=None):
+    """Run a single cell of a sweep on a replay.
+
+    Args:
+        rep: The `Replay` for the cell's seed.
+        algo_name: The name of an algorithm in `algo_registry`.
+        params: The parameters for the algorithm's update (constants).
+        schedule (optional): Steps after which to evaluate the algorithm.
+        evaluate (optional): A pair `(X, v)` of a feature matrix and the true
+            values of its states, used to compute the RMSE at each scheduled
+            step.
+
+    Returns:
+        A dictionary containing the errors (if requested) and the final
+        weights, i.e., those at the end of the replay, or at the last scheduled
+        step when evaluating.
+    """
+    algo = make_algo(algo_name, rep.X.shape[1], params)
+    ret = {}
+    if evaluate is not None and len(schedule):
+        X, v = evaluate
+        thetas = rep.weights(algo, schedule, **params)
+        errors = np.sqrt(np.mean((thetas @ X.T - v)**2, axis=-1))
+        ret['errors'] = errors.tolist()
+    else:
+        rep.run(algo, **params)
+    ret['theta'] = np.asarray(algo.theta).tolist()
+    return ret
+
+
+# state for the pool's worker processes, set up by `_init_worker`
+_worker = {}
+
+
+def _init_worker(specs, eval_spec, schedule):
+    segments = []
+    _worker['replays'] = {seed: attach_replay(spec, segments)
+                          for seed, spec in specs.items()}
+    if eval_spec is not None:
+        arrays = _attach(eval_spec, segments)
+        _worker['evaluate'] = (arrays['X'], arrays['v'])
+    else:
+        _worker['evaluate'] = None
+    _worker['schedule'] = schedule
+    _worker['segments'] = segments
+
+
+def _run_worker(algo_name, params, seed):
+    rep = _worker['replays'][seed]
+    return run_cell(rep, algo_name, params, _worker['schedule'],
+                    _worker['evaluate'])
+
+
+class Sweep:
+    """A parameter sweep over algorithms, parameters and seeds.
+
+    Args:
+        replays: A dictionary mapping seeds to `Replay` instances.
+        grid: A dictionary mapping algorithm names to dictionaries of
+            parameter values, e.g., `{'TD': {'alpha': [0.1, 0.01], ...}}`;
+            every combination of values is run, for every seed.
+        path (optional): A file to checkpoint completed cells to. Cells
+            already recorded there are skipped when the sweep is run.
+        schedule (optional): Steps after which to evaluate each algorithm.
+        evaluate (optional): A pair `(X, v)` of a (dense) feature matrix and
+            true values, used to compute errors at each scheduled step.
+    """
+    def __init__(self, replays, grid, path=None, schedule=(), evaluate=None):
+        self.replays = replays
+        self.grid = grid
+        self.path = path
+        self.schedule = np.asarray(schedule, dtype=int)
+        self.evaluate = evaluate
+        self._contexts = {}
+
+    def context(self, seed):
+        """A digest identifying the replay for `seed` and the evaluation
+        setup (schedule, and feature matrix and values), which are part of
+        the key of each of the seed's cells.
+        """
+        if seed not in self._contexts:
+            h = hashlib.sha1(replay_digest(self.replays[seed]).encode())
+            _update_hash(h, self.schedule)
+            if self.evaluate is not None:
+                for arr in self.evaluate:
+                    _update_hash(h, arr)
+            self._contexts[seed] = h.hexdigest()
+        return self._contexts[seed]
+
+    def cells(self):
+        """Iterate over the cells of the sweep, as `(key, algo_name, params,
+        seed)` tuples.
+        """
+        for algo_name, axes in self.grid.items():
+            points = param_grid(**axes)
+            num = len(next(iter(points.values()))) if points else 1
+            for i in range(num):
+                params = {k: float(v[i]) for k, v in points.items()}
+                for seed in self.replays:
+                    key = cell_key(algo_name, params, seed, self.context(seed))
+                    yield key, algo_name, params, seed
+
+    def completed(self):
+        """Load the results of the cells recorded in the checkpoint file."""
+        ret = {}
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    # skip a final line left incomplete by an interruption
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    ret[rec['key']] = rec['result']
+        return ret
+
+    def _record(self, f, key, result):
+        if f is not None:
+            f.write(json.dumps({'key': key, 'result': result}) + '\n')
+            f.flush()
+
+    def run(self, processes=None):
+        """Run the cells of the sweep that have not already been completed.
+
+        Args:
+            processes (optional): The number of worker processes to use; if
+                zero, the cells are run in the current process.
+
+        Returns:
+            A dictionary mapping the key of every cell to its result.
+        """
+        results = self.completed()
+        todo = [c for c in self.cells() if c[0] not in results]
+        f = None
+        if self.path is not None:
+            # terminate any incomplete record, so new ones start on a new line
+            incomplete = False
+            if os.path.exists(self.path) and os.path.getsize(self.path):
+                with open(self.path, 'rb') as g:
+                    g.seek(-1, os.SEEK_END)
+                    incomplete = g.read(1) != b'\n'
+            f = open(self.path, 'a')
+            if incomplete:
+                f.write('\n')
+        try:
+            if processes == 0:
+                for key, algo_name, params, seed in todo:
+                    results[key] = run_cell(self.replays[seed], algo_name,
+                                            params, self.schedule,
+                                            self.evaluate)
+                    self._record(f, key, results[key])
+            elif todo:
+                self._run_pool(todo, results, f, processes)
+        finally:
+            if f is not None:
+                f.close()
+        return results
+
+    def _run_pool(self, todo, results, f, processes):
+        segments = []
+        try:
+            specs = {seed: share_replay(rep, segments)
+                     for seed, rep in self.replays.items()}
+            eval_spec = None
+            if self.evaluate is not None:
+                X, v = self.evaluate
+                eval_spec = _share({'X': np.asarray(X), 'v': np.asarray(v)},
+                                   segments)
+            with ProcessPoolExecutor(processes, initializer=_init_worker,
+                                     initargs=(specs, eval_spec,
+                                               self.schedule)) as pool:
+                futures = {pool.submit(_run_worker, algo_name, params, seed):
+                           key for key, algo_name, params, seed in todo}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    results[key] = future.result()
+                    self._record(f, key, results[key])
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
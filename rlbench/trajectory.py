@@ -0,0 +1,242 @@
+"""
+Columnar on-disk storage for trajectories, implementing the run data format
+sketched in `specifications.md`.
+
+A trajectory is stored as a directory containing one raw binary file per
+column (`s`, `a`, `r`, `sp`, and any per-step parameters), a file of episode
+start offsets, and a `meta.json` file describing the columns and the run.
+Steps are written in chunks by `TrajectoryWriter`, so that the whole
+trajectory never has to be held in memory, and read back by
+`TrajectoryReader` as memory-mapped arrays.
+"""
+import json
+import os
+import numpy as np
+from parametric import to_parameter
+from policy import action_probability
+
+
+VERSION = 1
+
+# columns common to every trajectory, in the order they are recorded
+STEP_COLUMNS = ('s', 'a', 'r', 'sp')
+
+
+def env_metadata(env, parameters=None, random_seed=None):
+    """Summarize an environment for a trajectory's metadata."""
+    return {
+        'name': type(env).__name__,
+        'parameters': parameters if parameters is not None else {},
+        'random_seed': random_seed,
+        'num_states': len(env.states),
+        'num_actions': env.max_actions,
+    }
+
+
+class TrajectoryWriter:
+    """Write a trajectory to disk one step at a time.
+
+    Steps are buffered into chunks of `chunk_size` and appended to each
+    column's file as the chunks fill up. The data types (and per-step shapes)
+    of the state and action columns are taken from the first step unless
+    given in `dtypes`; rewards and parameters are stored as floats.
+
+    Args:
+        path: The directory to write the trajectory to (created if needed).
+        environment (optional): Information about the environment, e.g. as
+            returned by `env_metadata`.
+        policy (optional): A specification of the policy that was followed.
+        chunk_size (optional): The number of steps to buffer between writes.
+        dtypes (optional): A dictionary mapping column names to data types.
+    """
+    def __init__(self, path, environment=None, policy=None, chunk_size=2**16,
+                 dtypes=None):
+        self.path = path
+        self.environment = environment if environment is not None else {}
+        self.policy = policy
+        self.chunk_size = chunk_size
+        self.dtypes = dict(dtypes) if dtypes is not None else {}
+
+        os.makedirs(path, exist_ok=True)
+        self.columns = None     # column name --> (dtype, per-step shape)
+        self._buffers = {}
+        self._files = {}
+        self._episodes = []
+        self._new_episode = True
+        self._pos = 0           # position within the current chunk
+        self.num_steps = 0
+
+    def _open(self, step):
+        """Set up the columns and their files using the first step."""
+        self.columns = {}
+        for name, value in step.items():
+            # rewards and parameters are stored as floats, even if the first
+            # value is an integer (e.g., `gm=1` or `FirstVisit`'s zero)
+            default = None if name in ('s', 'a', 'sp') else np.float64
+            value = np.asarray(value, dtype=self.dtypes.get(name, default))
+            self.columns[name] = (value.dtype, value.shape)
+            self._buffers[name] = np.empty((self.chunk_size,) + value.shape,
+                                           dtype=value.dtype)
+            self._files[name] = open(self._filename(name), 'wb')
+
+    def _filename(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def append(self, s, a, r, sp, **params):
+        """Record a step, along with any per-step parameters."""
+        step = dict(zip(STEP_COLUMNS, (s, a, r, sp)), **params)
+        if self.columns is None:
+            self._open(step)
+        elif step.keys() != self.columns.keys():
+            raise ValueError("Step has different columns than trajectory:",
+                             sorted(step.keys()))
+        if self._new_episode:
+            self._episodes.append(self.num_steps)
+            self._new_episode = False
+
+        for name, value in step.items():
+            self._buffers[name][self._pos] = value
+        self._pos += 1
+        self.num_steps += 1
+        if self._pos == self.chunk_size:
+            self.flush()
+
+    def end_episode(self):
+        """Mark the end of the current episode; the next step begins a new one."""
+        self._new_episode = True
+
+    def flush(self):
+        """Write any buffered steps to disk."""
+        for name, buf in self._buffers.items():
+            buf[:self._pos].tofile(self._files[name])
+            self._files[name].flush()
+        self._pos = 0
+
+    @property
+    def metadata(self):
+        return {
+            'version': VERSION,
+            'num_steps': self.num_steps,
+            'num_episodes': len(self._episodes),
+            'environment': self.environment,
+            'policy': self.policy,
+            'columns': {name: {'dtype': dtype.str, 'shape': list(shape)}
+                        for name, (dtype, shape) in (self.columns or {}).items()},
+        }
+
+    def close(self):
+        """Flush remaining steps, and write the episode offsets and metadata."""
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        np.array(self._episodes, dtype=np.int64).tofile(
+            os.path.join(self.path, 'episodes.bin'))
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self.metadata, f, indent=2, default=str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryReader:
+    """Read a trajectory written by `TrajectoryWriter`.
+
+    Each column is exposed as a read-only memory-mapped array, so that even
+    very long trajectories can be accessed without loading them into memory.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.metadata = json.load(f)
+        self.num_steps = self.metadata['num_steps']
+
+        self.columns = {}
+        for name, spec in self.metadata['columns'].items():
+            self.columns[name] = self._map(name + '.bin', np.dtype(spec['dtype']),
+                                           (self.num_steps,) + tuple(spec['shape']))
+        n = self.metadata['num_episodes']
+        starts = self._map('episodes.bin', np.dtype(np.int64), (n,))
+        self.episode_bounds = np.append(starts, self.num_steps)
+
+    def _map(self, filename, dtype, shape):
+        if np.prod(shape) == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, filename), dtype=dtype,
+                         mode='r', shape=shape)
+
+    def __len__(self):
+        return self.num_steps
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def environment(self):
+        return self.metadata['environment']
+
+    @property
+    def policy(self):
+        return self.metadata['policy']
+
+    @property
+    def num_episodes(self):
+        return len(self.episode_bounds) - 1
+
+    def episode(self, i):
+        """Return a dictionary of (memory-mapped) columns for episode `i`."""
+        lo, hi = self.episode_bounds[i], self.episode_bounds[i+1]
+        return {name: col[lo:hi] for name, col in self.columns.items()}
+
+    def episodes(self):
+        """Iterate over the trajectory's episodes."""
+        for i in range(self.num_episodes):
+            yield self.episode(i)
+
+    def steps(self, chunk_size=2**16):
+        """Iterate over the trajectory's steps as `(s, a, r, sp)` tuples,
+        reading a chunk at a time.
+        """
+        for lo in range(0, self.num_steps, chunk_size):
+            cols = [np.asarray(self.columns[k][lo:lo+chunk_size]).tolist()
+                    for k in STEP_COLUMNS]
+            yield from zip(*cols)
+
+
+def record_policy(pol, env, max_steps, path, param_funcs=dict(),
+                  record_probs=False, **kwargs):
+    """Run a policy in an environment, writing each step (and the values of
+    any parameter functions) to a trajectory at `path`.
+
+    Like `run_policy_verbose`, but the steps are streamed to disk rather than
+    accumulated in memory. Additional keyword arguments are passed to
+    `TrajectoryWriter`. Returns the number of steps taken.
+    """
+    t = 0
+
+    # convert parameter functions to `Parameter` type, if needed
+    param_funcs = {k: to_parameter(v) for k, v in param_funcs.items()}
+    kwargs.setdefault('environment', env_metadata(env))
+
+    with TrajectoryWriter(path, **kwargs) as writer:
+        # reset the environment and get initial state
+        env.reset()
+        s = env.state
+        while not env.is_terminal() and t < max_steps:
+            actions = env.actions
+            a = pol.choose(s, actions)
+            r, sp = env.do(a)
+
+            # record the transition, with the values of parameters
+            params = {k: func(s, a, sp) for k, func in param_funcs.items()}
+            if record_probs:
+                params['mu'] = action_probability(pol, s, a, actions)
+            writer.append(s, a, r, sp, **params)
+
+            # prepare for next iteration
+            s = sp
+            t += 1
+    return t
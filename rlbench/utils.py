@@ -1,6 +1,14 @@
 import numpy as np
 
 
+def spawn_rngs(seed, n):
+    """Deterministically create `n` independent random number generators from
+    a single seed, e.g., one for each run of an experiment.
+    """
+    return [np.random.default_rng(ss)
+            for ss in np.random.SeedSequence(seed).spawn(n)]
+
+
 def compute_value_dct(theta_lst, features):
     return [{s: np.dot(theta, x) for s, x in features.items()} for theta in theta_lst]
 
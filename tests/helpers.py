@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+helpers
+----------------------------------
+
+Environments shared by several test modules.
+"""
+
+from environment import Environment
+
+
+class Corridor(Environment):
+    """Walk right along a corridor, terminating at the end."""
+    EPISODIC = True
+    def __init__(self, length):
+        self.length = length
+        self.s0 = 0
+        self.reset()
+
+    @property
+    def states(self):
+        return set(range(self.length))
+
+    def get_actions(self, s=None):
+        return (0,)
+
+    def do(self, action):
+        sp = self._state + 1
+        self._state = sp
+        return float(sp == self.length - 1), sp
+
+    def is_terminal(self, s=None):
+        s = self._state if s is None else s
+        return s == self.length - 1
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_agents
+----------------------------------
+
+Tests for `agents` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import agents
+import algos
+import chicken
+import features
+import parametric
+import policy
+
+
+class TestUpdatePlan(unittest.TestCase):
+
+    def test_args(self):
+        gamma = parametric.MapState({0: 0.5, 1: 0.9})
+        param_funcs = dict(alpha=parametric.Constant(0.1), gm=gamma,
+                           gm_p=parametric.MapNextState(gamma),
+                           lm=parametric.FirstVisit({0: 1.0}))
+        plan = agents.UpdatePlan(['alpha', 'gm', 'gm_p', 'lm', 'rho'],
+                                 param_funcs)
+        self.assertEqual(plan(0, None, 1, 2.0), [0.1, 0.5, 0.9, 1.0, 2.0])
+        self.assertEqual(plan(1, None, 0, 1.0, dict(alpha=0.2, other=1)),
+                         [0.2, 0.9, 0.5, 0, 1.0])
+        self.assertRaises(KeyError, agents.UpdatePlan(['eta'], {}), 0, 0, 1)
+        self.assertEqual(agents.UpdatePlan(['eta'], {})(0, 0, 1, 1, {'eta': 3}),
+                         [3])
+
+
+class TestOnPolicyAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.env = chicken.Chicken(6)
+        self.phi = features.Int2Binary(3)
+        self.agent = agents.OnPolicyAgent(
+            algos.TD(3), policy.RandomPolicy(), self.phi,
+            update_params=dict(alpha=0.1, gm=0.9, gm_p=0.9, lm=0.0))
+        self.agent.algo.theta[:] = [1, 2, 4]
+
+    def test_bind(self):
+        self.assertRaises(ValueError, self.agent.values)
+        self.agent.bind(self.env)
+        values = self.agent.values()
+        for s, v in zip(self.agent.states, values):
+            self.assertAlmostEqual(v, self.agent.predict(s))
+
+    def test_rng(self):
+        behavior = policy.FixedPolicy({s: {0: 0.3, 1: 0.7} for s in range(6)})
+        stream = behavior.uniform
+        def choices(pol, seed):
+            agent = agents.OnPolicyAgent(algos.TD(3), pol, self.phi, rng=seed)
+            return [agent.choose(t % 6, (0, 1)) for t in range(50)]
+        # agents sharing a behavior policy each have their own stream
+        self.assertEqual(choices(behavior, 0), choices(behavior, 0))
+        self.assertNotEqual(choices(behavior, 0), choices(behavior, 1))
+        self.assertIs(behavior.uniform, stream)
+        compiled = behavior.compile()
+        self.assertEqual(choices(compiled, 2), choices(compiled, 2))
+
+    def test_get_values(self):
+        dct = self.agent.get_values(self.env.states)
+        self.assertEqual(set(dct.keys()), self.env.states)
+        for s, v in dct.items():
+            self.assertAlmostEqual(v, s)
+
+
+class TestOffPolicyAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.states = range(4)
+        self.target = policy.FixedPolicy({s: {0: 0.9, 1: 0.1}
+                                          for s in self.states})
+        self.behavior = policy.FixedPolicy({s: {0: 0.5, 1: 0.5}
+                                            for s in self.states})
+
+    def make_agent(self, behavior):
+        return agents.OffPolicyAgent(algos.TD(4), self.target, behavior,
+                                     features.Int2Unary(4), rng=0)
+
+    def check_rho(self, agent):
+        for t in range(50):
+            a = agent.choose(t % 4, (0, 1))
+            self.assertAlmostEqual(agent.rho, [1.8, 0.2][a])
+
+    def test_cached(self):
+        self.check_rho(self.make_agent(self.behavior))
+
+    def test_compiled(self):
+        agent = self.make_agent(self.behavior.compile())
+        self.check_rho(agent)
+        self.assertIsNotNone(agent._rho_table)
+
+    def test_invalidation(self):
+        behavior = self.behavior.compile()
+        agent = self.make_agent(behavior)
+        self.check_rho(agent)
+        # changing a distribution in place is detected
+        self.target.pol[0][0] = 0.5
+        self.target.pol[0][1] = 0.5
+        agent.choose(0, (0, 1))
+        self.assertEqual(agent.rho, 1.0)
+        self.target.pol[0] = {0: 0.2, 1: 0.8}
+        a = agent.choose(0, (0, 1))
+        self.assertAlmostEqual(agent.rho, 0.4 if a == 0 else 1.6)
+        self.target.pol = {**self.target.pol, 0: {0: 0.5, 1: 0.5}}
+        agent.choose(0, (0, 1))
+        self.assertEqual(agent.rho, 1.0)
+        behavior.probs = [[1.0, 0.0]]*4
+        self.assertEqual(agent.choose(1, (0, 1)), 0)
+        self.assertAlmostEqual(agent.rho, 0.9)
+
+    def test_cache_size(self):
+        agent = self.make_agent(self.behavior)
+        size = agents.RHO_CACHE_SIZE
+        try:
+            agents.RHO_CACHE_SIZE = 2
+            self.check_rho(agent)
+            self.assertEqual(len(agent._rho_cache), 2)
+        finally:
+            agents.RHO_CACHE_SIZE = size
+
+    def test_nonstationary(self):
+        class Changing(policy.FixedPolicy):
+            stationary = False
+        agent = self.make_agent(Changing({s: {0: 0.5, 1: 0.5}
+                                          for s in self.states}))
+        self.check_rho(agent)
+        self.assertEqual(agent._rho_cache, {})
+
+
+class TestHordeAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.env = chicken.Chicken(3)
+        self.target = policy.FixedPolicy({s: {0: 0.9, 1: 0.1} for s in range(3)})
+        self.params = dict(alpha=0.1, gm=0.9, gm_p=0.9, lm=0.0)
+
+    def test_rho(self):
+        agent = agents.HordeAgent(algos.TD(3), self.target,
+                                  features.Int2Unary(3), self.params,
+                                  behavior=policy.RandomPolicy())
+        self.assertAlmostEqual(agent.ratio(0, 0, (0, 1)), 1.8)
+        self.assertRaises(ValueError, agent.ratio, 0, 1)
+        agent.bind(self.env)
+        self.assertAlmostEqual(agent.ratio(0, 1), 0.2)
+        # on-policy, without a behavior policy
+        agent = agents.HordeAgent(algos.TD(3), self.target,
+                                  features.Int2Unary(3), self.params)
+        self.assertEqual(agent.ratio(0, 1), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_algos
+----------------------------------
+
+Tests for `algos` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import algos
+import features
+
+
+def _transitions(n, steps, seed=0):
+    """Generate a reproducible sequence of random transitions."""
+    rs = np.random.RandomState(seed)
+    X = rs.rand(steps + 1, n)
+    R = rs.randn(steps)
+    return [(X[t], R[t], X[t+1]) for t in range(steps)]
+
+
+class TestBanks(unittest.TestCase):
+
+    def setUp(self):
+        self.n = 5
+        self.steps = 50
+        self.grid = algos.param_grid(alpha=[0.1, 0.01], lm=[0.0, 0.5, 0.9])
+
+    def test_param_grid(self):
+        self.assertEqual(len(self.grid['alpha']), 6)
+        pairs = set(zip(self.grid['alpha'], self.grid['lm']))
+        self.assertEqual(len(pairs), 6)
+
+    def test_td_bank(self):
+        bank = algos.TDBank(self.n, **self.grid)
+        members = [algos.TD(self.n) for _ in range(bank.K)]
+        for x, r, xp in _transitions(self.n, self.steps):
+            bank.update(x, r, xp, gm=0.9, gm_p=0.9, rho=1)
+            for k, td in enumerate(members):
+                td.update(x, r, xp, alpha=bank.alpha[k], gm=0.9, gm_p=0.9,
+                          lm=bank.lm[k], rho=1)
+        for k, td in enumerate(members):
+            np.testing.assert_allclose(bank.theta[k], td.theta)
+
+    def test_etd_bank(self):
+        bank = algos.ETDBank(self.n, **self.grid)
+        members = [algos.ETD(self.n) for _ in range(bank.K)]
+        for x, r, xp in _transitions(self.n, self.steps):
+            bank.update(x, r, xp, gm=0.9, gm_p=0.9, rho=1, interest=1)
+            for k, etd in enumerate(members):
+                etd.update(x, r, xp, alpha=bank.alpha[k], gm=0.9, gm_p=0.9,
+                           lm=bank.lm[k], rho=1, interest=1)
+        for k, etd in enumerate(members):
+            np.testing.assert_allclose(bank.theta[k], etd.theta)
+
+    def test_tdc_bank(self):
+        grid = algos.param_grid(alpha=[0.1, 0.01], beta=[0.05], lm=[0.0, 0.9])
+        bank = algos.TDCBank(self.n, **grid)
+        members = [algos.TDC(self.n) for _ in range(bank.K)]
+        for x, r, xp in _transitions(self.n, self.steps):
+            bank.update(x, r, xp, gm=0.9, gm_p=0.9, rho=0.5)
+            for k, tdc in enumerate(members):
+                tdc.update(x, r, xp, alpha=bank.alpha[k], beta=bank.beta[k],
+                           gm=0.9, gm_p=0.9, lm=bank.lm[k], lm_p=bank.lm[k],
+                           rho=0.5)
+        for k, tdc in enumerate(members):
+            np.testing.assert_allclose(bank.theta[k], tdc.theta)
+            np.testing.assert_allclose(bank.w[k], tdc.w)
+
+    def test_bank_in_agent(self):
+        import agents
+        import policy
+        bank = algos.TDBank(self.n, **self.grid)
+        agent = agents.OnPolicyAgent(bank, policy.RandomPolicy(),
+                                     update_params={'gm': 0.9, 'gm_p': 0.9})
+        agent.update(np.ones(self.n), 0, 1.0, np.zeros(self.n))
+        self.assertEqual(agent.theta.shape, (bank.K, self.n))
+
+
+class TestLSTD(unittest.TestCase):
+
+    def setUp(self):
+        self.n = 4
+        self.params = dict(gm=0.9, gm_p=0.9, lm=0.5, rho=1)
+
+    def test_recursive_matches_batch(self):
+        lstd = algos.LSTD(self.n, epsilon=1.0)
+        rlstd = algos.RecursiveLSTD(self.n, epsilon=1.0)
+        for x, r, xp in _transitions(self.n, 30):
+            lstd.update(x, r, xp, **self.params)
+            rlstd.update(x, r, xp, **self.params)
+            np.testing.assert_allclose(rlstd.theta, lstd.theta, rtol=1e-6)
+
+    def test_solve_every(self):
+        lstd = algos.LSTD(self.n, epsilon=1.0, solve_every=5)
+        steps = _transitions(self.n, 6)
+        lstd.update(*steps[0], **self.params)
+        theta = lstd.theta.copy()
+        for x, r, xp in steps[1:5]:
+            lstd.update(x, r, xp, **self.params)
+            np.testing.assert_array_equal(lstd.theta, theta)
+        lstd.update(*steps[5], **self.params)
+        self.assertFalse(np.allclose(lstd.theta, theta))
+
+
+class TestSparse(unittest.TestCase):
+    """Algorithms should give the same results for sparse and dense features."""
+
+    def setUp(self):
+        self.n = 20
+        phi = features.RandomBinary(self.n, 3, random_seed=1)
+        sparse_phi = features.RandomBinary(self.n, 3, random_seed=1, sparse=True)
+        rs = np.random.RandomState(0)
+        states = rs.randint(0, 8, size=40)
+        rewards = rs.randn(len(states) - 1)
+        self.dense = [(phi(s), r, phi(sp))
+                      for s, r, sp in zip(states, rewards, states[1:])]
+        self.sparse = [(sparse_phi(s), r, sparse_phi(sp))
+                       for s, r, sp in zip(states, rewards, states[1:])]
+        self.params = dict(alpha=0.1, beta=0.05, gm=0.9, gm_p=0.9, lm=0.8,
+                           lm_p=0.8, rho=0.7, interest=1)
+
+    def check(self, cls, **kwargs):
+        dense, sparse = cls(self.n, **kwargs), cls(self.n, **kwargs)
+        args = {k: self.params[k] for k in cls.update_params}
+        for (x, r, xp), (sx, sr, sxp) in zip(self.dense, self.sparse):
+            np.testing.assert_array_equal(x, np.asarray(sx))
+            dense.update(x, r, xp, **args)
+            sparse.update(sx, sr, sxp, **args)
+        np.testing.assert_allclose(sparse.theta, dense.theta, atol=1e-10)
+
+    def test_td(self):
+        self.check(algos.TD)
+
+    def test_etd(self):
+        self.check(algos.ETD)
+
+    def test_gtd(self):
+        self.check(algos.GTD)
+
+    def test_gtd2(self):
+        self.check(algos.GTD2)
+
+    def test_tdc(self):
+        self.check(algos.TDC)
+
+    def test_lstd(self):
+        self.check(algos.LSTD, epsilon=1.0)
+        self.check(algos.RecursiveLSTD, epsilon=1.0)
+
+    def test_support_pruned(self):
+        # decayed trace entries drop out, so the support stays bounded
+        n = 1000
+        td = algos.TD(n)
+        for t in range(n):
+            x = features.ActiveFeatures([t], length=n)
+            xp = features.ActiveFeatures([(t + 1) % n], length=n)
+            td.update(x, 0, xp, alpha=0.1, gm=0.9, gm_p=0.9, lm=0.5, rho=1)
+        self.assertLess(len(td._support), 50)
+        outside = np.setdiff1d(np.arange(n), td._support)
+        np.testing.assert_array_equal(td.z[outside], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
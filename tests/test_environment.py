@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_environment
+----------------------------------
+
+Tests for `environment` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import chicken
+from environment import VecEnv
+from tests.helpers import Corridor
+
+
+class TestVecEnv(unittest.TestCase):
+
+    def test_reset_terminal(self):
+        venv = VecEnv([Corridor(3), Corridor(4)])
+        r, sp, done = venv.step([0, 0])
+        np.testing.assert_array_equal(sp, [1, 1])
+        r, sp, done = venv.step([0, 0])
+        np.testing.assert_array_equal(sp, [2, 2])
+        np.testing.assert_array_equal(r, [1, 0])
+        np.testing.assert_array_equal(done, [True, False])
+        np.testing.assert_array_equal(venv.state, [0, 2])
+
+    def test_chicken(self):
+        env = chicken.Chicken(4)
+        native = env.vectorize(5)
+        generic = VecEnv.from_env(env, 5)
+        self.assertIsInstance(native, chicken.VecChicken)
+        rng = np.random.RandomState(0)
+        for t in range(100):
+            actions = rng.randint(2, size=5)
+            for x, y in zip(native.step(actions), generic.step(actions)):
+                np.testing.assert_array_equal(x, y)
+        np.testing.assert_array_equal(native.state, generic.state)
+        # the original environment is unaffected
+        self.assertEqual(env.state, env.s0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_features
+----------------------------------
+
+Tests for `features` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import features
+
+
+class TestTileCoder(unittest.TestCase):
+
+    def setUp(self):
+        self.phi = features.TileCoder([0, 0], [1, 1], num_tiles=10,
+                                      num_tilings=8, size=2**16)
+
+    def test_active(self):
+        x = self.phi([0.5, 0.5])
+        self.assertIsInstance(x, features.ActiveFeatures)
+        self.assertEqual(len(x.indices), 8)
+        self.assertEqual(np.asarray(x).sum(), 8)
+        self.assertEqual(len(np.asarray(x)), self.phi.nout)
+
+    def test_generalization(self):
+        near = set(self.phi([0.50, 0.50]).indices)
+        close = set(self.phi([0.51, 0.50]).indices)
+        far = set(self.phi([0.9, 0.1]).indices)
+        self.assertGreater(len(near & close), 4)
+        self.assertEqual(len(near & far), 0)
+
+    def test_batch(self):
+        states = np.random.RandomState(0).rand(50, 2)
+        indices = self.phi.indices(states)
+        self.assertEqual(indices.shape, (50, 8))
+        for s, idx in zip(states, indices):
+            np.testing.assert_array_equal(self.phi(s).indices, np.sort(idx))
+
+    def test_collisions(self):
+        phi = features.TileCoder([0], [1], num_tiles=100, num_tilings=4, size=16)
+        phi.indices(np.linspace(0, 1, 1000))
+        self.assertTrue(phi.table.full())
+        self.assertGreater(phi.table.collisions, 0)
+        self.assertTrue(np.all(phi.indices([0.3]) < 16))
+
+
+class TestBatch(unittest.TestCase):
+    """Batch evaluation should agree with evaluating each state in turn."""
+
+    def setUp(self):
+        self.states = np.array([3, 0, 7, 5, 3])
+
+    def check(self, phi):
+        X = features.feature_matrix(phi, self.states)
+        if not isinstance(X, np.ndarray):
+            X = X.toarray()
+        expected = np.array([np.asarray(phi(s)) for s in self.states])
+        np.testing.assert_array_equal(X, expected)
+
+    def test_int2unary(self):
+        self.check(features.Int2Unary(8))
+        self.check(features.Int2Unary(8, sparse=True))
+
+    def test_int2binary(self):
+        self.check(features.Int2Binary(4))
+        self.check(features.Int2Binary(4, sparse=True))
+
+    def test_random_binary(self):
+        self.check(features.RandomBinary(10, 3, random_seed=0))
+        self.check(features.RandomBinary(10, 3, random_seed=0, sparse=True))
+
+    def test_tile_coder(self):
+        self.states = np.random.RandomState(0).rand(5, 2)
+        self.check(features.TileCoder([0, 0], [1, 1], 4, 4, size=64))
+
+    def test_fallback(self):
+        self.check(lambda s: np.array([s, s**2]))
+
+
+class TestFeatureCache(unittest.TestCase):
+
+    def test_lru(self):
+        calls = []
+        def phi(s):
+            calls.append(s)
+            return np.array([s, 1])
+        cache = features.FeatureCache(phi, maxsize=2)
+        index, X = cache([2, 1, 0])
+        self.assertEqual(index[1], 1)
+        np.testing.assert_array_equal(X[index[2]], [2, 1])
+        cache([2, 1, 0])
+        self.assertEqual(len(calls), 3)
+        cache([3])
+        cache([4])
+        cache([2, 1, 0])
+        self.assertEqual(len(calls), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_horde
+----------------------------------
+
+Tests for `horde` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import algos
+import chicken
+import features
+import horde
+import parametric
+import policy
+
+
+class TestHorde(unittest.TestCase):
+
+    def setUp(self):
+        self.env = chicken.Chicken(4)
+        self.phi = features.Int2Unary(4)
+        self.targets = [policy.FixedPolicy({s: {0: p, 1: 1-p} for s in range(4)})
+                        for p in (0.9, 0.2)]
+        at_start = parametric.MapNextState({s: float(s == 0) for s in range(4)})
+        self.demons = [horde.Demon(t, cumulant=c, gamma=g)
+                       for t in self.targets for c in (None, at_start)
+                       for g in (0.0, 0.9)]
+        self.K = len(self.demons)
+
+    def test_size(self):
+        self.assertRaises(ValueError, horde.Horde, algos.TDCBank(4, 0.1, 0, 0),
+                          policy.RandomPolicy(), self.demons, self.phi)
+
+    def test_matches_individual(self):
+        h = horde.Horde(algos.TDCBank(4, np.full(self.K, 0.1), 0.01, 0.5),
+                        policy.RandomPolicy(), self.demons, self.phi, rng=0)
+        learners = [algos.TDC(4) for d in self.demons]
+        self.env.reset()
+        s = self.env.state
+        for t in range(200):
+            a = h.choose(s, self.env.actions)
+            r, sp = self.env.do(a)
+            rho = h.rho.copy()
+            h.update(s, a, r, sp)
+            for k, (d, algo) in enumerate(zip(self.demons, learners)):
+                self.assertAlmostEqual(rho[k], d.target.prob(s, a)/0.5)
+                c = r if d.cumulant is None else d.cumulant(s, a, sp)
+                algo.update(self.phi(s), c, self.phi(sp), 0.1, 0.01,
+                            d.gamma(s), d.gamma(sp), 0.5, 0.5, rho[k])
+            s = sp
+        np.testing.assert_allclose(h.theta, [algo.theta for algo in learners])
+
+    def test_values(self):
+        h = horde.Horde(algos.TDBank(4, np.full(self.K, 0.1), 0.0),
+                        policy.RandomPolicy(), self.demons, self.phi)
+        h.algo.theta[:] = np.arange(self.K)[:, None]
+        h.bind(self.env)
+        self.assertEqual(h.values().shape, (4, self.K))
+        np.testing.assert_allclose(h.predict(0), np.arange(self.K))
+        np.testing.assert_allclose(h.ratios(0, 1, (0, 1)),
+                                   [0.2]*4 + [1.6]*4)
+
+    def test_array_states(self):
+        # states that are themselves feature vectors, with `phi` omitted
+        demons = [horde.Demon(policy.RandomPolicy(), gamma=g)
+                  for g in (0.0, 0.9)]
+        h = horde.Horde(algos.TDBank(3, np.full(2, 0.1), 0.0),
+                        policy.RandomPolicy(), demons)
+        learners = [algos.TD(3) for d in demons]
+        states = [np.array([1.0, 0, 0]), np.array([0, 1.0, 0]),
+                  np.array([0, 0, 1.0])]
+        for s, sp in zip(states, states[1:] + states[:1]):
+            h.update(s, 0, 1.0, sp)
+            for d, algo in zip(demons, learners):
+                algo.update(s, 1.0, sp, 0.1, d.gamma(s), d.gamma(sp), 0.0,
+                            1.0)
+        np.testing.assert_allclose(h.theta, [algo.theta for algo in learners])
+
+    def test_next_state_gamma(self):
+        # a discount of zero upon returning to the start state
+        gamma = parametric.MapNextState({s: 0.9*(s != 0) for s in range(4)})
+        demons = [horde.Demon(t, gamma=gamma) for t in self.targets]
+        h = horde.Horde(algos.TDBank(4, np.full(2, 0.1), 0.5),
+                        policy.RandomPolicy(), demons, self.phi, rng=0)
+        learners = [algos.TD(4) for d in demons]
+        self.env.reset()
+        s = self.env.state
+        for t in range(100):
+            a = h.choose(s, self.env.actions)
+            r, sp = self.env.do(a)
+            rho = h.rho.copy()
+            h.update(s, a, r, sp)
+            for k, algo in enumerate(learners):
+                algo.update(self.phi(s), r, self.phi(sp), 0.1, gamma[sp],
+                            gamma[sp], 0.5, rho[k])
+            s = sp
+        np.testing.assert_allclose(h.theta, [algo.theta for algo in learners])
+
+    def test_sparse_predict(self):
+        phi = features.Int2Unary(4, sparse=True)
+        h = horde.Horde(algos.TDBank(4, np.full(self.K, 0.1), 0.0),
+                        policy.RandomPolicy(), self.demons, phi)
+        h.algo.theta[:] = np.arange(4*self.K).reshape(self.K, 4)
+        np.testing.assert_allclose(h.predict(2), h.theta[:, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_mdp
+----------------------------------
+
+Tests for `mdp` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import chicken
+import mdp
+import mdpsolver
+import parametric
+import policy
+from tests.helpers import Corridor
+
+
+class TestCompile(unittest.TestCase):
+
+    def setUp(self):
+        self.env = chicken.Chicken(4)
+
+    def test_chicken(self):
+        m = mdp.compile_env(self.env)
+        self.assertEqual(m.P.shape, (4, 2, 4))
+        np.testing.assert_allclose(m.P.sum(axis=2), 1)
+        # advancing moves forward, except from the end, which pays off
+        self.assertEqual(m.P[1, 0, 2], 1)
+        self.assertEqual(m.P[3, 0, 0], 1)
+        self.assertEqual(m.P[2, 1, 0], 1)
+        self.assertEqual(m.expected_reward()[3, 0], 1)
+        self.assertEqual(m.expected_reward().sum(), 1)
+        self.assertEqual(self.env.state, self.env.s0)
+
+    def test_sparse(self):
+        dense = mdp.compile_env(self.env)
+        sparse = mdp.compile_env(self.env, sparse=True)
+        np.testing.assert_array_equal(sparse.P.toarray().reshape(4, 2, 4),
+                                      dense.P)
+        np.testing.assert_array_equal(sparse.expected_reward(),
+                                      dense.expected_reward())
+
+
+class TestMarkovChain(unittest.TestCase):
+
+    def setUp(self):
+        self.env = chicken.Chicken(4)
+        self.pol = policy.FixedPolicy({s: {0: 0.7, 1: 0.3} for s in range(4)})
+
+    def test_chain(self):
+        chain = mdp.markov_chain(self.env, self.pol, phi=lambda s: [1, s])
+        np.testing.assert_allclose(chain.P.sum(axis=1), 1)
+        np.testing.assert_allclose(chain.P[0], [0.3, 0.7, 0, 0])
+        np.testing.assert_allclose(chain.r, [0, 0, 0, 0.7])
+        np.testing.assert_array_equal(chain.X[:, 1], chain.states)
+        sparse = mdp.markov_chain(self.env, self.pol, sparse=True)
+        np.testing.assert_allclose(sparse.P.toarray(), chain.P)
+        np.testing.assert_allclose(sparse.r, chain.r)
+
+    def test_true_values(self):
+        values = mdp.true_values(self.env, self.pol, 0.9)
+        chain = mdp.markov_chain(self.env, self.pol, phi=lambda s: np.eye(4)[s])
+        theta = mdpsolver.td_solver(chain.P, chain.r, chain.X, 0.9, 0)
+        np.testing.assert_allclose([values[s] for s in chain.states], theta)
+        sparse = mdp.true_values(self.env, self.pol, 0.9, sparse=True)
+        for s in values:
+            self.assertAlmostEqual(values[s], sparse[s])
+
+    def test_next_state_gamma(self):
+        # gamma as a function of the next state, ending on returning to 0
+        gm = {s: 0.9*(s != 0) for s in range(4)}
+        values = mdp.true_values(self.env, self.pol,
+                                 parametric.MapNextState(gm))
+        chain = mdp.markov_chain(self.env, self.pol)
+        expected = np.linalg.solve(
+            np.eye(4) - chain.P*[gm[s] for s in chain.states], chain.r)
+        np.testing.assert_allclose([values[s] for s in chain.states],
+                                   expected)
+        # the same values as with the dictionary itself
+        dct = mdp.true_values(self.env, self.pol, gm)
+        np.testing.assert_allclose([values[s] for s in chain.states],
+                                   [dct[s] for s in chain.states])
+
+    def test_terminal(self):
+        env = Corridor(4)
+        pol = policy.RandomPolicy()
+        values = mdp.true_values(env, pol, 0.9)
+        self.assertEqual(set(values), {0, 1, 2, 3})
+        np.testing.assert_allclose([values[s] for s in range(4)],
+                                   [0.81, 0.9, 1.0, 0.0])
+        # with restarts, the terminal state returns to the start
+        chain = mdp.markov_chain(env, pol, sparse=True)
+        np.testing.assert_array_equal(chain.terminal, [0, 0, 0, 1])
+        np.testing.assert_allclose(chain.P.toarray()[3], [1, 0, 0, 0])
+        gm = mdp.parameter_vector(0.9, chain.states, chain.terminal)
+        np.testing.assert_allclose(
+            mdpsolver.td_solver(chain.P, chain.r, np.eye(4), gm, 0)[:3],
+            [0.81, 0.9, 1.0])
+
+
+class TestSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.mdp = mdp.compile_env(chicken.Chicken(4))
+        self.pol = policy.FixedPolicy({s: {0: 0.7, 1: 0.3} for s in range(4)})
+
+    def test_sample(self):
+        sampler = mdp.TrajectorySampler(self.mdp, self.pol)
+        traj = sampler.sample(2000, seeds=[0, 1, 2])
+        self.assertEqual(traj['s'].shape, (3, 2000))
+        np.testing.assert_array_equal(traj['s'][:, 1:], traj['sp'][:, :-1])
+        self.assertTrue(np.all(
+            self.mdp.P[traj['s'], traj['a'], traj['sp']] == 1))
+        self.assertAlmostEqual(np.mean(traj['a'] == 0), 0.7, delta=0.02)
+        np.testing.assert_array_equal(
+            traj['r'], self.mdp.expected_reward()[traj['s'], traj['a']])
+
+    def test_seeds(self):
+        sampler = mdp.TrajectorySampler(self.mdp, self.pol)
+        a = sampler.sample(100, seeds=[5, 6], block_size=7)
+        b = sampler.sample(100, seeds=[6])
+        np.testing.assert_array_equal(a['s'][1], b['s'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_mdpsolver
+----------------------------------
+
+Tests for `mdpsolver` module (in `analytic-solution`).
+"""
+
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+import mdpsolver
+
+
+def random_mdp(ns, nf, seed=0):
+    rng = np.random.RandomState(seed)
+    P = rng.rand(ns, ns)
+    P /= P.sum(axis=1, keepdims=True)
+    return P, rng.rand(ns), rng.rand(ns, nf)
+
+
+class TestStationary(unittest.TestCase):
+
+    def setUp(self):
+        self.P = random_mdp(30, 1)[0]
+
+    def test_methods(self):
+        d = mdpsolver.stationary(self.P, method='solve')
+        np.testing.assert_allclose(d @ self.P, d)
+        for method in ('power', 'eigs'):
+            for P in (self.P, sparse.csr_matrix(self.P)):
+                np.testing.assert_allclose(
+                    mdpsolver.stationary(P, method=method, tol=1e-12), d,
+                    atol=1e-10)
+
+    def test_cache(self):
+        d = mdpsolver.stationary(self.P)
+        key = (mdpsolver.content_hash(self.P), 'solve', 1e-10)
+        self.assertIn(key, mdpsolver._stationary_cache)
+        # the cached result can't be modified through the returned array
+        d[:] = 0
+        self.assertTrue(np.all(mdpsolver.stationary(self.P) > 0))
+        # a different matrix with the same shape gets its own result
+        Q = np.roll(self.P, 1, axis=1)
+        self.assertNotEqual(mdpsolver.content_hash(Q),
+                            mdpsolver.content_hash(self.P))
+        np.testing.assert_allclose(mdpsolver.stationary(Q) @ Q,
+                                   mdpsolver.stationary(Q))
+
+
+class TestSolvers(unittest.TestCase):
+
+    def setUp(self):
+        self.P, self.r, self.X = random_mdp(20, 4)
+        self.v = np.linalg.solve(np.eye(20) - 0.9*self.P, self.r)
+
+    def test_tabular(self):
+        # with tabular features, every solution is the true value function
+        I = np.eye(20)
+        for lm in (0, 0.5, 1):
+            np.testing.assert_allclose(
+                mdpsolver.td_solver(self.P, self.r, I, 0.9, lm), self.v)
+            np.testing.assert_allclose(
+                mdpsolver.etd_solver(self.P, self.r, I, 0.9, lm, 1), self.v)
+        np.testing.assert_allclose(
+            mdpsolver.ls_solver(self.P, self.r, I, 0.9), self.v)
+
+    def test_monte_carlo(self):
+        # TD(1) finds the least-squares solution
+        np.testing.assert_allclose(
+            mdpsolver.td_solver(self.P, self.r, self.X, 0.9, 1),
+            mdpsolver.ls_solver(self.P, self.r, self.X, 0.9))
+
+    def test_sparse(self):
+        gm = np.linspace(0.5, 0.9, 20)
+        P, X = sparse.csr_matrix(self.P), sparse.csr_matrix(self.X)
+        np.testing.assert_allclose(mdpsolver.stationary(P),
+                                   mdpsolver.stationary(self.P))
+        np.testing.assert_allclose(
+            mdpsolver.td_solver(P, self.r, X, gm, 0.5),
+            mdpsolver.td_solver(self.P, self.r, self.X, gm, 0.5))
+        np.testing.assert_allclose(
+            mdpsolver.etd_solver(P, self.r, X, gm, 0.5, self.r),
+            mdpsolver.etd_solver(self.P, self.r, self.X, gm, 0.5, self.r))
+
+    def test_singular(self):
+        # with gamma and lambda of one, (I - P) is singular, and the
+        # pseudoinverse gives the minimum-norm solutions, as before
+        P = np.array([[0, 1.0], [1.0, 0]])
+        r, X = np.array([1.0, 0]), np.eye(2)
+        d = mdpsolver.stationary(P)
+        K = np.linalg.pinv(np.eye(2) - P)
+        A = X.T @ np.diag(d) @ K @ (np.eye(2) - P) @ X
+        expected = np.linalg.pinv(A) @ X.T @ np.diag(d) @ K @ r
+        for mat in (P, sparse.csr_matrix(P)):
+            np.testing.assert_allclose(
+                mdpsolver.td_solver(mat, r, X, 1.0, 1.0), expected)
+        np.testing.assert_allclose(mdpsolver.ls_solver(P, r, X, 1.0), expected)
+
+    def test_emphasis(self):
+        # compare with the emphasis computed from the "warp" matrix directly
+        gm, lm, interest = 0.9, 0.5, self.r
+        I = np.eye(20)
+        d = mdpsolver.stationary(self.P)
+        K = np.linalg.inv(I - gm*lm*self.P)
+        P_lm = I - K @ (I - gm*self.P)
+        m = (interest * d) @ np.linalg.inv(I - P_lm)
+        A = self.X.T @ np.diag(m) @ K @ (I - gm*self.P) @ self.X
+        b = self.X.T @ np.diag(m) @ K @ self.r
+        np.testing.assert_allclose(
+            mdpsolver.etd_solver(self.P, self.r, self.X, gm, lm, interest),
+            np.linalg.solve(A, b))
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.P, self.r, self.X = random_mdp(20, 4)
+        self.gm = np.array([0, 0.5, 0.9])
+        self.lm = np.array([0, 0.5, 1])
+
+    def test_td(self):
+        expected = np.array([[mdpsolver.td_solver(self.P, self.r, self.X, g, l)
+                              for l in self.lm] for g in self.gm])
+        for spectral in (True, False):
+            ret = mdpsolver.td_solver_batch(self.P, self.r, self.X,
+                                            self.gm[:, None], self.lm,
+                                            spectral=spectral)
+            self.assertEqual(ret.shape, (3, 3, 4))
+            np.testing.assert_allclose(ret, expected)
+
+    def test_ill_conditioned(self):
+        # nearly defective, so the eigenvectors are nearly parallel
+        P = np.array([[0.5, 0.5, 0], [0, 0.5, 0.5], [1e-14, 0, 1 - 1e-14]])
+        self.assertIsNone(mdpsolver.spectral_decomposition(P))
+        self.assertIsNotNone(mdpsolver.spectral_decomposition(self.P))
+
+    def test_singular(self):
+        P = np.array([[0, 1.0], [1.0, 0]])
+        r, X = np.array([1.0, 0]), np.eye(2)
+        gm = np.array([0.5, 1.0])
+        np.testing.assert_allclose(
+            mdpsolver.td_solver_batch(P, r, X, gm, 1.0),
+            [mdpsolver.td_solver(P, r, X, g, 1.0) for g in gm])
+        np.testing.assert_allclose(
+            mdpsolver.etd_solver_batch(P, r, X, gm, 1.0, 1.0),
+            [mdpsolver.etd_solver(P, r, X, g, 1.0, 1.0) for g in gm])
+
+    def test_etd(self):
+        Xs = [self.X, self.X[:, :2]]
+        for spectral in (True, False):
+            ret = mdpsolver.etd_solver_batch(self.P, self.r, Xs, self.gm,
+                                             self.lm, self.r,
+                                             spectral=spectral)
+            self.assertEqual(len(ret), 2)
+            for X, thetas in zip(Xs, ret):
+                self.assertEqual(thetas.shape, (3, X.shape[1]))
+                for g, l, theta in zip(self.gm, self.lm, thetas):
+                    np.testing.assert_allclose(
+                        theta, mdpsolver.etd_solver(self.P, self.r, X, g, l,
+                                                    self.r))
+
+    def test_sparse(self):
+        ret = mdpsolver.td_solver_batch(sparse.csr_matrix(self.P), self.r,
+                                        self.X, self.gm, 0.5)
+        np.testing.assert_allclose(
+            ret, mdpsolver.td_solver_batch(self.P, self.r, self.X, self.gm, 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
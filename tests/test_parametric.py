@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_parametric
+----------------------------------
+
+Tests for `parametric` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import parametric
+
+
+class TestParametric(unittest.TestCase):
+
+    def test_to_parameter(self):
+        param = parametric.to_parameter(np.array([0.5, 0.9, 0.0]))
+        self.assertIsInstance(param, parametric.ArrayState)
+        self.assertEqual(param(1), 0.9)
+        # dictionaries remain mutable `MapState`s, even with integer keys
+        param = parametric.to_parameter({0: 0.5, 1: 0.9})
+        self.assertIsInstance(param, parametric.MapState)
+        param[1] = 0.8
+        self.assertEqual(param(1.0), 0.8)
+        self.assertIsInstance(parametric.to_parameter(0.9),
+                              parametric.Constant)
+
+    def test_bounds(self):
+        param = parametric.ArrayState([0.5, 0.9, 0.0])
+        for s in (-1, 3, 1.5, None):
+            self.assertRaises(KeyError, param, s)
+        for s in ([-1, 0], [1.7], [0, 3]):
+            self.assertRaises(KeyError, param.batch, s)
+            self.assertRaises(KeyError, param, np.array(s))
+        self.assertEqual(len(param.batch([])), 0)
+
+    def test_batch(self):
+        s, a, sp = np.array([0, 2, 1, 2]), np.zeros(4), np.array([2, 1, 2, 0])
+        values = [0.5, 0.9, 0.0]
+        expected = np.array(values)
+        np.testing.assert_array_equal(parametric.ArrayState(values)(s),
+                                      expected[s])
+        np.testing.assert_array_equal(
+            parametric.ArrayNextState(values).batch(s, a, sp), expected[sp])
+        np.testing.assert_array_equal(parametric.Constant(0.9).batch(s),
+                                      np.full(4, 0.9))
+        # the fallback evaluates the parameter one transition at a time
+        np.testing.assert_array_equal(
+            parametric.MapNextState(enumerate(values)).batch(s, a, sp),
+            expected[sp])
+
+    def test_first_visit(self):
+        param = parametric.ArrayFirstVisit([1.0, 2.0, 3.0])
+        self.assertEqual(param(1), 2.0)
+        np.testing.assert_array_equal(param(np.array([0, 1, 0, 5, 2])),
+                                      [1.0, 0, 0, 0, 3.0])
+        self.assertEqual(param(2), 0)
+        param.reset()
+        reference = parametric.FirstVisit({0: 1.0, 1: 2.0, 2: 3.0})
+        keys = [2, 2, 0, 1, 0]
+        np.testing.assert_array_equal(param.batch(keys),
+                                      [reference(k) for k in keys])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_policy
+----------------------------------
+
+Tests for `policy` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import policy
+import utils
+
+
+class TestRandomStreams(unittest.TestCase):
+
+    def setUp(self):
+        self.dct = {s: {0: 0.2, 1: 0.8} for s in range(3)}
+
+    def choices(self, pol, n=200):
+        return [pol.choose(i % 3, (0, 1)) for i in range(n)]
+
+    def test_seeded(self):
+        a = policy.FixedPolicy(self.dct, rng=1)
+        b = policy.FixedPolicy(self.dct, rng=np.random.default_rng(1))
+        self.assertEqual(self.choices(a), self.choices(b))
+
+    def test_spawned(self):
+        rngs = utils.spawn_rngs(0, 2)
+        a = self.choices(policy.RandomPolicy(rng=rngs[0]))
+        b = self.choices(policy.RandomPolicy(rng=rngs[1]))
+        self.assertNotEqual(a, b)
+        again = self.choices(policy.RandomPolicy(rng=utils.spawn_rngs(0, 2)[0]))
+        self.assertEqual(a, again)
+
+    def test_distribution(self):
+        pol = policy.FixedPolicy(self.dct, rng=0)
+        freq = np.mean(self.choices(pol, 5000))
+        self.assertAlmostEqual(freq, 0.8, delta=0.03)
+
+    def test_block_sample(self):
+        stream = policy.UniformStream(0, block_size=8)
+        first = [stream() for _ in range(5)]
+        rest = stream.sample(10)
+        ref = np.random.default_rng(0).random(8)
+        np.testing.assert_array_equal(first + list(rest[:3]), ref)
+
+
+class TestCompiledPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.fixed = policy.FixedPolicy({'x': {'a': 0.1, 'b': 0.6, 'c': 0.3},
+                                         'y': {'a': 1.0}})
+        self.pol = self.fixed.compile(rng=0)
+
+    def test_probabilities(self):
+        self.assertEqual(self.pol.actions, ['a', 'b', 'c'])
+        for s in ('x', 'y'):
+            np.testing.assert_allclose(
+                self.pol.probabilities(s, ['c', 'a', 'b']),
+                self.fixed.probabilities(s, ['c', 'a', 'b']))
+        self.assertEqual(self.pol.prob('y', 'b'), 0)
+
+    def test_choose(self):
+        counts = {a: 0 for a in self.pol.actions}
+        for _ in range(10000):
+            counts[self.pol.choose('x', self.pol.actions)] += 1
+        self.assertAlmostEqual(counts['a']/10000, 0.1, delta=0.02)
+        self.assertAlmostEqual(counts['b']/10000, 0.6, delta=0.02)
+        self.assertEqual({self.pol.choose('y') for _ in range(100)}, {'a'})
+
+    def test_sample_indices(self):
+        idx = self.pol.sample_indices(np.zeros(20000, dtype=int))
+        freq = np.bincount(idx, minlength=3)/len(idx)
+        np.testing.assert_allclose(freq, [0.1, 0.6, 0.3], atol=0.02)
+        self.assertTrue(np.all(self.pol.sample_indices([1]*100) == 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
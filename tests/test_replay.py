@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_replay
+----------------------------------
+
+Tests for `replay` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import agents
+import algos
+import chicken
+import features
+import policy
+import replay
+import trajectory
+
+from rlbench import rlbench
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.env = chicken.Chicken(5)
+        self.phi = features.Int2Unary(5)
+        self.behavior = policy.FixedPolicy({s: {0: 0.5, 1: 0.5}
+                                            for s in self.env.states})
+        self.target = policy.FixedPolicy({s: {0: 0.9, 1: 0.1}
+                                          for s in self.env.states})
+        self.params = dict(alpha=0.1, gm=0.9, gm_p=0.9, lm=0.5, interest=1)
+
+    def test_matches_online(self):
+        steps = rlbench.run_policy(self.behavior, self.env, 200)
+        agent = agents.OnPolicyAgent(algos.TD(5), self.behavior, self.phi,
+                                     update_params=self.params)
+        for step in steps:
+            agent.update(*step)
+        rep = replay.Replay(steps, self.phi)
+        td = rep.run(algos.TD(5), **self.params)
+        np.testing.assert_allclose(td.theta, agent.theta)
+
+    def test_off_policy(self):
+        steps = rlbench.run_policy_verbose(self.behavior, self.env, 200,
+                                           param_funcs={'gm': 0.9},
+                                           record_probs=True)
+        rep = replay.Replay(steps, self.phi, target=self.target)
+        expected = [0.9/0.5 if ctx['a'] == 0 else 0.1/0.5 for ctx in steps]
+        np.testing.assert_allclose(rep.rho, expected)
+
+        res = rep.run_all({'ETD': (algos.ETD(5), self.params),
+                           'TDC': (algos.TDC(5), dict(self.params, beta=0.01,
+                                                      lm_p=0.5))})
+        self.assertEqual(set(res), {'ETD', 'TDC'})
+
+    def test_rho(self):
+        steps = rlbench.run_policy_verbose(self.behavior, self.env, 50,
+                                           record_probs=True)
+        # the target's probabilities depend on the available actions
+        rep = replay.Replay(steps, self.phi, target=policy.RandomPolicy())
+        np.testing.assert_allclose(rep.rho, 1.0)
+        rep = replay.Replay(steps, self.phi, target=policy.RandomPolicy(),
+                            actions=lambda s: [0, 1, 2, 3])
+        np.testing.assert_allclose(rep.rho, 0.25/0.5)
+        # rho can't be computed from `mu` alone
+        self.assertRaises(ValueError, replay.Replay, steps, self.phi)
+        steps = rlbench.run_policy(self.behavior, self.env, 50)
+        self.assertRaises(ValueError, replay.Replay, steps, self.phi,
+                          target=self.target)
+
+    def test_weights(self):
+        steps = rlbench.run_policy(self.behavior, self.env, 50)
+        rep = replay.Replay(steps, self.phi)
+        thetas = rep.weights(algos.TD(5), [10, 50], **self.params)
+        self.assertEqual(thetas.shape, (2, 5))
+        td = rep.run(algos.TD(5), **self.params)
+        np.testing.assert_allclose(thetas[-1], td.theta)
+
+    def test_memmap(self):
+        path = os.path.join(tempfile.mkdtemp(), 'run')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        trajectory.record_policy(self.behavior, self.env, 100, path,
+                                 param_funcs={'lm': {s: s/10 for s in
+                                                     self.env.states}})
+        reader = trajectory.TrajectoryReader(path)
+        chunk_size = replay.CHUNK_SIZE
+        try:
+            replay.CHUNK_SIZE = 7
+            rep = replay.Replay(reader, self.phi, param_funcs={'gm': 0.9})
+            # the states index themselves, so the columns are used as is
+            self.assertTrue(np.shares_memory(rep.idx, reader['s']))
+            self.assertEqual(rep.params['gm'], 0.9)
+            params = dict(self.params)
+            del params['gm'], params['lm']
+            td = rep.run(algos.TD(5), **params)
+        finally:
+            replay.CHUNK_SIZE = chunk_size
+        expected = replay.Replay(list(reader.steps()), self.phi)
+        lm = [s/10 for s in reader['s']]
+        np.testing.assert_allclose(
+            expected.run(algos.TD(5), **dict(params, gm=0.9, lm=lm)).theta,
+            td.theta)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,8 @@ Tests for `rlbench` module.
 
 import unittest
 
+import numpy as np
+
 from rlbench import rlbench
 
 
@@ -21,5 +23,92 @@ class TestRlbench(unittest.TestCase):
     def test_something(self):
         pass
 
+    def test_eval_schedule(self):
+        self.assertEqual(list(rlbench.eval_schedule(10, every=4)), [4, 8])
+        self.assertEqual(list(rlbench.eval_schedule(3)), [1, 2, 3])
+        steps = rlbench.eval_schedule(10**6, num=20, log=True)
+        self.assertEqual(steps[0], 1)
+        self.assertEqual(steps[-1], 10**6)
+        self.assertTrue(np.all(np.diff(steps) > 0))
+        self.assertRaises(ValueError, rlbench.eval_schedule, 10, every=0)
+        np.testing.assert_array_equal(rlbench.check_schedule([5, 2, 5]),
+                                      [2, 5])
+        for schedule in ([0, 1], [1.5], [[1]]):
+            self.assertRaises(ValueError, rlbench.check_schedule, schedule)
+
+    def test_run_errors(self):
+        import agents, algos, chicken, features, policy
+        env = chicken.Chicken(5)
+        agent = agents.OnPolicyAgent(
+            algos.TD(5), policy.RandomPolicy(), features.Int2Unary(5),
+            update_params=dict(alpha=0.5, gm=0.9, gm_p=0.9, lm=0.0))
+        val_dct = {s: 1.0 for s in env.states}
+        errors = rlbench.run_errors(agent, env, 50, val_dct,
+                                    rlbench.eval_schedule(50, every=10))
+        self.assertEqual(errors.shape, (5,))
+        values = agent.get_values(env.states)
+        expected = np.sqrt(np.mean([(1.0 - v)**2 for v in values.values()]))
+        self.assertAlmostEqual(errors[-1], expected)
+        # unsorted schedules, with repeated steps
+        errors = rlbench.run_errors(agent, env, 50, val_dct, [30, 10, 10])
+        self.assertEqual(errors.shape, (2,))
+        self.assertTrue(np.all(np.isfinite(errors)))
+
+    def test_run_many(self):
+        import agents, algos, chicken, features, policy
+        env = chicken.Chicken(5)
+        unary = features.Int2Unary(5)
+        calls = []
+        def phi(s):
+            calls.append(s)
+            return unary(s)
+        params = dict(alpha=0.1, gm=0.9, gm_p=0.9, lm=0.0)
+        make = lambda: [agents.OnPolicyAgent(algos.TD(5), policy.RandomPolicy(),
+                                             phi, update_params=params)
+                        for i in range(50)]
+        agent_lst = make()
+        ret = rlbench.run_many(agent_lst, policy.RandomPolicy(), env, 20)
+        self.assertEqual(len(calls), 21)
+        # the same updates as without sharing the features
+        expected = make()
+        for agent in expected:
+            for s, a, r, sp in ret['steps']:
+                agent.update(s, a, r, sp)
+        for agent, other in zip(agent_lst, expected):
+            np.testing.assert_allclose(agent.theta, other.theta)
+        # precomputed features
+        del calls[:]
+        table = rlbench.get_features(env.states, unary)
+        rlbench.run_many(make(), policy.RandomPolicy(), env, 20,
+                         features={phi: table})
+        self.assertEqual(calls, [])
+
+    def test_discounted_return(self):
+        rng = np.random.RandomState(0)
+        rewards = rng.rand(100)
+        gammas = rng.rand(100) * (rng.rand(100) > 0.1)
+        expected, G = [], 0
+        for r, gm in zip(rewards[::-1], gammas[::-1]):
+            G = r + gm*G
+            expected.append(G)
+        expected = expected[::-1]
+        for block_size in (1, 7, 128):
+            np.testing.assert_allclose(
+                rlbench.discounted_return(rewards, gammas, block_size),
+                expected)
+        np.testing.assert_allclose(
+            rlbench.discounted_return(rewards, 0.5, block_size=7),
+            rlbench.discounted_return(rewards, np.full(100, 0.5)))
+
+    def test_every_visit_mc(self):
+        steps = [(0, 0, 1.0, 1), (1, 0, 0.0, 0), (0, 0, 2.0, 2)]
+        values = rlbench.every_visit_mc(steps, 0.5)
+        self.assertEqual(values, {0: (1.5 + 2.0)/2, 1: 1.0})
+        values, counts = rlbench.mc_values([0, 1, 0], [1.0, 0.0, 2.0], 0.5,
+                                           num_states=3, block_size=2)
+        np.testing.assert_allclose(values[:2], [1.75, 1.0])
+        self.assertTrue(np.isnan(values[2]))
+        np.testing.assert_array_equal(counts, [2, 1, 0])
+
     def tearDown(self):
         pass
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_streaming
+----------------------------------
+
+Tests for `streaming` module.
+"""
+
+import unittest
+
+import numpy as np
+
+import agents
+import algos
+import chicken
+import features
+import policy
+import streaming
+from rlbench import rlbench
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.env = chicken.Chicken(5)
+        self.steps = rlbench.run_policy(policy.RandomPolicy(), self.env, 500)
+
+    def test_tap(self):
+        ret = streaming.RunningReturn(0.5)
+        steps = list(streaming.tap(iter(self.steps), ret))
+        self.assertEqual(steps, self.steps)
+        self.assertEqual(ret.t, 500)
+        rewards = rlbench.get_rewards(self.steps)
+        self.assertEqual(ret.total, sum(rewards))
+        self.assertAlmostEqual(ret.discounted,
+                               rlbench.discounted_return(rewards, 0.5)[0])
+
+    def test_online_mc(self):
+        gamma = {0: 0.9, 1: 0.0, 2: 0.5, 3: 0.99, 4: 0.8}
+        for gm in (0.9, gamma):
+            mc, = streaming.consume(iter(self.steps), streaming.OnlineMC(gm))
+            expected = rlbench.every_visit_mc(self.steps, gm)
+            self.assertEqual(mc.values.keys(), expected.keys())
+            for s, v in mc.values.items():
+                self.assertAlmostEqual(v, expected[s])
+
+    def test_verbose(self):
+        ctxs = rlbench.iter_policy_verbose(policy.RandomPolicy(), self.env, 50,
+                                           param_funcs={'gm': 0.9})
+        mc, = streaming.consume(ctxs, streaming.OnlineMC(0.9))
+        self.assertEqual(mc.counts.sum(), 50)
+
+    def test_error_tracker(self):
+        def make_agent():
+            return agents.OnPolicyAgent(
+                algos.TD(5), policy.RandomPolicy(), features.Int2Unary(5),
+                update_params=dict(alpha=0.5, gm=0.9, gm_p=0.9, lm=0.0))
+        val_dct = {s: 1.0 for s in self.env.states}
+        schedule = rlbench.eval_schedule(50, every=10)
+
+        np.random.seed(1)
+        expected = rlbench.run_errors(make_agent(), self.env, 50, val_dct,
+                                      schedule)
+        np.random.seed(1)
+        agent = make_agent()
+        agent.bind(self.env)
+        tracker = streaming.ErrorTracker(agent, val_dct, schedule)
+        streaming.consume(rlbench.iter_episode(agent, self.env, 50), tracker)
+        self.assertTrue(tracker.done)
+        np.testing.assert_allclose(tracker.errors, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
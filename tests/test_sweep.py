@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_sweep
+----------------------------------
+
+Tests for `sweep` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import chicken
+import features
+import policy
+import replay
+import sweep
+
+from rlbench import rlbench
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        env = chicken.Chicken(4)
+        phi = features.Int2Unary(4)
+        pol = policy.RandomPolicy()
+        self.replays = {}
+        for seed in range(2):
+            np.random.seed(seed)
+            steps = rlbench.run_policy(pol, env, 100)
+            self.replays[seed] = replay.Replay(steps, phi)
+        self.grid = {'TD': {'alpha': [0.1, 0.05], 'gm': [0.9], 'gm_p': [0.9],
+                            'lm': [0.0, 0.5]}}
+        self.evaluate = (np.eye(4), np.zeros(4))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_pool_matches_serial(self):
+        serial = sweep.Sweep(self.replays, self.grid, schedule=[50, 100],
+                             evaluate=self.evaluate).run(processes=0)
+        self.assertEqual(len(serial), 8)
+        pooled = sweep.Sweep(self.replays, self.grid, schedule=[50, 100],
+                             evaluate=self.evaluate).run(processes=2)
+        self.assertEqual(set(pooled), set(serial))
+        for key in serial:
+            np.testing.assert_allclose(pooled[key]['errors'],
+                                       serial[key]['errors'])
+
+    def test_resume(self):
+        path = os.path.join(self.dir, 'sweep.jsonl')
+        grid = {'TD': dict(self.grid['TD'], alpha=[0.1])}
+        first = sweep.Sweep(self.replays, grid, path).run(processes=0)
+        # simulate an interruption while recording a cell
+        with open(path, 'a') as f:
+            f.write('{"key": ')
+        sw = sweep.Sweep(self.replays, self.grid, path)
+        self.assertEqual(set(sw.completed()), set(first))
+        results = sw.run(processes=0)
+        self.assertEqual(len(results), 8)
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), 9)
+
+    def test_context(self):
+        path = os.path.join(self.dir, 'sweep.jsonl')
+        first = sweep.Sweep(self.replays, self.grid, path,
+                            schedule=[50]).run(processes=0)
+        # results for a different schedule or replay are not reused
+        sw = sweep.Sweep(self.replays, self.grid, path, schedule=[50, 100])
+        self.assertFalse(set(c[0] for c in sw.cells()) & set(first))
+        replays = dict(self.replays)
+        replays[0] = replays[1]
+        sw = sweep.Sweep(replays, self.grid, path, schedule=[50])
+        self.assertEqual(len(set(c[0] for c in sw.cells()) & set(first)), 4)
+
+    def test_bank(self):
+        grid = {'TDBank': {'alpha': [0.1], 'lm': [0.5], 'gm': [0.9],
+                           'gm_p': [0.9]}}
+        results = sweep.Sweep(self.replays, grid).run(processes=0)
+        self.assertEqual(len(results), 2)
+        td = sweep.Sweep(self.replays, {'TD': dict(grid['TDBank'])})
+        for key, result in td.run(processes=0).items():
+            bank = results[key.replace('"TD"', '"TDBank"')]
+            np.testing.assert_allclose(bank['theta'], [result['theta']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_trajectory
+----------------------------------
+
+Tests for `trajectory` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import chicken
+import policy
+import trajectory
+
+
+class TestTrajectory(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'run')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_roundtrip(self):
+        steps = [(0, 1, 0, 1), (1, 0, 2.5, 2), (2, 1, -1, 0)]
+        with trajectory.TrajectoryWriter(self.path, chunk_size=2) as writer:
+            for i, step in enumerate(steps):
+                writer.append(*step, gm=0.9)
+                if i == 1:
+                    writer.end_episode()
+        reader = trajectory.TrajectoryReader(self.path)
+        self.assertEqual(len(reader), 3)
+        self.assertEqual(reader.num_episodes, 2)
+        self.assertEqual(list(reader.steps(chunk_size=2)), steps)
+        np.testing.assert_array_equal(reader['r'], [0, 2.5, -1])
+        np.testing.assert_array_equal(reader['gm'], [0.9]*3)
+        np.testing.assert_array_equal(reader.episode(1)['s'], [2])
+
+    def test_float_params(self):
+        with trajectory.TrajectoryWriter(self.path) as writer:
+            writer.append(0, 0, 1, 1, gm=1, lm=0)
+            writer.append(1, 0, 0, 0, gm=0.9, lm=0.5)
+        reader = trajectory.TrajectoryReader(self.path)
+        np.testing.assert_array_equal(reader['gm'], [1.0, 0.9])
+        np.testing.assert_array_equal(reader['lm'], [0.0, 0.5])
+        self.assertEqual(reader['s'].dtype.kind, 'i')
+
+    def test_record_policy(self):
+        env = chicken.Chicken(4)
+        num = trajectory.record_policy(policy.RandomPolicy(), env, 100,
+                                       self.path, param_funcs={'gm': 0.9})
+        reader = trajectory.TrajectoryReader(self.path)
+        self.assertEqual(len(reader), num)
+        self.assertEqual(reader.environment['name'], 'Chicken')
+        self.assertEqual(reader.environment['num_states'], 4)
+        s, sp = reader['s'], reader['sp']
+        np.testing.assert_array_equal(s[1:], sp[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()